@@ -0,0 +1,72 @@
+"""Aggregation of many sessions: Session objects vs. columns
+
+Usage: python -m benchmarks.bench_columnar [--sessions 50000] [--repeat 10]
+
+Sums the revenue by (year, month, level), and the no-shows by month, from the
+`Session` objects, and from the columns (NumPy, then `array.array`).
+"""
+import argparse
+import time
+
+from openclassrooms import columnar
+from openclassrooms.session import Status
+
+from .mock import make_manager
+
+
+def aggregate_sessions(sessions):
+    revenue = {}
+    held = {}
+    noshows = {}
+    for s in sessions:
+        key = (s.session_date.year, s.session_date.month)
+        level_key = key + (s.level,)
+        revenue[level_key] = revenue.get(level_key, 0) + s.price
+        if s.status_code in (Status.COMPLETED, Status.NOSHOW):
+            held[key] = held.get(key, 0) + 1
+            noshows[key] = noshows.get(key, 0) + s.noshow
+    return revenue, {key: noshows[key] / count for key, count in held.items()}
+
+
+def aggregate_columns(columns):
+    revenue = columns.revenue("year", "month", "level")
+    return revenue, columns.noshow_rate("year", "month")
+
+
+def measure(function, repeat):
+    start = time.perf_counter()
+    for _ in range(repeat):
+        function()
+    return (time.perf_counter() - start) / repeat
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--sessions", type=int, default=50000)
+    parser.add_argument("--repeat", type=int, default=10)
+    args = parser.parse_args()
+
+    manager = make_manager(args.sessions)
+    sessions = list(manager.sessions.values())
+
+    duration = measure(lambda: aggregate_sessions(sessions), args.repeat)
+    print(f"sessions:       {duration * 1e3:7.1f} ms")
+
+    numpy = columnar.numpy
+    for label in ("numpy", "array"):
+        if label == "array":
+            columnar.numpy = None
+        elif numpy is None:
+            continue
+
+        start = time.perf_counter()
+        columns = manager.columns()
+        build = time.perf_counter() - start
+        duration = measure(lambda: aggregate_columns(columns), args.repeat)
+        print(f"columns/{label}: {duration * 1e3:7.1f} ms (built in {build:.2f}s)")
+
+    columnar.numpy = numpy
+
+
+if __name__ == "__main__":
+    main()
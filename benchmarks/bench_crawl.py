@@ -0,0 +1,116 @@
+"""End-to-end month crawl and render, replayed from a cassette
+
+Usage: python -m benchmarks.bench_crawl [--cassette DIR --month N --year Y]
+    [--workers 1,2,5,10] [--latency 0.02] [--throttle 0.05] [--rate-limits]
+
+Without `--cassette`, a cassette of last month is first recorded from the
+local mock of the OC API. Record a real one with
+`python -m openclassrooms.invoice N --record DIR` (a past month: the requests
+of the current month depend on the time of the crawl).
+"""
+import argparse
+import tempfile
+import time
+import tracemalloc
+
+from openclassrooms.adapter import OcAdapter, _now
+from openclassrooms.cassette import Cassette
+from openclassrooms.connector import OcConnector
+from openclassrooms.invoice import Invoice
+
+from .mock import MockConnector
+
+
+class RecordingConnector(MockConnector):
+    """The mock connector, saving its responses to a cassette"""
+
+    def __init__(self, cassette, **kwargs):
+        super().__init__(**kwargs)
+        self.cassette = cassette
+        cassette.save_meta(self.user_id)
+
+    def get(self, url, *args, **kwargs):
+        resp = super().get(url, *args, **kwargs)
+        self.cassette.record("GET", url, resp, kwargs.get("params"))
+        return resp
+
+
+def record_mock(path, month, year):
+    cassette = Cassette(path, mode="record")
+    adapter = OcAdapter(None, None, connector=RecordingConnector(cassette, latency=0))
+    adapter.get_sessions_for_month(month, year)
+
+
+def run(path, month, year, workers, latency, throttle, rate_limits):
+    cassette = Cassette(path, latency=latency, throttle=throttle)
+    connector = OcConnector(
+        cassette=cassette, rate_limits=None if rate_limits else {}, backoff_factor=0
+    )
+    adapter = OcAdapter(None, None, workers=workers, connector=connector)
+
+    tracemalloc.start()
+    start = time.perf_counter()
+    adapter.get_sessions_for_month(month, year)
+    crawl = time.perf_counter() - start
+
+    start = time.perf_counter()
+    Invoice(adapter.manager, crawl).render()
+    render = time.perf_counter() - start
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    return {
+        "sessions": len(adapter.manager.sessions),
+        "requests": cassette.played,
+        "throttled": cassette.throttled,
+        "crawl": crawl,
+        "render": render,
+        "peak": peak,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--cassette", help="recorded cassette (default: the mock)")
+    parser.add_argument("--month", type=int)
+    parser.add_argument("--year", type=int)
+    parser.add_argument("--workers", default="1,2,5,10")
+    parser.add_argument("--latency", type=float, default=0.02)
+    parser.add_argument("--throttle", type=float, default=0.0)
+    parser.add_argument(
+        "--rate-limits", action="store_true", help="keep the client rate limits"
+    )
+    args = parser.parse_args()
+
+    now = _now()
+    month = args.month or now.month - 1 or 12
+    year = args.year or (now.year if month < now.month else now.year - 1)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = args.cassette
+        if path is None:
+            path = tmp
+            record_mock(path, month, year)
+
+        for workers in map(int, args.workers.split(",")):
+            result = run(
+                path,
+                month,
+                year,
+                workers,
+                args.latency,
+                args.throttle,
+                args.rate_limits,
+            )
+            print(
+                f"{workers: >3} workers | {result['sessions']} sessions, "
+                f"{result['requests']} requests ({result['throttled']} throttled) | "
+                f"crawl: {result['crawl']:.3f}s "
+                f"({result['requests'] / result['crawl']:.0f} req/s) | "
+                f"render: {result['render'] * 1e3:.1f} ms | "
+                f"peak: {result['peak'] / 1024:.0f} KiB"
+            )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,93 @@
+"""CPU time of the month crawl: legacy busy-wait loop vs. blocking pipeline
+
+Usage: python -m benchmarks.bench_pipeline [--latency 0.01] [--workers 5]
+"""
+import argparse
+import concurrent.futures
+import time
+from datetime import datetime, timedelta, timezone
+from queue import Queue
+from threading import Event, Thread
+
+from openclassrooms.adapter import OcAdapter, _now
+
+from .mock import MockConnector
+
+
+class LegacyAdapter(OcAdapter):
+    """The adapter as it was, with a consumer spinning on `queue.empty()`"""
+
+    def get_sessions_for_month(self, month):
+        now = _now()
+        after = datetime(now.year, month, 1, 0, 0, tzinfo=timezone.utc)
+        before = after + timedelta(32)
+
+        self.done = Event()
+        student_queue = Queue()
+        session_thread = Thread(
+            target=self._legacy_get_sessions_between,
+            args=(before, after, student_queue, self.manager),
+        )
+        session_thread.start()
+
+        with concurrent.futures.ThreadPoolExecutor(max_workers=5) as executor:
+            while not self.done.is_set():
+                if not student_queue.empty():
+                    student = student_queue.get()
+                    executor.submit(student.update_financed_status, self.connector)
+
+        session_thread.join()
+
+    def _legacy_get_sessions_between(self, before, after, queue, manager):
+        while before > after:
+            sessions = self._get_sessions(params={"before": before})
+            for session in sessions:
+                data = self._process_session(session)
+                session_date = data["session_date"]
+                before = min(before, session_date)
+
+                if session_date.month == after.month and session_date <= _now():
+                    student = manager.add(**data)
+                    if student is not None:
+                        queue.put(student)
+
+        self.done.set()
+
+
+def run(adapter_class, month, latency, workers):
+    connector = MockConnector(latency=latency)
+    adapter = adapter_class(None, None, workers=workers, connector=connector)
+
+    wall, cpu = time.perf_counter(), time.process_time()
+    adapter.get_sessions_for_month(month)
+    wall, cpu = time.perf_counter() - wall, time.process_time() - cpu
+
+    return {
+        "sessions": len(adapter.manager.sessions),
+        "requests": connector.requests,
+        "wall": wall,
+        "cpu": cpu,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--latency", type=float, default=0.01)
+    parser.add_argument("--workers", type=int, default=5)
+    args = parser.parse_args()
+
+    now = _now()
+    # Last month if possible, so the crawl covers a whole month
+    month = now.month - 1 or now.month
+
+    for label, adapter_class in (("legacy", LegacyAdapter), ("pipeline", OcAdapter)):
+        result = run(adapter_class, month, args.latency, args.workers)
+        print(
+            f"{label: <10} {result['sessions']} sessions, "
+            f"{result['requests']} requests | "
+            f"wall: {result['wall']:.3f}s | cpu: {result['cpu']:.3f}s"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,86 @@
+"""Decoding a sessions page: json + dateutil vs. orjson + fromisoformat
+
+Usage: python -m benchmarks.bench_process_session [--sessions 5000]
+"""
+import argparse
+import json
+import time
+
+import dateutil.parser
+
+from openclassrooms import helpers
+from openclassrooms.adapter import OcAdapter
+
+from .mock import make_session
+
+
+def make_page(sessions):
+    """A page of sessions, with the other fields returned by the API"""
+    page = []
+    for index in range(sessions):
+        session = make_session(index, 5, 40)
+        session["recipient"]["profilePicture"] = f"https://example.com/{index}.png"
+        session["project"] = {"id": index % 30, "title": "Some project" * 5}
+        session["videoConference"] = {"url": "https://example.com/room"}
+        page.append(session)
+    return json.dumps(page).encode()
+
+
+def process_legacy(session):
+    """`OcAdapter._process_session` as it was, with dateutil"""
+    project_level = session["projectLevel"]
+    project_level = int(session["projectLevel"]) if project_level is not None else 0
+
+    return {
+        "session_id": session["id"],
+        "session_date": dateutil.parser.parse(session["sessionDate"]),
+        "student_id": session["recipient"]["id"],
+        "student_name": session["recipient"]["displayableName"],
+        "level": project_level,
+        "status": session["status"],
+        "soutenance": session["type"] == "presentation",
+    }
+
+
+def measure(loads, process, page, sessions, repeat=3):
+    """Returns the best decode and process times, per session"""
+    decode = parse = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        decoded = loads(page)
+        decode = min(decode, time.perf_counter() - start)
+
+        start = time.perf_counter()
+        for session in decoded:
+            process(session)
+        parse = min(parse, time.perf_counter() - start)
+
+    return decode / sessions, parse / sessions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--sessions", type=int, default=5000)
+    args = parser.parse_args()
+
+    page = make_page(args.sessions)
+    print(f"{args.sessions} sessions, {len(page)} bytes")
+
+    process = lambda session: OcAdapter._process_session(None, session)
+    runs = [("json + dateutil", json.loads, process_legacy)]
+    runs.append(("json + fromisoformat", json.loads, process))
+    if helpers.orjson is not None:
+        runs.append(("orjson + fromisoformat", helpers.orjson.loads, process))
+    else:
+        print("(orjson is not installed)")
+
+    for label, loads, process in runs:
+        decode, parse = measure(loads, process, page, args.sessions)
+        print(
+            f"{label: <24} per session | decode: {decode * 1e6: >5.2f} µs | "
+            f"process: {parse * 1e6: >5.2f} µs | total: {(decode + parse) * 1e6: >6.2f} µs"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,58 @@
+"""Rendering N invoices: new Jinja environment each time vs. cached one
+
+Usage: python -m benchmarks.bench_render [--invoices 50] [--sessions 150]
+"""
+import argparse
+import time
+
+from jinja2 import Environment, PackageLoader, select_autoescape
+
+from openclassrooms import invoice as invoice_module
+from openclassrooms.invoice import Invoice
+
+from .mock import make_manager
+
+
+def render_uncached(invoice, html):
+    """How `Invoice.render` used to work"""
+    env = Environment(
+        loader=PackageLoader("openclassrooms"),
+        autoescape=select_autoescape(),
+        trim_blocks=True,
+        lstrip_blocks=True,
+    )
+    env.filters["round2dec"] = lambda v: f"{v:.2f}"
+    env.filters["nice_date"] = lambda v: f"{v:%a %d %b %Y @ %H:%M}"
+    template_file = invoice.HTML_TEMPLATE if html else invoice.TEXT_TEMPLATE
+    return env.get_template(template_file).render(**invoice.data)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--invoices", type=int, default=50)
+    parser.add_argument("--sessions", type=int, default=150)
+    args = parser.parse_args()
+
+    invoice = Invoice(make_manager(args.sessions), 0)
+
+    for html in (True, False):
+        start = time.perf_counter()
+        for _ in range(args.invoices):
+            render_uncached(invoice, html)
+        uncached = time.perf_counter() - start
+
+        # Start from an empty environment (the bytecode cache may be warm)
+        invoice_module._environment = None
+        start = time.perf_counter()
+        for _ in range(args.invoices):
+            invoice.render(html)
+        cached = time.perf_counter() - start
+
+        print(
+            f"{('text', 'html')[html]: <5} {args.invoices} invoices | "
+            f"uncached: {uncached:.3f}s | cached: {cached:.3f}s"
+        )
+
+
+if __name__ == "__main__":
+    main()
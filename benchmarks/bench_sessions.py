@@ -0,0 +1,43 @@
+"""Memory per session, and time to filter the sessions of an invoice
+
+Usage: python -m benchmarks.bench_sessions [--sessions 20000]
+"""
+import argparse
+import time
+import tracemalloc
+
+from openclassrooms.invoice import Invoice
+
+from .mock import make_manager
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--sessions", type=int, default=20000)
+    parser.add_argument("--repeat", type=int, default=10)
+    args = parser.parse_args()
+
+    tracemalloc.start()
+    start = time.perf_counter()
+    manager = make_manager(args.sessions)
+    duration = time.perf_counter() - start
+    memory = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+
+    print(
+        f"add:      {duration * 1e6 / args.sessions:.1f} µs/session | "
+        f"{memory / args.sessions:.0f} bytes/session"
+    )
+
+    invoice = Invoice(manager, 0)
+    start = time.perf_counter()
+    for _ in range(args.repeat):
+        sessions = invoice.filtered_sessions
+        total = sum(s.price for group in sessions.values() for s in group)
+    duration = (time.perf_counter() - start) / args.repeat
+
+    print(f"invoice:  {duration * 1e3:.1f} ms (filters + prices, total {total:.2f})")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,57 @@
+"""Loading a month of sessions: pickle vs. JSON lines snapshot
+
+Usage: python -m benchmarks.bench_snapshot [--sessions 150] [--repeat 50]
+"""
+import argparse
+import os
+import pickle
+import tempfile
+import time
+
+from openclassrooms.snapshot import Snapshot, load_snapshot, save_snapshot
+
+from .mock import make_manager
+
+
+def measure(load, repeat):
+    start = time.perf_counter()
+    for _ in range(repeat):
+        load()
+    return (time.perf_counter() - start) / repeat
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--sessions", type=int, default=150)
+    parser.add_argument("--repeat", type=int, default=50)
+    args = parser.parse_args()
+
+    manager = make_manager(args.sessions)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        pickle_path = os.path.join(tmp, "manager.dat")
+        snapshot_path = os.path.join(tmp, "demo.jsonl")
+
+        with open(pickle_path, "wb") as fp:
+            pickle.dump(manager, fp)
+        save_snapshot(manager, snapshot_path)
+
+        def load_pickle():
+            with open(pickle_path, "rb") as fp:
+                return pickle.load(fp)
+
+        results = (
+            ("pickle", pickle_path, load_pickle),
+            ("snapshot", snapshot_path, lambda: load_snapshot(snapshot_path)),
+            ("header", snapshot_path, lambda: Snapshot(snapshot_path).header),
+        )
+        for label, path, load in results:
+            duration = measure(load, args.repeat)
+            print(
+                f"{label: <9} {os.path.getsize(path): >8} bytes | "
+                f"{duration * 1e3: >7.2f} ms"
+            )
+
+
+if __name__ == "__main__":
+    main()
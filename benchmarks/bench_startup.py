@@ -0,0 +1,81 @@
+"""Cold start of the invoice command, with `python -X importtime`
+
+Usage: python -m benchmarks.bench_startup [--repeat 10] [--top 15]
+
+Times a bare interpreter, the import of `openclassrooms.invoice`, and the
+invoice of a snapshot (`--demo`), each in a new process. The slowest imports
+of the invoice module are then listed, as reported by `-X importtime`.
+"""
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+from openclassrooms.snapshot import save_snapshot
+
+from .mock import make_manager
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def run(args):
+    return subprocess.run(
+        [sys.executable, *args], cwd=ROOT, capture_output=True, check=True, text=True
+    )
+
+
+def measure(args, repeat):
+    """Returns the median wall time of the command, in seconds"""
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        run(args)
+        times.append(time.perf_counter() - start)
+    return statistics.median(times)
+
+
+def import_times(code):
+    """Returns the cumulative import time of each module, in microseconds"""
+    stderr = run(["-X", "importtime", "-c", code]).stderr
+    times = {}
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "|" not in line:
+            continue
+        _, cumulative, name = line.split("|")
+        if cumulative.strip().isdigit():
+            times[name.strip()] = int(cumulative)
+    return times
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--repeat", type=int, default=10)
+    parser.add_argument("--top", type=int, default=15)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        demo = os.path.join(tmp, "demo.jsonl")
+        save_snapshot(make_manager(150), demo)
+
+        commands = {
+            "python": ["-c", "pass"],
+            "import": ["-c", "import openclassrooms.invoice"],
+            "demo": ["-m", "openclassrooms.invoice", "--demo", demo, "--text"],
+        }
+        for label, command in commands.items():
+            print(f"{label: >8}: {measure(command, args.repeat) * 1e3:.1f} ms")
+
+    # Without the modules of the interpreter startup (`site`)
+    startup = import_times("pass")
+    times = import_times("import openclassrooms.invoice")
+    times = {name: us for name, us in times.items() if name not in startup}
+    print("\nSlowest imports of openclassrooms.invoice (cumulative):")
+    for name, us in sorted(times.items(), key=lambda item: -item[1])[: args.top]:
+        print(f"{us / 1e3: >8.1f} ms  {name}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,160 @@
+"""Student dashboard parsing: full lxml tree + XPath vs. streaming parser
+
+Usage: python -m benchmarks.bench_student_parser [--repeat 200] [--pages 50]
+    [--handshake 0.03] [--latency 0.01]
+
+Then fetches `--pages` dashboards from a local server, which waits for
+`--handshake` seconds on each new connection (TCP + TLS) and `--latency`
+seconds on each request: closing each response at the financed status, or
+reading the rest of the page to reuse the connection.
+"""
+import argparse
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from io import BytesIO
+from pathlib import Path
+from urllib.parse import urlsplit
+
+import requests
+from lxml import etree
+
+from openclassrooms import student
+from openclassrooms.student import CHUNK_SIZE, FinancedStatusParser, Student
+
+FIXTURES = Path(__file__).parent / "fixtures"
+
+
+def parse_tree(page):
+    """The previous parser: returns the status, and the bytes read"""
+    tree = etree.parse(BytesIO(page), etree.HTMLParser())
+    xpath = tree.xpath("//div[contains(@class, 'mentorshipStudent__details')]/p")
+    return xpath[0].text.strip(), len(page)
+
+
+def parse_stream(page):
+    """The streaming parser, fed like `Student.update_financed_status`"""
+    parser = FinancedStatusParser()
+    read = 0
+    for i in range(0, len(page), CHUNK_SIZE):
+        chunk = page[i : i + CHUNK_SIZE]
+        read += len(chunk)
+        if parser.feed(chunk) is not None:
+            break
+    return parser.close(), read
+
+
+def measure(parse, page, repeat):
+    # The memory is mostly allocated by libxml2, out of reach of tracemalloc:
+    # the bytes read (and parsed) are the best proxy for it
+    status, read = parse(page)
+
+    start = time.perf_counter()
+    for _ in range(repeat):
+        parse(page)
+    duration = (time.perf_counter() - start) / repeat
+
+    return status, read, duration
+
+
+def serve(page, handshake, latency):
+    """Starts a local server answering `page`, with the given delays"""
+    connections = []
+
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def setup(self):
+            connections.append(self.client_address)
+            time.sleep(handshake)
+            super().setup()
+
+        def handle(self):
+            try:
+                super().handle()
+            except ConnectionResetError:
+                # Closed by the client at the financed status
+                pass
+
+        def do_GET(self):
+            time.sleep(latency)
+            self.send_response(200)
+            self.send_header("Content-Length", str(len(page)))
+            self.end_headers()
+            try:
+                self.wfile.write(page)
+            except OSError:
+                # Closed by the client at the financed status
+                pass
+
+        def log_message(self, *args):
+            pass
+
+    httpd = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    threading.Thread(target=httpd.serve_forever, daemon=True).start()
+    return httpd, connections
+
+
+class LocalConnector:
+    """Sends the requests of the student pages to the local server"""
+
+    def __init__(self, port):
+        self.base = f"http://127.0.0.1:{port}"
+        self.session = requests.Session()
+
+    def get(self, url, **kwargs):
+        return self.session.get(self.base + urlsplit(url).path, **kwargs)
+
+
+def fetch_pages(page, pages, handshake, latency, drain_limit):
+    """Returns the time to fetch `pages` dashboards, and the connections"""
+    httpd, connections = serve(page, handshake, latency)
+    connector = LocalConnector(httpd.server_port)
+    student.DRAIN_LIMIT = drain_limit
+
+    start = time.perf_counter()
+    for student_id in range(pages):
+        Student(student_id, "Student").update_financed_status(connector)
+    duration = time.perf_counter() - start
+
+    httpd.shutdown()
+    return duration, len(connections)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--repeat", type=int, default=200)
+    parser.add_argument("--pages", type=int, default=50)
+    parser.add_argument("--handshake", type=float, default=0.03)
+    parser.add_argument("--latency", type=float, default=0.01)
+    args = parser.parse_args()
+
+    for path in sorted(FIXTURES.glob("student_*.html")):
+        page = path.read_bytes()
+        print(f"{path.name} ({len(page)} bytes)")
+
+        for label, parse in (("tree", parse_tree), ("stream", parse_stream)):
+            status, read, duration = measure(parse, page, args.repeat)
+            print(
+                f"  {label: <8} {status!r: <24} read: {read: >7} bytes | "
+                f"{duration * 1e6: >7.1f} µs"
+            )
+
+    page = sorted(FIXTURES.glob("student_*.html"))[0].read_bytes()
+    print(f"{args.pages} pages, handshake {args.handshake}s, latency {args.latency}s")
+
+    drain_limit = student.DRAIN_LIMIT
+    for label, limit in (("close", 0), ("drain", drain_limit)):
+        duration, connections = fetch_pages(
+            page, args.pages, args.handshake, args.latency, limit
+        )
+        print(
+            f"  {label: <8} {duration * 1e3: >7.0f} ms | "
+            f"{duration / args.pages * 1e3: >5.1f} ms/page | "
+            f"{connections} connections"
+        )
+    student.DRAIN_LIMIT = drain_limit
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,135 @@
+"""A local mock of the OC API, used by the benchmarks
+
+The mock connector answers the same URLs as `OcConnector`, with a simulated
+network latency. Sessions are generated on the fly every `step` hours, so the
+sessions API never runs out of pages.
+"""
+import json
+import re
+import threading
+import time
+from datetime import datetime, timedelta, timezone
+
+from openclassrooms.cassette import make_response
+from openclassrooms.constants import API_BASE_URL, STUDENT_URL
+from openclassrooms.session import SessionManager
+
+EPOCH = datetime(2000, 1, 1, tzinfo=timezone.utc)
+
+STATUSES = [
+    "completed",
+    "completed",
+    "completed",
+    "canceled",
+    "marked student as absent",
+    "late canceled",
+    "pending",
+]
+
+STUDENT_PAGE = """<!DOCTYPE html>
+<html><head><title>Student</title></head><body>
+<div class="mentorshipStudent__header">{name}</div>
+<div class="mentorshipStudent__details oc-typography-body1">
+<p>
+{status}
+</p></div>
+{padding}
+</body></html>"""
+
+STUDENT_ID_RE = re.compile(r"/students/(\d+)/dashboard")
+
+
+def make_session(index, step, students):
+    """Returns the JSON of the session number `index`"""
+    session_date = EPOCH + timedelta(hours=step * index)
+    student_id = index % students
+    return {
+        "id": index,
+        "sessionDate": session_date.strftime("%Y-%m-%dT%H:%M:%S+0000"),
+        "recipient": {"id": student_id, "displayableName": f"Student {student_id}"},
+        "projectLevel": str(index % 3 + 1),
+        "status": STATUSES[index % len(STATUSES)],
+        "type": "presentation" if index % 10 == 0 else "mentoring",
+    }
+
+
+def make_student_page(student_id, padding=200):
+    status = "Auto-financé" if student_id % 3 == 0 else "Financé par un tiers"
+    filler = "\n".join(
+        f'<div class="card"><p>Some project information #{i}</p></div>'
+        for i in range(padding)
+    )
+    page = STUDENT_PAGE.format(
+        name=f"Student {student_id}", status=status, padding=filler
+    )
+    return page.encode()
+
+
+def make_manager(sessions, step=5, students=40):
+    """Returns a `SessionManager` filled with synthetic sessions"""
+    manager = SessionManager()
+
+    for index in range(sessions):
+        session_date = EPOCH + timedelta(hours=step * index)
+        student_id = index % students
+        manager.add(
+            session_id=index,
+            session_date=session_date,
+            student_id=student_id,
+            student_name=f"Student {student_id}",
+            level=index % 3 + 1,
+            status=STATUSES[index % len(STATUSES)],
+            soutenance=index % 10 == 0,
+        )
+
+    for student in manager.student_manager.students.values():
+        student.financed = student.student_id % 3 != 0
+
+    return manager
+
+
+class MockConnector:
+    """Drop-in replacement for `OcConnector`, that never leaves the machine"""
+
+    user_id = 1
+
+    def __init__(self, latency=0.01, step=5, students=40, page_size=20):
+        self.latency = latency
+        self.step = step
+        self.students = students
+        self.page_size = page_size
+        self.requests = 0
+        self._lock = threading.Lock()
+
+    def _sessions(self, params):
+        before = datetime.strptime(params["before"], "%Y-%m-%dT%H:%M:%SZ")
+        before = before.replace(tzinfo=timezone.utc)
+        hours = (before - EPOCH).total_seconds() / 3600
+        # Index of the most recent session strictly before `before`
+        last = int(-(-hours // self.step)) - 1
+        first = max(last - self.page_size + 1, 0)
+        return [
+            make_session(i, self.step, self.students)
+            for i in range(last, first - 1, -1)
+        ]
+
+    def get(self, url, *args, **kwargs):
+        with self._lock:
+            self.requests += 1
+        time.sleep(self.latency)
+
+        if url.startswith(API_BASE_URL):
+            content = json.dumps(self._sessions(kwargs.get("params", {}))).encode()
+            return make_response(url, 200, content)
+
+        match = STUDENT_ID_RE.search(url)
+        if match and url == STUDENT_URL.format(match.group(1)):
+            return make_response(url, 200, make_student_page(int(match.group(1))))
+
+        return make_response(url, 404)
+
+    def post(self, *args, **kwargs):
+        raise NotImplementedError
+
+    def close(self):
+        pass
@@ -1,28 +1,82 @@
-import concurrent.futures
 import logging
+import os
 from datetime import datetime, timedelta, timezone
 from queue import Queue
-from threading import Event, Thread
-
-import dateutil.parser
+from threading import Thread
 
+from . import metrics
 from .connector import OcConnector
 from .constants import API_BASE_URL
+from .helpers import json_loads, parse_date
+from .httpcache import CACHE_DIR, HttpCache
+from .pagination import SessionPaginator
 from .session import SessionManager
+from .store import DATABASE_FILE, SessionStore
+from .student import StudentManager
+from .tokens import TokenStore
 
 logger = logging.getLogger(__name__)
 
+# Put on the student queue once the sessions have all been fetched
+_DONE = object()
+
 
 def _now():
     return datetime.now(timezone.utc)
 
 
 class OcAdapter:
-    def __init__(self, username, password, persistent_students=False):
-        self.connector = OcConnector(username, password)
-        self.manager = SessionManager(persistent_students)
+    # Pending sessions more recent than this are fetched again when syncing
+    RECHECK_WINDOW = timedelta(days=7)
+
+    # Pages of sessions before a date more recent than this are not cached:
+    # the first page of the current month is requested up to the time of the
+    # crawl, and never again
+    UNCACHED_WINDOW = timedelta(minutes=1)
+
+    def __init__(
+        self,
+        username,
+        password,
+        persistent_students=False,
+        workers=5,
+        connector=None,
+        incremental=False,
+        data_dir=None,
+        http_cache=False,
+    ):
+        """Constructor
+
+        `workers` is the number of threads fetching the student pages.
+        When `incremental`, the sessions are stored, and a month is only
+        fetched from where the previous crawl stopped.
+
+        The token and the database are kept in `data_dir` (the current
+        directory by default): use one directory per account. With
+        `http_cache`, so are the responses (see `httpcache.HttpCache`).
+        """
+        self.workers = workers
+        data_dir = data_dir or "."
+        # One connection per student thread, and one for the sessions
+        self.connector = connector or OcConnector(
+            username,
+            password,
+            pool_size=workers + 1,
+            token_store=TokenStore.in_directory(data_dir),
+            cache=HttpCache(os.path.join(data_dir, CACHE_DIR)) if http_cache else None,
+        )
+        database = os.path.join(data_dir, DATABASE_FILE)
+        self.manager = SessionManager(
+            student_manager=StudentManager(persistent_students, path=database)
+        )
+        self.session_store = SessionStore(database) if incremental else None
 
-    def _get_sessions(self, params=None):
+    @property
+    def sessions_url(self):
+        return f"{API_BASE_URL}/users/{self.connector.user_id}/sessions"
+
+    def _sessions_params(self, params=None):
+        """Fills in the default parameters of the sessions API"""
         if params is None:
             params = {}
 
@@ -47,43 +101,207 @@ class OcAdapter:
         # Convert the date to the API format
         params["before"] = params["before"].strftime("%Y-%m-%dT%H:%M:%SZ")
 
-        sessions_url = f"{API_BASE_URL}/users/{self.connector.user_id}/sessions"
-        data = self.connector.get(sessions_url, params=params).json()
-        return data
+        return params
+
+    def _get_sessions(self, params=None, cache=True):
+        params = self._sessions_params(params)
+        kwargs = {} if cache else {"cache": False}
+        with metrics.timer("sessions_page_seconds"):
+            resp = self.connector.get(self.sessions_url, params=params, **kwargs)
+        with metrics.timer("sessions_json_seconds"):
+            return json_loads(resp.content)
 
-    def get_sessions_for_month(self, month):
+    def _fetch_page(self, before):
+        """Returns the sessions before a date, as dictionaries"""
+        cache = before <= _now() - self.UNCACHED_WINDOW
+        sessions = self._get_sessions(params={"before": before}, cache=cache)
+        page = []
+        for session in sessions:
+            with metrics.timer("process_session_seconds"):
+                page.append(self._process_session(session))
+        return page
+
+    @staticmethod
+    def _month_bounds(month, year=None):
+        """Returns the (before, after) dates to crawl for a month"""
         now = _now()
 
         if not month:
             month = now.month
 
-        after = datetime(now.year, month, 1, 0, 0, tzinfo=timezone.utc)
-        before = after + timedelta(32)
+        if not year:
+            year = now.year
+
+        after = datetime(year, month, 1, 0, 0, tzinfo=timezone.utc)
+        before = datetime(year + month // 12, month % 12 + 1, 1, tzinfo=timezone.utc)
+        return min(before, now), after
+
+    def _load_month(self, after, manager):
+        """Adds the stored sessions of the month to its manager
+
+        Returns the date the crawl can stop at, and the students that need
+        updating.
+        """
+        if self.session_store is None:
+            return after, []
+
+        synced_until, sessions = self.session_store.load_month(after.year, after.month)
+        metrics.inc("sessions_loaded", len(sessions))
+
+        students = []
+        for data in sessions:
+            student = manager.add(**data)
+            if student is not None:
+                students.append(student)
+
+        if synced_until is None:
+            return after, students
+
+        # Recent pending sessions may have been completed since
+        pending = [s.session_date for s in manager.sessions.values() if s.pending]
+        recheck = max(min(pending, default=synced_until), _now() - self.RECHECK_WINDOW)
+        stop = max(after, min(synced_until, recheck))
+
+        logger.info(f"Loaded {len(sessions)} sessions, syncing from {stop}.")
+        return stop, students
+
+    def _save_month(self, before, after, manager):
+        """Stores the sessions of the month, synced until `before`"""
+        if self.session_store is None or before <= after:
+            return
+
+        sessions = manager.sessions.values()
+        self.session_store.save_month(after.year, after.month, sessions, before)
+
+    def _prepare_crawl(self, managers):
+        """Loads the stored sessions of the months to crawl
+
+        `managers` maps (year, month) to the manager of the month. Returns
+        the dates to crawl between, the students that need updating, and the
+        shards the crawl fills (see `SessionManager.shard`), by month.
+        """
+        bounds = {key: self._month_bounds(key[1], key[0]) for key in managers}
+        before = max(before for before, _ in bounds.values())
+
+        stops = []
+        students = []
+        for key, manager in managers.items():
+            stop, month_students = self._load_month(bounds[key][1], manager)
+            stops.append(stop)
+            students.extend(month_students)
+
+        shards = {key: manager.shard() for key, manager in managers.items()}
+        return before, min(stops), students, shards
+
+    def _finish_crawl(self, before, managers, shards):
+        """Merges the shards, then saves the students and the sessions"""
+        for key, shard in shards.items():
+            managers[key].merge(shard)
+
+        self.student_manager.save()
+
+        for (year, month), manager in managers.items():
+            _, after = self._month_bounds(month, year)
+            self._save_month(before, after, manager)
+
+    @property
+    def student_manager(self):
+        return self.manager.student_manager
+
+    def get_sessions_for_month(self, month, year=None):
+        _, after = self._month_bounds(month, year)
+        self.manager.month = after.month
+        self._crawl({(after.year, after.month): self.manager})
 
-        self.done = Event()
-        student_queue = Queue()
+    def get_sessions_for_months(self, months, year=None):
+        """Fetches several months in one crawl
+
+        Returns a dictionary with a `SessionManager` for each month. The
+        managers share the students of `self.manager`.
+        """
+        keys = []
+        for month in months:
+            _, after = self._month_bounds(month, year)
+            keys.append((after.year, after.month))
+
+        managers = self.get_sessions_by_month(keys)
+
+        return {month: manager for (_, month), manager in managers.items()}
+
+    def get_sessions_by_month(self, keys):
+        """Fetches the months of `keys`, (year, month) tuples, in one crawl
+
+        Returns a dictionary with a `SessionManager` for each (year, month).
+        """
+        managers = {
+            (year, month): SessionManager(
+                student_manager=self.student_manager, month=month
+            )
+            for year, month in keys
+        }
+
+        self._crawl(managers)
+
+        return managers
+
+    def _crawl(self, managers):
+        before, stop, students, shards = self._prepare_crawl(managers)
+
+        # Bounded, so the sessions thread waits when the students lag behind
+        student_queue = Queue(maxsize=2 * self.workers)
+
+        logger.info(f"Starting {self.workers} threads for students...")
+        student_threads = [
+            Thread(
+                target=self._update_students,
+                args=(student_queue,),
+                name=f"students_{i}",
+            )
+            for i in range(self.workers)
+        ]
+        for thread in student_threads:
+            thread.start()
+
+        for student in students:
+            student_queue.put(student)
+
+        errors = []
         session_thread = Thread(
             target=self._get_sessions_between,
-            args=(before, after, student_queue, self.manager),
+            args=(before, stop, student_queue, shards, errors),
             name="sessions",
         )
 
         logger.info("Starting thread for sessions...")
         session_thread.start()
 
-        with concurrent.futures.ThreadPoolExecutor(
-            max_workers=5, thread_name_prefix="students"
-        ) as executor:
-            logger.info("Starting thread pool for students...")
-            while not self.done.is_set():
-                if not student_queue.empty():
-                    student = student_queue.get()
-                    executor.submit(student.update_financed_status, self.connector)
-
         session_thread.join()
         logger.info("Sessions thread terminated.")
 
-        self.manager.student_manager.save()
+        for thread in student_threads:
+            thread.join()
+        logger.info("Students threads terminated.")
+
+        if errors:
+            raise errors[0]
+
+        self._finish_crawl(before, managers, shards)
+
+    def _update_students(self, queue):
+        """Updates the students from the queue until the sessions are done
+
+        Meant to be used in a thread.
+        """
+
+        while True:
+            student = queue.get()
+            if student is _DONE:
+                break
+
+            try:
+                self.student_manager.update_financed_status(student, self.connector)
+            except Exception:
+                logger.exception(f"Cannot update student {student}")
 
     def _process_session(self, session):
         """Take the JSON session information and returns a dictionary"""
@@ -93,8 +311,7 @@ class OcAdapter:
 
         return {
             "session_id": session["id"],
-            # We remove the +0000 at the end of the date
-            "session_date": dateutil.parser.parse(session["sessionDate"]),
+            "session_date": parse_date(session["sessionDate"]),
             "student_id": session["recipient"]["id"],
             "student_name": session["recipient"]["displayableName"],
             "level": project_level,
@@ -102,26 +319,47 @@ class OcAdapter:
             "soutenance": session["type"] == "presentation",
         }
 
-    def _get_sessions_between(self, before, after, queue, manager):
+    def _process_page(self, sessions, managers):
+        """Adds a page of sessions (see `_fetch_page`) to the managers
+
+        `managers` maps (year, month) to the manager of the month: sessions of
+        other months are ignored. Returns the students that need updating
+        (financed status).
+        """
+
+        now = _now()
+        students = []
+        for data in sessions:
+            session_date = data["session_date"]
+            manager = managers.get((session_date.year, session_date.month))
+            if manager is not None and session_date <= now:
+                # Add the session to the manager
+                student = manager.add(**data)
+                # If the student is not "updated", it needs to be fetched
+                if student is not None:
+                    students.append(student)
+
+        return students
+
+    def _get_sessions_between(self, before, after, queue, managers, errors=None):
         """Gets the sessions, and posts to the queue
 
         Meant to be used in a thread. The queue is filled up with students that
-        need updating (financed status)
+        need updating (financed status), followed by one `_DONE` marker per
+        student worker. Exceptions are appended to `errors` if provided.
         """
 
-        while before > after:
-            sessions = self._get_sessions(params={"before": before})
-            for session in sessions:
-                data = self._process_session(session)
-                session_date = data["session_date"]
-                before = min(before, session_date)
-
-                if session_date.month == after.month and session_date <= _now():
-                    # Add the session to the manager
-                    student = manager.add(**data)
-                    # If the student is not "updated", add it to the queue for updating
-                    if student is not None:
-                        queue.put(student)
-
-        self.done.set()
-        return manager
+        try:
+            paginator = SessionPaginator(before, after)
+            for sessions in paginator(self._fetch_page):
+                for student in self._process_page(sessions, managers):
+                    queue.put(student)
+        except Exception as e:
+            if errors is None:
+                raise
+            errors.append(e)
+        finally:
+            for _ in range(self.workers):
+                queue.put(_DONE)
+
+        return managers
@@ -0,0 +1,210 @@
+"""Asyncio counterpart of the adapter
+
+Requires `aiohttp` (`pip install aiohttp`). The login still goes through the
+regular `OcConnector` (and its saved token); the crawl itself then runs on a
+single event loop, with one shared connection pool.
+"""
+import asyncio
+import logging
+
+from . import metrics
+from .adapter import OcAdapter
+from .connector import RETRY_STATUSES
+from .constants import STUDENT_URL
+from .helpers import json_loads
+from .pagination import SessionPaginator
+from .ratelimit import parse_retry_after
+from .student import CHUNK_SIZE, FinancedStatusParser
+
+try:
+    import aiohttp
+except ImportError:  # pragma: no cover
+    aiohttp = None
+
+logger = logging.getLogger(__name__)
+
+
+class AsyncOcConnector:
+    """Makes the HTTP requests with aiohttp
+
+    Use it as an async context manager. The headers, the cookies and the rate
+    limiter are taken from an authenticated `OcConnector`. Responses 429 and
+    5xx are retried up to `retries` times.
+    """
+
+    def __init__(self, connector, concurrency=10, retries=5):
+        if aiohttp is None:
+            raise RuntimeError("aiohttp is required for the asyncio crawler")
+
+        self.connector = connector
+        self.user_id = connector.user_id
+        self.concurrency = concurrency
+        self.retries = retries
+        self.limiter = connector.limiter
+        self.session = None
+        self._semaphore = None
+
+    async def __aenter__(self):
+        self._semaphore = asyncio.Semaphore(self.concurrency)
+        self.session = aiohttp.ClientSession(
+            headers=dict(self.connector.session.headers),
+            cookies=self.connector.session.cookies.get_dict(),
+            connector=aiohttp.TCPConnector(limit=self.concurrency),
+        )
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.session.close()
+
+    async def get(self, url, params=None, parser=None):
+        """Returns the body of the response
+
+        With a `parser` (see `FinancedStatusParser`), the body is fed to it
+        chunk by chunk until it returns a result, and that result is returned.
+        """
+        async with self._semaphore:
+            for attempt in range(self.retries + 1):
+                await self.limiter.acquire_async(url)
+                metrics.inc("http_requests")
+                logger.info(f"-> Accessing {url} (async)")
+                # The token may have been renewed since the session was opened
+                headers = {
+                    "Authorization": self.connector.session.headers["Authorization"]
+                }
+                async with self.session.get(
+                    url, params=params, headers=headers
+                ) as resp:
+                    retry_after = parse_retry_after(resp.headers.get("Retry-After"))
+                    self.limiter.update(url, resp.status, retry_after)
+
+                    if resp.status in RETRY_STATUSES and attempt < self.retries:
+                        logger.warning(f"Retrying GET {url} ({resp.status})")
+                        metrics.inc("http_retries")
+                        await asyncio.sleep(retry_after or 0.5 * 2**attempt)
+                        continue
+
+                    resp.raise_for_status()
+                    if parser is None:
+                        return await resp.read()
+
+                    async for chunk in resp.content.iter_chunked(CHUNK_SIZE):
+                        if parser.feed(chunk) is not None:
+                            break
+                    return parser.close()
+
+    async def get_json(self, url, params=None):
+        return json_loads(await self.get(url, params=params))
+
+
+class AsyncOcAdapter(OcAdapter):
+    """Crawls the sessions and the student pages on one event loop
+
+    `concurrency` is the maximum number of requests in flight; the requests
+    per second are limited by the rate limiter of the `OcConnector`. The
+    sessions end up in the same `SessionManager` as with `OcAdapter`.
+    """
+
+    async_connector_class = AsyncOcConnector
+
+    def __init__(
+        self,
+        username,
+        password,
+        persistent_students=False,
+        concurrency=10,
+        connector=None,
+        incremental=False,
+        data_dir=None,
+    ):
+        super().__init__(
+            username,
+            password,
+            persistent_students=persistent_students,
+            workers=concurrency,
+            connector=connector,
+            incremental=incremental,
+            data_dir=data_dir,
+        )
+        self.concurrency = concurrency
+
+    def _crawl(self, managers):
+        asyncio.run(self.crawl(managers))
+
+    async def crawl(self, managers):
+        """Fetches the months of `managers` (see `OcAdapter._prepare_crawl`)"""
+        before, stop, students, shards = self._prepare_crawl(managers)
+
+        async with self.async_connector_class(
+            self.connector, concurrency=self.concurrency
+        ) as connector:
+            tasks = []
+            # student_id => task of the lookup in flight
+            lookups = {}
+            for student in students:
+                self._lookup_student(connector, student, lookups, tasks)
+
+            paginator = SessionPaginator(before, stop)
+            next_page = None
+            try:
+                if not paginator.done:
+                    next_page = self._prefetch(connector, paginator)
+
+                while next_page is not None:
+                    sessions = paginator.advance(await next_page)
+                    next_page = None
+                    # Fetched while the current page is being processed
+                    if not paginator.done:
+                        next_page = self._prefetch(connector, paginator)
+
+                    for student in self._process_page(sessions, shards):
+                        self._lookup_student(connector, student, lookups, tasks)
+            except Exception:
+                for task in tasks + [next_page]:
+                    if task is not None:
+                        task.cancel()
+                raise
+
+            logger.info(f"Sessions fetched, waiting for {len(tasks)} students...")
+            await asyncio.gather(*tasks)
+
+        self._finish_crawl(before, managers, shards)
+
+    def _prefetch(self, connector, paginator):
+        """Starts fetching the page at the cursor of `paginator`"""
+        page = self._fetch_page_async(connector, paginator.cursor)
+        return asyncio.ensure_future(page)
+
+    async def _fetch_page_async(self, connector, before):
+        params = self._sessions_params({"before": before})
+        # Including the JSON decoding, done by the connector
+        with metrics.timer("sessions_page_seconds"):
+            sessions = await connector.get_json(self.sessions_url, params)
+        return [self._process_session(session) for session in sessions]
+
+    def _lookup_student(self, connector, student, lookups, tasks):
+        """Starts updating a student, unless a lookup is already in flight
+
+        The task is added to `lookups` (by student ID) while in flight, and to
+        `tasks`.
+        """
+        if student.student_id in lookups:
+            metrics.inc("student_lookups_saved")
+            return
+
+        task = asyncio.ensure_future(self._update_student(connector, student))
+        lookups[student.student_id] = task
+        task.add_done_callback(lambda _: lookups.pop(student.student_id, None))
+        tasks.append(task)
+
+    async def _update_student(self, connector, student):
+        if not student.needs_update:
+            return
+
+        student_url = STUDENT_URL.format(student.student_id)
+        try:
+            parser = FinancedStatusParser()
+            with metrics.timer("student_page_seconds"):
+                status = await connector.get(student_url, parser=parser)
+            student.set_financed_status(status, student_url)
+        except Exception:
+            logger.exception(f"Cannot update student {student}")
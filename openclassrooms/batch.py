@@ -0,0 +1,182 @@
+"""Invoices of several mentors, crawled concurrently in one process
+
+Usage: python -m openclassrooms.batch credentials.json [N] [--workers 10]
+
+The credentials file is a JSON list of accounts:
+
+    [{"name": "alice", "username": "alice@example.com", "password": "..."}]
+
+Each account gets its own connector, and its own directory for its token and
+database (`--data-dir/<name>`). The invoices are written to
+`--output-dir/report-<name>-<month>.html`.
+"""
+import argparse
+import json
+import logging
+import os
+import re
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from .adapter import OcAdapter
+from .connector import OcConnector
+from .invoice import LOG_FORMAT, Invoice
+from .tokens import TokenStore
+
+logger = logging.getLogger(__name__)
+
+DATA_DIR = "accounts"
+
+# Threads fetching the student pages, for each account
+ACCOUNT_WORKERS = 5
+
+
+def load_credentials(path):
+    """Returns the accounts of a credentials file, with a name for each"""
+    try:
+        with open(path, "r") as fp:
+            accounts = json.load(fp)
+    except (OSError, ValueError) as e:
+        raise RuntimeError(f"Cannot read the credentials: {e}")
+
+    if not isinstance(accounts, list):
+        raise RuntimeError("The credentials must be a list of accounts")
+
+    names = set()
+    for account in accounts:
+        if not (account.get("username") and account.get("password")):
+            raise RuntimeError("Each account needs a username and a password")
+
+        # The name is used in file names
+        name = account.get("name") or account["username"]
+        account["name"] = re.sub(r"[^\w.@-]", "_", name)
+        if account["name"] in names:
+            raise RuntimeError(f"Duplicate account: {account['name']}")
+        names.add(account["name"])
+
+    return accounts
+
+
+def create_invoice(account, month, html, output_dir, data_dir, slots):
+    """Crawls the sessions of an account, and writes its invoice"""
+    account_dir = os.path.join(data_dir, account["name"])
+    os.makedirs(account_dir, exist_ok=True)
+
+    start = time.time()
+    connector = OcConnector(
+        account["username"],
+        account["password"],
+        pool_size=ACCOUNT_WORKERS + 1,
+        token_store=TokenStore.in_directory(account_dir),
+        auto_refresh=False,
+        slots=slots,
+    )
+    try:
+        adapter = OcAdapter(
+            account["username"],
+            account["password"],
+            persistent_students=True,
+            workers=ACCOUNT_WORKERS,
+            connector=connector,
+            incremental=True,
+            data_dir=account_dir,
+        )
+        adapter.get_sessions_for_month(month)
+    finally:
+        connector.close()
+    end = time.time()
+
+    invoice = Invoice(adapter.manager, end - start)
+    extension = ("txt", "html")[html]
+    path = os.path.join(
+        output_dir, f"report-{account['name']}-{invoice.month}.{extension}"
+    )
+    invoice.write(path, html=html)
+
+    logger.info(f"{account['name']}: {path} ({end - start:.2f}s)")
+    return path
+
+
+def create_invoices(
+    accounts, month=None, html=True, output_dir=".", data_dir=DATA_DIR, workers=10
+):
+    """Creates the invoice of each account, concurrently
+
+    At most `workers` requests are in flight at once, for all the accounts
+    together. Returns the paths of the invoices, and the errors, by account
+    name: an account failing does not stop the others.
+    """
+    os.makedirs(output_dir, exist_ok=True)
+    slots = threading.BoundedSemaphore(workers)
+
+    paths = {}
+    errors = {}
+    with ThreadPoolExecutor(max_workers=max(1, min(len(accounts), workers))) as pool:
+        futures = {
+            pool.submit(
+                create_invoice, account, month, html, output_dir, data_dir, slots
+            ): account["name"]
+            for account in accounts
+        }
+
+        for future in as_completed(futures):
+            name = futures[future]
+            try:
+                paths[name] = future.result()
+            except Exception as e:
+                logger.error(f"{name}: {e}")
+                errors[name] = e
+
+    return paths, errors
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Creates the invoices of mentors")
+    parser.add_argument("credentials", help="JSON file with the accounts")
+    parser.add_argument(
+        "month_number", metavar="N", type=int, nargs="?", help="the month number"
+    )
+    parser.add_argument("--debug", action="store_true")
+    parser.add_argument("--text", action="store_true", default=False)
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=10,
+        help="requests in flight, for all the accounts together",
+    )
+    parser.add_argument("--output-dir", default=".", help="where to write invoices")
+    parser.add_argument(
+        "--data-dir",
+        default=DATA_DIR,
+        help="where to keep the token and database of each account",
+    )
+
+    args = parser.parse_args()
+
+    logging.basicConfig(
+        level=logging.INFO if args.debug else logging.WARNING, format=LOG_FORMAT
+    )
+
+    try:
+        accounts = load_credentials(args.credentials)
+    except RuntimeError as e:
+        print("An error occurred:", e)
+        sys.exit(1)
+
+    paths, errors = create_invoices(
+        accounts,
+        month=args.month_number,
+        html=not args.text,
+        output_dir=args.output_dir,
+        data_dir=args.data_dir,
+        workers=args.workers,
+    )
+
+    for name, path in sorted(paths.items()):
+        print(f"{name}: {path}")
+    for name, error in sorted(errors.items()):
+        print(f"{name}: an error occurred: {error}")
+
+    sys.exit(1 if errors else 0)
@@ -0,0 +1,171 @@
+"""Recording and replay of the HTTP responses, for offline runs and benchmarks
+
+A cassette is a directory: `meta.json` holds the user ID of the recording,
+and each request is saved as `<key>.json` (status and headers) and
+`<key>.body`, the key being a hash of the method, URL and parameters.
+
+When recording, `OcConnector` saves the responses of its GET requests (but
+not the login ones, nor the cookies). When replaying, it does not log in, and
+the responses come from the cassette, with an optional latency and share of
+throttled (429) responses. Only the thread crawler goes through the cassette:
+`AsyncOcAdapter` uses its own HTTP client.
+"""
+import hashlib
+import json
+import os
+import random
+import threading
+import time
+from urllib.parse import urlencode
+
+from requests.models import Response
+from requests.structures import CaseInsensitiveDict
+from urllib3.response import HTTPResponse
+
+from .constants import API_ME_URL, CSRF_URL, TOKEN_URL
+from .helpers import atomic_write
+
+CASSETTE_VERSION = 1
+
+# Requests that are never recorded: they hold credentials and tokens
+AUTH_URLS = (CSRF_URL, TOKEN_URL, API_ME_URL)
+
+# Response headers that are not recorded
+SKIPPED_HEADERS = {"set-cookie", "content-encoding", "transfer-encoding"}
+
+
+def make_response(url, status_code=200, content=b"", headers=None):
+    """Returns a `requests.Response` with the given content"""
+    resp = Response()
+    resp.url = url
+    resp.status_code = status_code
+    resp.headers = CaseInsensitiveDict(headers or {})
+    resp.encoding = "utf-8"
+    resp._content = content
+    resp._content_consumed = True
+    return resp
+
+
+def request_key(method, url, params=None):
+    params = urlencode(sorted((params or {}).items()))
+    return hashlib.sha1(f"{method} {url}?{params}".encode()).hexdigest()
+
+
+class Cassette:
+    """A directory of recorded responses
+
+    `mode` is "record" or "replay". When replaying, each request waits for
+    `latency` seconds, and a share `throttle` (between 0 and 1) of them is
+    first answered with a 429, as OC does when requests come too fast.
+    """
+
+    def __init__(self, path, mode="replay", latency=0, throttle=0, seed=0):
+        if mode not in ("record", "replay"):
+            raise ValueError(f"Unknown cassette mode: {mode}")
+
+        self.path = path
+        self.mode = mode
+        self.latency = latency
+        self.throttle = throttle
+        self.played = 0
+        self.throttled = 0
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self.meta = {}
+
+        if mode == "record":
+            os.makedirs(path, exist_ok=True)
+            return
+
+        try:
+            with open(os.path.join(path, "meta.json"), "r") as fp:
+                self.meta = json.load(fp)
+        except (OSError, ValueError) as e:
+            raise RuntimeError(f"Cannot open the cassette {path}: {e}")
+
+        if self.meta.get("version") != CASSETTE_VERSION:
+            raise RuntimeError(f"Unsupported cassette version: {path}")
+
+    @property
+    def replaying(self):
+        return self.mode == "replay"
+
+    @property
+    def user_id(self):
+        return self.meta.get("user_id")
+
+    def save_meta(self, user_id):
+        self.meta = {
+            "version": CASSETTE_VERSION,
+            "user_id": user_id,
+            "recorded_at": time.time(),
+        }
+        with atomic_write(os.path.join(self.path, "meta.json")) as fp:
+            json.dump(self.meta, fp)
+
+    def _file(self, key, extension):
+        return os.path.join(self.path, f"{key}.{extension}")
+
+    def save(self, method, url, params, status_code, headers, content):
+        key = request_key(method, url, params)
+        data = {
+            "method": method,
+            "url": url,
+            "params": params,
+            "status_code": status_code,
+            "headers": {
+                k: v for k, v in headers.items() if k.lower() not in SKIPPED_HEADERS
+            },
+        }
+
+        with atomic_write(self._file(key, "body"), "wb") as fp:
+            fp.write(content)
+        # Written last: the entry only exists once complete
+        with atomic_write(self._file(key, "json")) as fp:
+            json.dump(data, fp, default=str)
+
+    def record(self, method, url, resp, params=None):
+        """Saves a response (reading its whole content)"""
+        if method != "GET" or url in AUTH_URLS:
+            return
+
+        params = {k: str(v) for k, v in (params or {}).items()}
+        self.save(method, url, params, resp.status_code, resp.headers, resp.content)
+
+    def play(self, method, url, params=None, on_retry=None, before_retry=None):
+        """Returns the recorded response to a request
+
+        `on_retry(method, url, response, error)` and `before_retry(url)` are
+        called for each injected 429, like the callbacks of the retry policy of
+        `OcConnector` for the real ones.
+        """
+        params = {k: str(v) for k, v in (params or {}).items()}
+        key = request_key(method, url, params)
+
+        try:
+            with open(self._file(key, "json"), "r") as fp:
+                data = json.load(fp)
+            with open(self._file(key, "body"), "rb") as fp:
+                content = fp.read()
+        except FileNotFoundError:
+            raise RuntimeError(f"Not in the cassette: {method} {url} {params}")
+
+        with self._lock:
+            self.played += 1
+            throttled = self._random.random() < self.throttle
+            if throttled:
+                self.throttled += 1
+
+        if throttled:
+            if self.latency:
+                time.sleep(self.latency)
+            if on_retry is not None:
+                response = HTTPResponse(status=429, headers={"Retry-After": "0"})
+                on_retry(method, url, response, None)
+            if before_retry is not None:
+                before_retry(url)
+
+        if self.latency:
+            time.sleep(self.latency)
+
+        return make_response(url, data["status_code"], content, data["headers"])
@@ -0,0 +1,282 @@
+"""Columns of the sessions, for aggregations over many months
+
+`SessionColumns` holds one array per field of the sessions (NumPy arrays if
+NumPy is installed, `array.array` otherwise), and sums them by group:
+
+    columns = SessionColumns.from_managers(managers.values())
+    columns.revenue("year", "month", "level")
+
+The columns are a copy of the sessions: build them again once the sessions
+or the financed status of their students changed. They can be exported to
+CSV, and to Parquet with `pyarrow` (`pip install pyarrow`).
+
+Usage: python -m openclassrooms.columnar [--year 2021] [--range 1-12]
+    [--demo FILE] [--csv FILE] [--parquet FILE]
+"""
+import argparse
+import csv
+import logging
+import sys
+from array import array
+
+from .helpers import atomic_write
+from .invoice import LOG_FORMAT, make_adapter, parse_months
+from .session import Status
+from .snapshot import load_snapshot
+
+try:
+    import numpy
+except ImportError:  # pragma: no cover
+    numpy = None
+
+# Name, `array` typecode and NumPy type of each column
+COLUMNS = (
+    ("session_id", "q", "int64"),
+    ("timestamp", "d", "float64"),
+    ("year", "h", "int16"),
+    ("month", "b", "int8"),
+    ("level", "b", "int8"),
+    ("status", "b", "int8"),
+    # 0 or 1
+    ("financed", "b", "int8"),
+    ("soutenance", "b", "int8"),
+    ("student_id", "q", "int64"),
+    ("price", "d", "float64"),
+)
+
+STATUSES = list(Status)
+STATUS_CODES = {status: code for code, status in enumerate(STATUSES)}
+
+
+def _row(session):
+    date = session.session_date
+    return (
+        session.session_id,
+        date.timestamp(),
+        date.year,
+        date.month,
+        session.level,
+        STATUS_CODES[session.status_code],
+        session.financed is True,
+        session.soutenance,
+        session.student.student_id,
+        session.price,
+    )
+
+
+def _column(values, typecode, dtype):
+    if numpy is not None:
+        return numpy.array(values, dtype=dtype)
+    return array(typecode, values)
+
+
+class SessionColumns:
+    """The sessions, as one array per field (see `COLUMNS`)"""
+
+    def __init__(self, columns):
+        self.columns = columns
+
+    @classmethod
+    def from_sessions(cls, sessions):
+        rows = [_row(session) for session in sessions]
+        values = list(zip(*rows)) or [()] * len(COLUMNS)
+        return cls(
+            {
+                name: _column(column, typecode, dtype)
+                for (name, typecode, dtype), column in zip(COLUMNS, values)
+            }
+        )
+
+    @classmethod
+    def from_managers(cls, managers):
+        """Returns the columns of the sessions of several `SessionManager`"""
+        return cls.from_sessions(
+            session for manager in managers for session in manager.copy_sessions()
+        )
+
+    def __len__(self):
+        return len(self.columns["session_id"])
+
+    def __getitem__(self, name):
+        return self.columns[name]
+
+    def mask(self, **values):
+        """Returns which sessions have the given values, e.g. `level=2`
+
+        A value can also be a tuple of values. Statuses are `Status` members.
+        """
+        mask = [True] * len(self) if numpy is None else numpy.ones(len(self), bool)
+
+        for name, value in values.items():
+            value = value if isinstance(value, tuple) else (value,)
+            if name == "status":
+                value = tuple(STATUS_CODES[status] for status in value)
+
+            column = self.columns[name]
+            if numpy is not None:
+                mask &= numpy.isin(column, value)
+            else:
+                mask = [m and v in value for m, v in zip(mask, column)]
+
+        return mask
+
+    def group_by(self, *keys, value=None, where=None):
+        """Sums the column `value` (or counts the sessions) by the `keys` columns
+
+        `where` is a mask (see `mask()`) of the sessions to include. Returns a
+        dictionary from the tuples of the values of `keys` to the totals,
+        sorted by key.
+        """
+        if numpy is None:
+            return self._group_by_python(keys, value, where)
+
+        key_columns = [self.columns[key] for key in keys]
+        weights = self.columns[value] if value else None
+        if where is not None:
+            key_columns = [column[where] for column in key_columns]
+            weights = weights[where] if weights is not None else None
+        size = len(self) if where is None else int(numpy.count_nonzero(where))
+
+        # One code per combination of the values of the keys
+        codes = numpy.zeros(size, dtype="int64")
+        uniques = []
+        for column in key_columns:
+            values, inverse = numpy.unique(column, return_inverse=True)
+            codes = codes * len(values) + inverse.reshape(-1)
+            uniques.append(values.tolist())
+
+        groups, inverse = numpy.unique(codes, return_inverse=True)
+        totals = numpy.bincount(inverse.reshape(-1), weights, len(groups))
+
+        result = {}
+        for code, total in zip(groups.tolist(), totals.tolist()):
+            key = []
+            for values in reversed(uniques):
+                code, index = divmod(code, len(values))
+                key.append(values[index])
+            result[tuple(reversed(key))] = total
+
+        return result
+
+    def _group_by_python(self, keys, value, where):
+        size = len(self)
+        rows = zip(*(self.columns[key] for key in keys)) if keys else [()] * size
+        values = self.columns[value] if value else [1] * size
+        where = [True] * size if where is None else where
+
+        totals = {}
+        for key, v, included in zip(rows, values, where):
+            if included:
+                totals[key] = totals.get(key, 0) + v
+
+        return dict(sorted(totals.items()))
+
+    def revenue(self, *keys):
+        """Returns the sum of the prices, by `keys`"""
+        return self.group_by(*keys, value="price")
+
+    def noshow_rate(self, *keys):
+        """Returns the share of no-shows among the held sessions, by `keys`"""
+        held = self.group_by(
+            *keys, where=self.mask(status=(Status.COMPLETED, Status.NOSHOW))
+        )
+        noshows = self.group_by(*keys, where=self.mask(status=Status.NOSHOW))
+        return {key: noshows.get(key, 0) / count for key, count in held.items()}
+
+    def financed_ratio(self, *keys):
+        """Returns the share of sessions with a financed student, by `keys`"""
+        counts = self.group_by(*keys)
+        financed = self.group_by(*keys, value="financed")
+        return {key: financed[key] / count for key, count in counts.items()}
+
+    def _export(self):
+        """Returns the columns to export, with the names of the statuses"""
+        columns = dict(self.columns)
+        columns["status"] = [STATUSES[code].value for code in self.columns["status"]]
+        return columns
+
+    def to_csv(self, path):
+        """Writes the sessions to a CSV file, with a header"""
+        columns = self._export()
+        rows = zip(*(list(column) for column in columns.values()))
+
+        with atomic_write(path) as fp:
+            writer = csv.writer(fp)
+            writer.writerow(columns)
+            writer.writerows(rows)
+
+    def to_parquet(self, path):
+        """Writes the sessions to a Parquet file (requires pyarrow)"""
+        try:
+            import pyarrow
+            import pyarrow.parquet
+        except ImportError:
+            raise RuntimeError("pyarrow is required for the Parquet export")
+
+        table = pyarrow.table(
+            {
+                name: list(column) if numpy is None else column
+                for name, column in self._export().items()
+            }
+        )
+        with atomic_write(path, "wb") as fp:
+            pyarrow.parquet.write_table(table, fp)
+
+
+def print_summary(columns, file=sys.stdout):
+    """Prints the revenue, no-show rate and financed ratio of each month"""
+    revenue = columns.revenue("year", "month")
+    noshows = columns.noshow_rate("year", "month")
+    financed = columns.financed_ratio("year", "month")
+    counts = columns.group_by("year", "month")
+
+    print("Month   | Sessions | Revenue  | No-shows | Financed", file=file)
+    for year, month in counts:
+        key = (year, month)
+        print(
+            f"{year}-{month:02} | {counts[key]: >8} | {revenue[key]: >8.2f} | "
+            f"{noshows.get(key, 0): >8.1%} | {financed[key]: >8.1%}",
+            file=file,
+        )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Aggregates the sessions by month")
+    parser.add_argument("--year", type=int, help="year of the sessions")
+    parser.add_argument(
+        "--range",
+        dest="months",
+        type=parse_months,
+        default=list(range(1, 13)),
+        help="months of the year, e.g. 1-6 (default: all)",
+    )
+    parser.add_argument("--demo", metavar="FILE", help="use a snapshot instead")
+    parser.add_argument("--csv", metavar="FILE", help="export the sessions to CSV")
+    parser.add_argument(
+        "--parquet", metavar="FILE", help="export the sessions to Parquet"
+    )
+    parser.add_argument("--workers", type=int, default=5)
+    parser.add_argument("--debug", action="store_true")
+    args = parser.parse_args()
+
+    logging.basicConfig(
+        level=logging.INFO if args.debug else logging.WARNING, format=LOG_FORMAT
+    )
+
+    try:
+        if args.demo:
+            managers = [load_snapshot(args.demo)]
+        else:
+            adapter = make_adapter(args.workers)
+            managers = adapter.get_sessions_for_months(args.months, args.year).values()
+
+        columns = SessionColumns.from_managers(managers)
+        print_summary(columns)
+
+        if args.csv:
+            columns.to_csv(args.csv)
+        if args.parquet:
+            columns.to_parquet(args.parquet)
+    except (OSError, RuntimeError) as e:
+        print("An error occurred:", e)
+        sys.exit(1)
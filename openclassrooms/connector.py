@@ -1,42 +1,206 @@
 """Connector module."""
-import json
 import logging
-import pickle
+import threading
 import time
-from datetime import datetime, timedelta
 
 import requests
 from requests.adapters import HTTPAdapter
 from requests.packages.urllib3.util.retry import Retry
 
+from . import metrics
 from .constants import API_ME_URL, CSRF_URL, TOKEN_URL
+from .ratelimit import RateLimiter, parse_retry_after
+from .tokens import TokenStore, token_expiry
 
 logger = logging.getLogger(__name__)
 
+# Retried responses: throttling, and server errors
+RETRY_STATUSES = [429, 500, 502, 503, 504]
+
+HEADERS = {"User-Agent": "Google Chrome"}
+
+# The token is renewed this many seconds before it expires
+REFRESH_MARGIN = 300
+# Delay before trying again when the renewal failed
+REFRESH_RETRY = 60
+
+
+class _Retry(Retry):
+    """Retry policy that reports each retry to callbacks
+
+    `on_retry(method, url, response, error)` is called when a request is to be
+    retried, and `before_retry(url)` once the backoff has been slept, right
+    before the request is sent again.
+    """
+
+    on_retry = None
+    before_retry = None
+
+    def new(self, **kwargs):
+        retry = super().new(**kwargs)
+        retry.on_retry = self.on_retry
+        retry.before_retry = self.before_retry
+        return retry
+
+    def increment(self, method=None, url=None, response=None, error=None, **kwargs):
+        pool = kwargs.get("_pool")
+        if pool is not None:
+            url = f"{pool.scheme}://{pool.host}{url}"
+        if self.on_retry is not None:
+            self.on_retry(method, url, response, error)
+        return super().increment(method, url, response, error, **kwargs)
+
+    def sleep(self, response=None):
+        super().sleep(response)
+        if self.before_retry is not None and self.history:
+            self.before_retry(self.history[-1].url)
+
+
+class _CountingAdapter(HTTPAdapter):
+    """Adapter reporting each TCP connection it opens to a callback
+
+    urllib3 reuses the connection objects of its pools: a dropped connection
+    is opened again by the same object, so `pool.num_connections` misses it.
+    """
+
+    def __init__(self, on_connect, **kwargs):
+        self.on_connect = on_connect
+        super().__init__(**kwargs)
+
+    def init_poolmanager(self, *args, **kwargs):
+        super().init_poolmanager(*args, **kwargs)
+        classes = self.poolmanager.pool_classes_by_scheme
+        self.poolmanager.pool_classes_by_scheme = {
+            scheme: self._counting_pool(pool_class)
+            for scheme, pool_class in classes.items()
+        }
+
+    def _counting_pool(self, pool_class):
+        on_connect = self.on_connect
+
+        class Connection(pool_class.ConnectionCls):
+            def connect(self):
+                on_connect()
+                super().connect()
+
+        class Pool(pool_class):
+            ConnectionCls = Connection
+
+        return Pool
+
+
+class _Session(requests.Session):
+    """Session whose token can be switched while other threads use it
+
+    The headers and the cookies of the session are merged into each request
+    under `token_lock`: a request gets either the old token and cookies, or
+    the new ones.
+    """
+
+    def __init__(self):
+        super().__init__()
+        self.token_lock = threading.Lock()
+
+    def prepare_request(self, request):
+        with self.token_lock:
+            return super().prepare_request(request)
+
 
 class OcConnector:
-    def __init__(self, username=None, password=None):
-        """Constructor"""
+    def __init__(
+        self,
+        username=None,
+        password=None,
+        pool_size=10,
+        retries=5,
+        backoff_factor=0.5,
+        timeout=(5, 30),
+        rate_limits=None,
+        token_store=None,
+        auto_refresh=True,
+        slots=None,
+        cassette=None,
+        cache=None,
+    ):
+        """Constructor
+
+        `pool_size` is the number of connections kept alive for each host: it
+        should match the number of threads using the connector. Requests are
+        retried with an exponential backoff (honouring `Retry-After`), and
+        `timeout` is the (connect, read) timeout of each request.
+
+        `rate_limits` maps base URLs to their maximum number of requests per
+        second (see `ratelimit.DEFAULT_RATES`), shared by all the threads.
+
+        The token is shared with the other processes through `token_store`
+        (see `tokens.TokenStore`). With `auto_refresh`, it is renewed in the
+        background shortly before it expires.
+
+        `slots` is a semaphore shared by several connectors (e.g. one per
+        account), to cap the number of requests they have in flight. The slot
+        of a `stream=True` request is held until its response is closed.
+
+        With a `cassette` (see `cassette.Cassette`), the responses are either
+        recorded, or replayed without logging in nor going online.
+
+        With a `cache` (see `httpcache.HttpCache`), the GET responses are
+        served from it while fresh, and revalidated with conditional requests
+        once stale. A request with `cache=False` bypasses it.
+        """
         self._access_token = None
-
-        # HTTP strategy: retry on 429
-        retry_strategy = Retry(
-            total=3, status_forcelist=[429], method_whitelist=["HEAD", "GET", "OPTIONS"]
+        self.user_id = None
+        self.expires = None
+        self.username = username
+        self.password = password
+        self.token_store = token_store or TokenStore()
+        self._refresh_timer = None
+        self.timeout = timeout
+        self.slots = slots
+        self.cassette = cassette
+        self.cache = cache
+        self.limiter = RateLimiter(rate_limits)
+        self.retry_count = 0
+        self.connection_count = 0
+        self._lock = threading.Lock()
+
+        # HTTP strategy: retry on 429 and server errors
+        retry_strategy = _Retry(
+            total=retries,
+            backoff_factor=backoff_factor,
+            status_forcelist=RETRY_STATUSES,
+            allowed_methods=["HEAD", "GET", "OPTIONS"],
+            respect_retry_after_header=True,
+            raise_on_status=False,
+        )
+        retry_strategy.on_retry = self._on_retry
+        retry_strategy.before_retry = self._before_retry
+        adapter = _CountingAdapter(
+            self._on_connect,
+            pool_connections=4,
+            pool_maxsize=pool_size,
+            max_retries=retry_strategy,
         )
-        adapter = HTTPAdapter(max_retries=retry_strategy)
-        self.session = requests.Session()
+        self.session = _Session()
         self.session.mount("https://", adapter)
         self.session.mount("http://", adapter)
+        self.session.headers.update(HEADERS)
 
-        self.session = requests.Session()
-        self.session.headers.update({"User-Agent": "Google Chrome"})
-
-        if not self.load_token():
-            self._authenticate(username, password)
-            self.save_token()
+        if cassette is not None and cassette.replaying:
+            self.access_token = "replay"
+            self.user_id = cassette.user_id
+            logger.info("!! Replaying the cassette.")
+            return
 
+        with metrics.timer("login_seconds"):
+            self.login()
         logger.info("!! Logged in.")
 
+        if cassette is not None:
+            cassette.save_meta(self.user_id)
+
+        if auto_refresh and username is not None:
+            self._schedule_refresh()
+
     @property
     def access_token(self):
         return self._access_token
@@ -44,49 +208,99 @@ class OcConnector:
     @access_token.setter
     def access_token(self, val):
         """Updates the requests headers when setting the access token"""
-        self._access_token = val
-        self.session.headers.update({"Authorization": "Bearer {}".format(val)})
+        with self.session.token_lock:
+            self._access_token = val
+            self.session.headers.update({"Authorization": "Bearer {}".format(val)})
+
+    def _set_token(self, token, cookies):
+        """Switches to another token and its cookies, in one step"""
+        with self.session.token_lock:
+            self._access_token = token
+            self.session.headers.update({"Authorization": "Bearer {}".format(token)})
+            self.session.cookies = cookies
 
     def save_token(self):
-        with open("token.json", "w") as fp:
-            expires = datetime.now() + timedelta(seconds=3500)
-            data = {
-                "token": self.access_token,
-                "user_id": self.user_id,
-                "expires": expires.isoformat(),
-            }
-            json.dump(data, fp)
-
-        with open("cookies.dat", "wb") as fp:
-            pickle.dump(self.session.cookies, fp)
-
-    def load_token(self):
-        try:
-            with open("token.json", "r") as fp:
-                data = json.load(fp)
+        self.expires = token_expiry(self.access_token, self.session.cookies)
+        self.token_store.save(
+            self.access_token, self.user_id, self.expires, self.session.cookies
+        )
 
-                if datetime.fromisoformat(data["expires"]) < datetime.now():
-                    raise FileNotFoundError
+    def load_token(self, margin=0):
+        """Loads the saved token, if still valid for `margin` seconds"""
+        data = self.token_store.load(margin)
+        if data is None:
+            return False
 
-                self.access_token = data["token"]
-                self.user_id = data["user_id"]
+        self._set_token(data["token"], data["cookies"])
+        self.user_id = data["user_id"]
+        self.expires = data["expires"]
+        return True
 
-            with open("cookies.dat", "rb") as fp:
-                self.session.cookies = pickle.load(fp)
+    def login(self, margin=REFRESH_MARGIN):
+        """Uses the saved token, or logs in and saves the new token
 
-            return True
-        except FileNotFoundError:
-            return False
+        Only one process logs in at a time: the others wait for the lock, and
+        then load the token it saved.
+        """
+        if self.load_token(margin):
+            metrics.inc("token_cache_hits")
+            return
+
+        with self.token_store.lock():
+            if self.load_token(margin):
+                metrics.inc("token_cache_hits")
+                return
+
+            metrics.inc("token_cache_misses")
+            with metrics.timer("authenticate_seconds"):
+                if not self._authenticate(self.username, self.password):
+                    raise RuntimeError("Authentication failed")
+            self.save_token()
+
+    def _schedule_refresh(self, delay=None):
+        if delay is None:
+            delay = max(0, self.expires - REFRESH_MARGIN - time.time())
+
+        self._refresh_timer = threading.Timer(delay, self._refresh)
+        self._refresh_timer.daemon = True
+        self._refresh_timer.start()
+
+    def _refresh(self):
+        """Renews the token, from the timer thread
+
+        OC has no endpoint to renew a token: unless another process already
+        did, this is a full login (CSRF token, credentials, user ID). It runs
+        on a session of its own, so the requests of the other threads go on
+        with the current token meanwhile.
+        """
+        try:
+            # Reuses the token of another process only if it is newer
+            self.login(REFRESH_MARGIN + REFRESH_RETRY)
+        except Exception as e:
+            logger.warning(f"Could not renew the token ({e})")
+            self._schedule_refresh(REFRESH_RETRY)
+        else:
+            logger.info("!! Token renewed.")
+            self._schedule_refresh()
+
+    def _login_session(self):
+        """A new session to log in with, on the same connection pools"""
+        session = requests.Session()
+        session.headers.update(HEADERS)
+        for prefix, adapter in self.session.adapters.items():
+            session.mount(prefix, adapter)
+        return session
 
     def _authenticate(self, username, password):
         """
-        Tries to authenticate.
-        Raises RuntimeError if it fails.
+        Tries to authenticate, on a session of its own, and then switches to
+        the new token. Returns False if it fails.
         """
+        session = self._login_session()
 
         # CSRF token
         logger.info("-> Fetching CSRF token...")
-        resp = self.session.get(CSRF_URL)
+        resp = self.get(CSRF_URL, session=session)
         data = resp.json()
         csrf = data["csrf"]
 
@@ -103,29 +317,155 @@ class OcConnector:
         time.sleep(0.2)
 
         # Post data
-        self.session.post(TOKEN_URL, data=data)
+        self.post(TOKEN_URL, data=data, session=session)
 
         # We did not find the `access_token` cookie. :sad:
-        if "access_token" not in self.session.cookies.get_dict():
+        if "access_token" not in session.cookies.get_dict():
             return False
 
-        # Update the token
-        self.access_token = self.session.cookies["access_token"]
+        token = session.cookies["access_token"]
+        session.headers.update({"Authorization": "Bearer {}".format(token)})
+        user_data = self.get(API_ME_URL, session=session).json()
 
-        user_data = self.session.get(API_ME_URL).json()
+        # Update the token
+        self._set_token(token, session.cookies)
         self.user_id = user_data["id"]
 
         logger.info(f" <- Got user ID: {self.user_id} - OK!")
 
         return True
 
-    def get(self, url, *args, **kwargs):
+    def _on_connect(self):
+        with self._lock:
+            self.connection_count += 1
+        metrics.inc("http_connections")
+
+    def _on_retry(self, method, url, response, error):
+        with self._lock:
+            self.retry_count += 1
+        metrics.inc("http_retries")
+
+        if response is None:
+            logger.warning(f"Retrying {method} {url} ({error})")
+            return
+
+        retry_after = parse_retry_after(response.headers.get("Retry-After"))
+        self.limiter.update(url, response.status, retry_after)
+        logger.warning(f"Retrying {method} {url} ({response.status})")
+
+    def _before_retry(self, url):
+        # The retries made by urllib3 take their token too
+        self.limiter.acquire(url)
+
+    def _request(self, method, url, **kwargs):
+        kwargs.setdefault("timeout", self.timeout)
+
+        if self.slots is None:
+            return self._send(method, url, **kwargs)
+
+        if not kwargs.get("stream"):
+            with self.slots:
+                return self._send(method, url, **kwargs)
+
+        # The body is read after `_send` returns: the slot is released when the
+        # response is closed
+        self.slots.acquire()
+        try:
+            resp = self._send(method, url, **kwargs)
+        except BaseException:
+            self.slots.release()
+            raise
+
+        close = resp.close
+
+        def release():
+            # Closing the response again does not release the slot again
+            resp.close = close
+            try:
+                close()
+            finally:
+                self.slots.release()
+
+        resp.close = release
+        return resp
+
+    def _send(self, method, url, cache=True, session=None, **kwargs):
+        replaying = self.cassette is not None and self.cassette.replaying
+        cacheable = (
+            cache
+            and self.cache is not None
+            and not replaying
+            and method == "GET"
+            and self.cache.max_age(url) is not None
+        )
+
+        entry = None
+        if cacheable:
+            headers = kwargs.get("headers")
+            entry = self.cache.lookup(url, kwargs.get("params"), headers)
+            if entry is not None and self.cache.is_fresh(entry):
+                return self.cache.hit(entry)
+            if entry is not None:
+                kwargs["headers"] = dict(headers or {}, **self.cache.validators(entry))
+
+        self.limiter.acquire(url)
+        metrics.inc("http_requests")
+
+        if replaying:
+            resp = self.cassette.play(
+                method,
+                url,
+                kwargs.get("params"),
+                on_retry=self._on_retry,
+                before_retry=self._before_retry,
+            )
+        else:
+            resp = (session or self.session).request(method, url, **kwargs)
+            if self.cassette is not None:
+                self.cassette.record(method, url, resp, kwargs.get("params"))
+
+        retry_after = parse_retry_after(resp.headers.get("Retry-After"))
+        self.limiter.update(url, resp.status_code, retry_after)
+
+        if entry is not None and resp.status_code == 304:
+            resp.close()
+            return self.cache.not_modified(entry, resp)
+        if cacheable:
+            self.cache.store(url, kwargs.get("params"), kwargs.get("headers"), resp)
+
+        return resp
+
+    @property
+    def stats(self):
+        """Counters of the retries, and of the new / reused connections"""
+        requests_count = 0
+        for adapter in set(self.session.adapters.values()):
+            pools = adapter.poolmanager.pools
+            for key in pools.keys():
+                requests_count += pools[key].num_requests
+
+        with self._lock:
+            connections = self.connection_count
+        stats = {
+            "requests": requests_count,
+            "retries": self.retry_count,
+            "new_connections": connections,
+            "reused_connections": requests_count - connections,
+        }
+        if self.cache is not None:
+            stats["cache"] = self.cache.stats
+
+        return stats
+
+    def get(self, url, **kwargs):
         params_str = ",".join([f"{k}={v}" for k, v in kwargs.get("params", {}).items()])
         logger.info(f"-> Accessing {url} ({params_str})")
-        return self.session.get(url, *args, **kwargs)
+        return self._request("GET", url, **kwargs)
 
-    def post(self, *args, **kwargs):
-        return self.session.post(*args, **kwargs)
+    def post(self, url, **kwargs):
+        return self._request("POST", url, **kwargs)
 
     def close(self):
+        if self._refresh_timer is not None:
+            self._refresh_timer.cancel()
         self.session.close()
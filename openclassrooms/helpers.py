@@ -1,4 +1,13 @@
+import json
 import os
+import tempfile
+from contextlib import contextmanager
+from datetime import datetime
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover
+    orjson = None
 
 
 def get_username_password():
@@ -9,3 +18,63 @@ def get_username_password():
         raise RuntimeError("No credentials provided!")
 
     return username, password
+
+
+def json_loads(content):
+    """Decodes JSON (bytes or str), with orjson if it is installed"""
+    if orjson is not None:
+        return orjson.loads(content)
+    return json.loads(content)
+
+
+def parse_date(value):
+    """Parses a date of the API, such as `2021-03-01T10:00:00+0000`
+
+    `datetime.fromisoformat` is much faster than dateutil, but (before Python
+    3.11) it needs a colon in the UTC offset, and no `Z`. Other formats still
+    go through dateutil.
+    """
+    text = value
+    if text.endswith("Z"):
+        text = text[:-1] + "+00:00"
+    elif len(text) > 5 and text[-5] in "+-" and text[-4:].isdigit():
+        text = f"{text[:-2]}:{text[-2:]}"
+
+    try:
+        return datetime.fromisoformat(text)
+    except ValueError:
+        import dateutil.parser
+
+        return dateutil.parser.parse(value)
+
+
+@contextmanager
+def atomic_write(path, mode="w"):
+    """Opens a temporary file, that replaces `path` once written
+
+    Readers of `path` see either the previous or the new content, never a
+    partial file. Nothing is replaced if an exception is raised.
+    """
+    path = os.fspath(path)
+    directory = os.path.dirname(os.path.abspath(path))
+    fd, tmp_path = tempfile.mkstemp(dir=directory, prefix=".tmp-")
+
+    try:
+        with os.fdopen(fd, mode) as fp:
+            yield fp
+            fp.flush()
+            os.fsync(fp.fileno())
+
+        # mkstemp creates the file readable by its owner only
+        try:
+            os.chmod(tmp_path, os.stat(path).st_mode)
+        except FileNotFoundError:
+            os.chmod(tmp_path, 0o644)
+
+        os.replace(tmp_path, path)
+    except BaseException:
+        try:
+            os.unlink(tmp_path)
+        except FileNotFoundError:
+            pass
+        raise
@@ -0,0 +1,189 @@
+"""Cache of the HTTP responses, revalidated with conditional requests
+
+A cache is a directory: each response is saved as `<key>.json` (status,
+headers and validators) and `<key>.body`, the key being a hash of the URL,
+the parameters and the `Range` header. Only the URLs with a freshness policy
+are cached: each policy is a URL prefix, and the number of seconds its
+responses are used without asking the server.
+
+Once stale, a response is revalidated: `OcConnector` sends its `ETag` and
+`Last-Modified` date (`If-None-Match`, `If-Modified-Since`), and a 304 is
+answered from the cache. The cache holds the pages of one account: keep it in
+the directory of the account, next to its token.
+"""
+import hashlib
+import json
+import os
+import threading
+import time
+from urllib.parse import urlencode
+
+from requests.structures import CaseInsensitiveDict
+
+from . import metrics
+from .cassette import AUTH_URLS, SKIPPED_HEADERS, make_response
+from .constants import API_BASE_URL, BASE_URL
+from .helpers import atomic_write
+
+CACHE_DIR = "http-cache"
+CACHE_VERSION = 1
+
+# (URL prefix, seconds a response is fresh): the student pages rarely change,
+# the sessions change with each new session
+DEFAULT_POLICIES = (
+    (BASE_URL + "/fr/mentorship/students/", 7 * 24 * 3600),
+    (API_BASE_URL + "/users/", 300),
+)
+
+
+def cache_key(url, params=None, headers=None):
+    params = urlencode(sorted((params or {}).items()))
+    page = (headers or {}).get("Range", "")
+    return hashlib.sha1(f"{url}?{params}#{page}".encode()).hexdigest()
+
+
+class HttpCache:
+    """A directory of responses, with a freshness policy per URL prefix"""
+
+    def __init__(self, path=CACHE_DIR, policies=DEFAULT_POLICIES):
+        self.path = path
+        self.policies = policies
+        self.hits = 0
+        self.revalidated = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        os.makedirs(path, exist_ok=True)
+
+    def max_age(self, url):
+        """Returns how long the responses of `url` are fresh, or None"""
+        if url in AUTH_URLS:
+            return None
+
+        for prefix, max_age in self.policies:
+            if url.startswith(prefix):
+                return max_age
+
+        return None
+
+    def _file(self, key, extension):
+        return os.path.join(self.path, f"{key}.{extension}")
+
+    def lookup(self, url, params=None, headers=None):
+        """Returns the cached entry of a request, or None"""
+        if self.max_age(url) is None:
+            return None
+
+        params = {k: str(v) for k, v in (params or {}).items()}
+        key = cache_key(url, params, headers)
+        try:
+            with open(self._file(key, "json"), "r") as fp:
+                entry = json.load(fp)
+            with open(self._file(key, "body"), "rb") as fp:
+                entry["content"] = fp.read()
+        except (OSError, ValueError):
+            return None
+
+        if entry.get("version") != CACHE_VERSION:
+            return None
+
+        entry["key"] = key
+        return entry
+
+    def is_fresh(self, entry):
+        return time.time() - entry["stored_at"] < self.max_age(entry["url"])
+
+    @staticmethod
+    def validators(entry):
+        """Returns the headers of a conditional request for the entry"""
+        headers = {}
+        if entry["etag"]:
+            headers["If-None-Match"] = entry["etag"]
+        if entry["last_modified"]:
+            headers["If-Modified-Since"] = entry["last_modified"]
+        return headers
+
+    def _count(self, name, entry=None):
+        with self._lock:
+            setattr(self, name, getattr(self, name) + 1)
+        metrics.inc(f"http_cache_{name}")
+        if entry is not None:
+            metrics.inc("http_cache_bytes_saved", len(entry["content"]))
+
+    def _response(self, entry):
+        return make_response(
+            entry["url"], entry["status_code"], entry["content"], entry["headers"]
+        )
+
+    def hit(self, entry):
+        """Returns the response of a fresh entry"""
+        self._count("hits", entry)
+        return self._response(entry)
+
+    def not_modified(self, entry, resp):
+        """Returns the response of an entry the server answered a 304 for
+
+        The entry is fresh again, with the new validators if any.
+        """
+        self._count("revalidated", entry)
+
+        headers = CaseInsensitiveDict(entry["headers"])
+        for name in ("ETag", "Last-Modified"):
+            if name in resp.headers:
+                headers[name] = resp.headers[name]
+        entry["headers"] = dict(headers.items())
+        self._save_entry(entry, time.time())
+
+        return self._response(entry)
+
+    def store(self, url, params, headers, resp):
+        """Saves a response (reading its whole content), if it can be cached"""
+        self._count("misses")
+
+        cache_control = resp.headers.get("Cache-Control", "").lower()
+        if resp.status_code != 200 or "no-store" in cache_control:
+            return
+
+        params = {k: str(v) for k, v in (params or {}).items()}
+        key = cache_key(url, params, headers)
+        entry = {
+            "key": key,
+            "url": url,
+            "status_code": resp.status_code,
+            "headers": {
+                k: v
+                for k, v in resp.headers.items()
+                if k.lower() not in SKIPPED_HEADERS
+            },
+        }
+
+        with atomic_write(self._file(key, "body"), "wb") as fp:
+            fp.write(resp.content)
+        self._save_entry(entry, time.time())
+
+    def _save_entry(self, entry, stored_at):
+        headers = CaseInsensitiveDict(entry["headers"])
+        data = {
+            "version": CACHE_VERSION,
+            "url": entry["url"],
+            "status_code": entry["status_code"],
+            "headers": entry["headers"],
+            "etag": headers.get("ETag"),
+            "last_modified": headers.get("Last-Modified"),
+            "stored_at": stored_at,
+        }
+        # Written last: the entry only exists once complete
+        with atomic_write(self._file(entry["key"], "json")) as fp:
+            json.dump(data, fp)
+        entry.update(data)
+
+    @property
+    def stats(self):
+        """Counters of the responses, and share served without a full download"""
+        with self._lock:
+            total = self.hits + self.revalidated + self.misses
+            return {
+                "hits": self.hits,
+                "revalidated": self.revalidated,
+                "misses": self.misses,
+                "hit_rate": (self.hits + self.revalidated) / total if total else None,
+            }
@@ -1,13 +1,68 @@
 import argparse
 import logging
+import os
+import sys
+import threading
 import time
 from datetime import datetime
 from pathlib import Path
 
-from jinja2 import Environment, PackageLoader, select_autoescape
+from . import metrics
+from .helpers import atomic_write, get_username_password
+from .snapshot import DEMO_FILE, load_snapshot, save_snapshot
 
-from .adapter import OcAdapter
-from .helpers import get_username_password
+logger = logging.getLogger(__name__)
+
+
+# Directory of the bytecode of the templates (the temporary directory by
+# default): keep it where the next processes can read it (see
+# `compile_templates()`)
+TEMPLATE_CACHE_DIR = os.environ.get("OC_TEMPLATE_CACHE")
+
+_environment = None
+_environment_lock = threading.Lock()
+
+
+def get_environment():
+    """Returns the Jinja environment of the invoices, built on first use
+
+    The environment keeps the compiled templates in memory, and their bytecode
+    in a FileSystemBytecodeCache (in `TEMPLATE_CACHE_DIR`), so that the next
+    processes don't compile them again either.
+    """
+    global _environment
+
+    with _environment_lock:
+        if _environment is None:
+            # Imported here: the module is imported before every run
+            from jinja2 import (
+                Environment,
+                FileSystemBytecodeCache,
+                PackageLoader,
+                select_autoescape,
+            )
+
+            env = Environment(
+                loader=PackageLoader("openclassrooms"),
+                autoescape=select_autoescape(),
+                trim_blocks=True,
+                lstrip_blocks=True,
+                bytecode_cache=FileSystemBytecodeCache(TEMPLATE_CACHE_DIR),
+                # The templates don't change while running
+                auto_reload=False,
+            )
+            env.filters["round2dec"] = lambda v: f"{v:.2f}"
+            env.filters["nice_date"] = lambda v: f"{v:%a %d %b %Y @ %H:%M}"
+            _environment = env
+
+    return _environment
+
+
+def compile_templates():
+    """Compiles the templates into the bytecode cache, e.g. in a Docker image"""
+    env = get_environment()
+    for name in env.list_templates():
+        env.get_template(name)
 
 
 class Invoice:
@@ -19,9 +74,9 @@ class Invoice:
     HTML_TEMPLATE = "invoice.html"
     TEXT_TEMPLATE = "invoice.txt"
 
-    def __init__(self, adapter, duration):
-        self.manager = adapter.manager
-        self.month = adapter.manager.month
+    def __init__(self, manager, duration):
+        self.manager = manager
+        self.month = manager.month
         self.duration = duration
 
     @property
@@ -37,21 +92,38 @@ class Invoice:
         }
         return data
 
+    # Template chunks joined into each write when streaming (not characters):
+    # 16 chunks of an HTML invoice make about 6 KB
+    BUFFER_SIZE = 16
+
     def print(self, html=True):
-        print(self.render(html))
+        self.stream(sys.stdout, html)
+        print()
 
-    def render(self, html=True):
-        env = Environment(
-            loader=PackageLoader("openclassrooms"),
-            autoescape=select_autoescape(),
-            trim_blocks=True,
-            lstrip_blocks=True,
-        )
-        env.filters["round2dec"] = lambda v: f"{v:.2f}"
-        env.filters["nice_date"] = lambda v: f"{v:%a %d %b %Y @ %H:%M}"
+    def _template(self, html):
         template_file = self.HTML_TEMPLATE if html else self.TEXT_TEMPLATE
-        tpl = env.get_template(template_file)
-        return tpl.render(**self.data)
+        return get_environment().get_template(template_file)
+
+    def render(self, html=True):
+        with metrics.timer("render_seconds"):
+            return self._template(html).render(**self.data)
+
+    def generate(self, html=True):
+        """Renders the invoice piece by piece (e.g. for an HTTP response)"""
+        stream = self._template(html).stream(**self.data)
+        stream.enable_buffering(self.BUFFER_SIZE)
+        return stream
+
+    def stream(self, fp, html=True):
+        """Writes the invoice to the file object `fp`, without building it"""
+        with metrics.timer("render_seconds"):
+            for chunk in self.generate(html):
+                fp.write(chunk)
+
+    def write(self, path, html=True):
+        """Writes the invoice to the file at `path`, replaced atomically"""
+        with atomic_write(path) as fp:
+            self.stream(fp, html)
 
     @property
     def af_students(self):
@@ -96,30 +168,170 @@ class Invoice:
         return output
 
 
-def print_invoice(month=None, html=True):
+def make_adapter(
+    workers=5, use_asyncio=False, cassette=None, http_cache=False, data_dir=None
+):
+    """Returns the adapter of the account in the environment
+
+    With a `cassette`, the requests are recorded or replayed, and nothing is
+    cached (so that the same requests are made each time). `http_cache` keeps
+    the responses of the thread crawler (see `httpcache`).
+
+    The token, the database and the cache are kept in `data_dir` (the current
+    directory by default).
+    """
+    # Imported here, with `requests`: creating a demo invoice needs neither
+    from .adapter import OcAdapter
+    from .connector import OcConnector
+
+    if data_dir is not None:
+        os.makedirs(data_dir, exist_ok=True)
+
+    if cassette is not None:
+        username = password = None
+        if not cassette.replaying:
+            username, password = get_username_password()
+
+        connector = OcConnector(
+            username, password, pool_size=workers + 1, cassette=cassette
+        )
+        return OcAdapter(username, password, workers=workers, connector=connector)
+
     username, password = get_username_password()
 
+    if use_asyncio:
+        from .aio import AsyncOcAdapter
+
+        return AsyncOcAdapter(
+            username,
+            password,
+            persistent_students=True,
+            concurrency=workers,
+            incremental=True,
+            data_dir=data_dir,
+        )
+
+    return OcAdapter(
+        username,
+        password,
+        persistent_students=True,
+        workers=workers,
+        incremental=True,
+        data_dir=data_dir,
+        http_cache=http_cache,
+    )
+
+
+def print_invoice(
+    month=None,
+    html=True,
+    workers=5,
+    use_asyncio=False,
+    output=None,
+    snapshot=None,
+    cassette=None,
+    http_cache=False,
+    data_dir=None,
+):
+    """Creates the invoice of a month
+
+    The invoice is written to the file `output` if provided, or printed. The
+    sessions are also saved to the file `snapshot` if provided (see `--demo`).
+    """
     start = time.time()
-    adapter = OcAdapter(username, password, persistent_students=True)
+    adapter = make_adapter(workers, use_asyncio, cassette, http_cache, data_dir)
     adapter.get_sessions_for_month(month)
     end = time.time()
+    logger.info(f"Connector: {adapter.connector.stats}")
+    metrics.LoggingSink().emit()
+
+    if snapshot is not None:
+        save_snapshot(adapter.manager, snapshot)
+
+    invoice = Invoice(adapter.manager, end - start)
+
+    if output is None:
+        invoice.print(html=html)
+    else:
+        invoice.write(output, html=html)
+
+
+def print_invoices(
+    months,
+    year=None,
+    html=True,
+    workers=5,
+    use_asyncio=False,
+    output_dir=None,
+    cassette=None,
+    http_cache=False,
+    data_dir=None,
+):
+    """Creates the invoices of several months, from a single crawl
+
+    The invoices are written to `output_dir` (as `report-<month>.html`) if
+    provided, or printed one after the other.
+    """
+    start = time.time()
+    adapter = make_adapter(workers, use_asyncio, cassette, http_cache, data_dir)
+    managers = adapter.get_sessions_for_months(months, year)
+    end = time.time()
+    logger.info(f"Connector: {adapter.connector.stats}")
+    metrics.LoggingSink().emit()
 
-    invoice = Invoice(adapter, end - start)
+    for month, manager in managers.items():
+        invoice = Invoice(manager, end - start)
 
-    invoice.print(html=html)
+        if output_dir is None:
+            invoice.print(html=html)
+            continue
 
+        path = Path(output_dir) / f"report-{month}.{('txt', 'html')[html]}"
+        invoice.write(path, html=html)
 
-def demo_invoice(html=True):
-    start = time.time()
-    import pickle
 
-    with open("manager.dat", "rb") as fp:
-        manager = pickle.load(fp)
+def parse_months(value):
+    """Parses a month number, or a range of months such as `1-12`"""
+    first, _, last = value.partition("-")
+    try:
+        months = list(range(int(first), int(last or first) + 1))
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"invalid range of months: {value}")
+
+    if not months or months[0] < 1 or months[-1] > 12:
+        raise argparse.ArgumentTypeError(f"invalid range of months: {value}")
+
+    return months
+
+
+def select_months(months=None, year=None, month=None):
+    """Returns the months of `--range` / `--year`, up to the current month
+
+    Defaults to `month`, or else to all the months of the year. The months of
+    the current year (or of no year) that have not begun are left out.
+    """
+    now = datetime.now()
+    if months is None:
+        months = [month] if month else list(range(1, 13))
+
+    if year is None or year == now.year:
+        months = [m for m in months if m <= now.month]
+
+    return months
+
+
+def demo_invoice(html=True, output=None, path=DEMO_FILE):
+    """Creates the invoice of a snapshot (see `--save-demo`), offline"""
+    start = time.time()
+    manager = load_snapshot(path)
     end = time.time()
 
     invoice = Invoice(manager, end - start)
 
-    invoice.print(html=html)
+    if output is None:
+        invoice.print(html=html)
+    else:
+        invoice.write(output, html=html)
 
 
 LOG_FORMAT = "%(levelname)s:%(module)s [%(threadName)s]: %(msg)s"
@@ -133,24 +345,154 @@ if __name__ == "__main__":
 
     parser.add_argument("--debug", action="store_true")
     parser.add_argument("--text", action="store_true", default=False)
-    parser.add_argument("--demo", action="store_true", default=False)
+    parser.add_argument(
+        "--demo",
+        nargs="?",
+        const=DEMO_FILE,
+        metavar="FILE",
+        help=f"create the invoice of a snapshot (default: {DEMO_FILE})",
+    )
+    parser.add_argument(
+        "--save-demo", metavar="FILE", help="save the sessions of the month to FILE"
+    )
+    parser.add_argument(
+        "--workers", type=int, default=5, help="threads fetching the student pages"
+    )
+    parser.add_argument(
+        "--range",
+        dest="months",
+        type=parse_months,
+        help="months to create the invoices for, e.g. 1-12 (one crawl)",
+    )
+    parser.add_argument(
+        "--year", type=int, help="year of the invoices (all its months by default)"
+    )
+    parser.add_argument(
+        "--output", help="write the invoice to this file (replaced atomically)"
+    )
+    parser.add_argument(
+        "--output-dir", help="write the invoices of --range/--year to this directory"
+    )
+    parser.add_argument(
+        "--asyncio",
+        dest="use_asyncio",
+        action="store_true",
+        default=False,
+        help="crawl with asyncio (requires aiohttp)",
+    )
+
+    parser.add_argument(
+        "--record", metavar="DIR", help="record the responses to a cassette"
+    )
+    parser.add_argument(
+        "--replay", metavar="DIR", help="replay the responses of a cassette, offline"
+    )
+
+    parser.add_argument(
+        "--data-dir",
+        default=os.environ.get("OC_DATA_DIR", "."),
+        help="keep the token, the database and the cache in this directory "
+        "(default: $OC_DATA_DIR, or the current directory)",
+    )
+    parser.add_argument(
+        "--http-cache",
+        action="store_true",
+        help="keep the responses, and revalidate them (not with --asyncio)",
+    )
+
+    parser.add_argument(
+        "--metrics", metavar="FILE", help="write the metrics of the stages to FILE"
+    )
+    parser.add_argument(
+        "--profile",
+        nargs="?",
+        const="invoice.prof",
+        metavar="FILE",
+        help="profile the run: save the cProfile stats to FILE (invoice.prof), "
+        "and print them with the metrics",
+    )
 
     args = parser.parse_args()
 
+    if args.http_cache and args.use_asyncio:
+        parser.error("--http-cache does not apply to the asyncio crawler")
+
+    if args.months is not None or args.year is not None:
+        months = select_months(args.months, args.year, args.month_number)
+        if not months:
+            parser.error("the months requested have not begun yet")
+        if len(months) > 1 and args.output_dir is None and not args.text:
+            parser.error("several HTML invoices need --output-dir (or --text)")
+
     process_html = not args.text
 
     if args.demo:
-        demo_invoice(not args.text)
-        import sys
-
+        try:
+            demo_invoice(not args.text, output=args.output, path=args.demo)
+        except (OSError, RuntimeError) as e:
+            print("An error occurred:", e)
+            sys.exit(1)
         sys.exit(0)
 
+    profiler = None
+    if args.profile:
+        import cProfile
+
+        profiler = cProfile.Profile()
+        profiler.enable()
+
     try:
         log_level = logging.WARNING
         if args.debug:
             log_level = logging.INFO
 
         logging.basicConfig(level=log_level, format=LOG_FORMAT)
-        print_invoice(args.month_number, html=process_html)
+
+        cassette = None
+        if args.record or args.replay:
+            from .cassette import Cassette
+
+        if args.record:
+            cassette = Cassette(args.record, mode="record")
+        elif args.replay:
+            cassette = Cassette(args.replay, mode="replay")
+
+        if args.months is None and args.year is None:
+            print_invoice(
+                args.month_number,
+                html=process_html,
+                workers=args.workers,
+                use_asyncio=args.use_asyncio,
+                output=args.output,
+                snapshot=args.save_demo,
+                cassette=cassette,
+                http_cache=args.http_cache,
+                data_dir=args.data_dir,
+            )
+        else:
+            print_invoices(
+                months,
+                year=args.year,
+                html=process_html,
+                workers=args.workers,
+                use_asyncio=args.use_asyncio,
+                output_dir=args.output_dir,
+                cassette=cassette,
+                http_cache=args.http_cache,
+                data_dir=args.data_dir,
+            )
     except RuntimeError as e:
         print("An error occurred:", e)
+        sys.exit(1)
+    finally:
+        if args.metrics:
+            metrics.JsonFileSink(args.metrics).emit()
+
+        if profiler is not None:
+            import pstats
+
+            profiler.disable()
+            profiler.dump_stats(args.profile)
+            print("\n".join(metrics.format_summary()), file=sys.stderr)
+            stats = pstats.Stats(profiler, stream=sys.stderr)
+            stats.sort_stats("cumulative").print_stats(25)
@@ -0,0 +1,167 @@
+"""Counters and timings of the stages of the crawl and of the invoice
+
+The stages record their metrics in `REGISTRY` with `inc()`, `observe()` and
+`timer()`:
+
+    with metrics.timer("sessions_page_seconds"):
+        ...
+
+The registry can then be written to a sink: the log (`LoggingSink`), a JSON
+file (`JsonFileSink`), or the Prometheus text format (`prometheus_text`,
+served by the server on `/metrics`).
+"""
+import bisect
+import json
+import logging
+import threading
+import time
+from contextlib import contextmanager
+
+from .helpers import atomic_write
+
+logger = logging.getLogger(__name__)
+
+# Upper bounds of the histogram buckets, in seconds
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+# Prefix of the Prometheus metric names
+PREFIX = "oc_"
+
+
+class Histogram:
+    """Count, sum, min, max and cumulative buckets of observed values"""
+
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.count = 0
+        self.sum = 0
+        self.min = None
+        self.max = None
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+        self.min = value if self.min is None else min(self.min, value)
+        self.max = value if self.max is None else max(self.max, value)
+
+    def summary(self):
+        return {
+            "count": self.count,
+            "sum": self.sum,
+            "mean": self.sum / self.count if self.count else None,
+            "min": self.min,
+            "max": self.max,
+        }
+
+
+class Registry:
+    """Thread-safe collection of counters and histograms"""
+
+    def __init__(self):
+        self.counters = {}
+        self.histograms = {}
+        self._lock = threading.Lock()
+
+    def inc(self, name, value=1):
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + value
+
+    def observe(self, name, value):
+        with self._lock:
+            histogram = self.histograms.get(name)
+            if histogram is None:
+                histogram = self.histograms[name] = Histogram()
+            histogram.observe(value)
+
+    @contextmanager
+    def timer(self, name):
+        """Observes the duration of the block (also for coroutines)"""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - start)
+
+    def summary(self):
+        with self._lock:
+            return {
+                "counters": dict(self.counters),
+                "histograms": {
+                    name: histogram.summary()
+                    for name, histogram in self.histograms.items()
+                },
+            }
+
+    def reset(self):
+        with self._lock:
+            self.counters.clear()
+            self.histograms.clear()
+
+
+REGISTRY = Registry()
+
+inc = REGISTRY.inc
+observe = REGISTRY.observe
+timer = REGISTRY.timer
+
+
+def format_summary(registry=REGISTRY):
+    """Returns one line of text per metric"""
+    summary = registry.summary()
+    lines = [f"{name}: {value}" for name, value in sorted(summary["counters"].items())]
+
+    for name, h in sorted(summary["histograms"].items()):
+        lines.append(
+            f"{name}: {h['count']} in {h['sum']:.3f}s "
+            f"(mean {h['mean'] * 1e3:.2f} ms, max {h['max'] * 1e3:.2f} ms)"
+        )
+
+    return lines
+
+
+class LoggingSink:
+    """Logs one line per metric"""
+
+    def __init__(self, log=logger, level=logging.INFO):
+        self.log = log
+        self.level = level
+
+    def emit(self, registry=REGISTRY):
+        for line in format_summary(registry):
+            self.log.log(self.level, line)
+
+
+class JsonFileSink:
+    """Writes the summary of the metrics to a JSON file"""
+
+    def __init__(self, path):
+        self.path = path
+
+    def emit(self, registry=REGISTRY):
+        with atomic_write(self.path) as fp:
+            json.dump(registry.summary(), fp, indent=2, sort_keys=True)
+
+
+def prometheus_text(registry=REGISTRY):
+    """Returns the metrics in the Prometheus text exposition format"""
+    lines = []
+
+    with registry._lock:
+        for name, value in sorted(registry.counters.items()):
+            name = f"{PREFIX}{name}_total"
+            lines += [f"# TYPE {name} counter", f"{name} {value}"]
+
+        for name, histogram in sorted(registry.histograms.items()):
+            name = PREFIX + name
+            lines.append(f"# TYPE {name} histogram")
+            cumulative = 0
+            for bound, count in zip(histogram.buckets, histogram.counts):
+                cumulative += count
+                lines.append(f'{name}_bucket{{le="{bound}"}} {cumulative}')
+            lines.append(f'{name}_bucket{{le="+Inf"}} {histogram.count}')
+            lines.append(f"{name}_sum {histogram.sum}")
+            lines.append(f"{name}_count {histogram.count}")
+
+    return "\n".join(lines) + "\n"
@@ -0,0 +1,85 @@
+"""Walk of the sessions API, from the most recent sessions backwards
+
+The API returns the sessions strictly before the `before` date (to the
+second), most recent first. Paging by the oldest date of each page loses the
+sessions sharing that date which did not fit in the page, and never ends if a
+page does not move the date. `SessionPaginator` handles both.
+"""
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+
+logger = logging.getLogger(__name__)
+
+ONE_SECOND = timedelta(seconds=1)
+
+
+class SessionPaginator:
+    """Cursor over the pages of sessions, from `before` back to `after`
+
+    The next page starts one second after the oldest session of the current
+    one, so that the sessions sharing its date are fetched again (and
+    de-duplicated by ID). The cursor always moves back by at least one second,
+    and the walk stops on an empty page, or when the cursor reaches `after`:
+    it always ends. Sessions are the dictionaries of `OcAdapter._process_session`.
+
+    Sessions sharing a date are all fetched as long as they fit in a page
+    (of the size the API chooses).
+    """
+
+    # Bound on the number of pages, should the API misbehave
+    MAX_PAGES = 10000
+
+    def __init__(self, before, after):
+        self.cursor = before
+        self.after = after
+        self.pages = 0
+        self.done = before <= after
+        self._seen = set()
+
+    def advance(self, page):
+        """Moves the cursor past a page fetched at the current cursor
+
+        Returns the sessions of the page not seen before.
+        """
+        self.pages += 1
+        if not page:
+            self.done = True
+            return []
+
+        if self.pages >= self.MAX_PAGES:
+            raise RuntimeError(f"Sessions still not fetched after {self.pages} pages")
+
+        oldest = min(data["session_date"] for data in page)
+        cursor = oldest.replace(microsecond=0) + ONE_SECOND
+        if cursor >= self.cursor:
+            # The whole page is within the last second: skip that second
+            logger.warning(f"Sessions page stuck at {self.cursor}, moving on")
+            cursor = self.cursor - ONE_SECOND
+        self.cursor = cursor
+        self.done = cursor <= self.after
+
+        new = [data for data in page if data["session_id"] not in self._seen]
+        self._seen.update(data["session_id"] for data in new)
+        return new
+
+    def __call__(self, fetch):
+        """Yields the new sessions of each page, fetched by `fetch(cursor)`
+
+        The next page is fetched in the background while the current one is
+        being processed.
+        """
+        if self.done:
+            return
+
+        with ThreadPoolExecutor(max_workers=1) as executor:
+            future = executor.submit(fetch, self.cursor)
+            while future is not None:
+                page = future.result()
+                new = self.advance(page)
+
+                future = None
+                if not self.done:
+                    future = executor.submit(fetch, self.cursor)
+
+                yield new
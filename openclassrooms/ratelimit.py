@@ -0,0 +1,120 @@
+"""Client-side rate limiting, to avoid being throttled (429) by OC"""
+import asyncio
+import threading
+import time
+from urllib.parse import urlsplit
+
+from .constants import API_BASE_URL, BASE_URL
+
+# Requests per second for each host
+DEFAULT_RATES = {
+    API_BASE_URL: 10,
+    BASE_URL: 4,
+}
+
+
+class TokenBucket:
+    """Allows `rate` requests per second, with bursts of up to `capacity`
+
+    Thread-safe: `acquire()` blocks the calling thread until a request can be
+    made, and `acquire_async()` does the same for a coroutine. The rate adapts
+    to the server: it is halved on each throttled response (with a pause for
+    the `Retry-After` delay), and slowly goes back up on success.
+    """
+
+    # Fraction of the configured rate regained on each success
+    RECOVERY = 0.05
+
+    def __init__(self, rate, capacity=None):
+        self.max_rate = rate
+        self.min_rate = rate / 16
+        self.rate = rate
+        self.capacity = capacity or max(1, rate)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.paused_until = 0
+        self._lock = threading.Lock()
+
+    def _reserve(self):
+        """Takes a token, and returns how long to wait before using it"""
+        with self._lock:
+            now = time.monotonic()
+            elapsed = now - self.updated
+            self.tokens = min(self.capacity, self.tokens + elapsed * self.rate)
+            self.updated = now
+
+            # The tokens can go negative: the next requests wait longer
+            self.tokens -= 1
+            wait = -self.tokens / self.rate if self.tokens < 0 else 0
+            return max(wait, self.paused_until - now)
+
+    def acquire(self):
+        wait = self._reserve()
+        if wait > 0:
+            time.sleep(wait)
+
+    async def acquire_async(self):
+        wait = self._reserve()
+        if wait > 0:
+            await asyncio.sleep(wait)
+
+    def throttled(self, retry_after=None):
+        """Slows down after a 429 response"""
+        with self._lock:
+            self.rate = max(self.min_rate, self.rate / 2)
+            if retry_after:
+                self.paused_until = max(
+                    self.paused_until, time.monotonic() + retry_after
+                )
+
+    def succeeded(self):
+        with self._lock:
+            self.rate = min(self.max_rate, self.rate + self.max_rate * self.RECOVERY)
+
+
+class RateLimiter:
+    """One token bucket per host
+
+    `rates` maps base URLs to their rate (requests per second). Hosts without
+    a rate are not limited.
+    """
+
+    def __init__(self, rates=None):
+        if rates is None:
+            rates = DEFAULT_RATES
+
+        self.buckets = {
+            urlsplit(url).hostname: TokenBucket(rate) for url, rate in rates.items()
+        }
+
+    def bucket(self, url):
+        return self.buckets.get(urlsplit(url).hostname)
+
+    def acquire(self, url):
+        bucket = self.bucket(url)
+        if bucket is not None:
+            bucket.acquire()
+
+    async def acquire_async(self, url):
+        bucket = self.bucket(url)
+        if bucket is not None:
+            await bucket.acquire_async()
+
+    def update(self, url, status, retry_after=None):
+        """Adapts the rate of the host to the status of a response"""
+        bucket = self.bucket(url)
+        if bucket is None:
+            return
+
+        if status == 429:
+            bucket.throttled(retry_after)
+        elif status < 500:
+            bucket.succeeded()
+
+
+def parse_retry_after(value):
+    """Returns the `Retry-After` delay in seconds, if given as a number"""
+    try:
+        return max(0, float(value))
+    except (TypeError, ValueError):
+        return None
@@ -0,0 +1,336 @@
+"""Long-running HTTP server, serving the invoices from memory
+
+Usage: python -m openclassrooms.server [--port 8000] [--refresh 900]
+
+The server keeps one authenticated adapter. The sessions of the current month
+are fetched again (incrementally) every `--refresh` seconds, and the invoices
+are only rendered again when their sessions changed. Then:
+
+* `GET /invoice/<month>`: the invoice of a month of the current year, in HTML
+* `GET /invoice/<month>.txt`: the same, in text
+* `GET /metrics`: the metrics of the crawls and renders, for Prometheus
+
+The responses have an `ETag` and a `Last-Modified` date, and conditional
+requests are answered with 304 (Not Modified).
+"""
+import argparse
+import hashlib
+import logging
+import re
+import threading
+import time
+from email.utils import formatdate, parsedate_to_datetime
+from http import HTTPStatus
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from . import metrics
+from .adapter import OcAdapter
+from .invoice import LOG_FORMAT, Invoice, make_adapter
+
+logger = logging.getLogger(__name__)
+
+INVOICE_PATH_RE = re.compile(r"^/invoice/(\d{1,2})(\.html|\.txt)?$")
+
+# Seconds between two refreshes of the current month
+DEFAULT_REFRESH = 15 * 60
+
+
+def fingerprint(manager):
+    """Returns a hash of everything the invoice of `manager` depends on"""
+    digest = hashlib.sha1()
+    for session_id in sorted(manager.sessions):
+        s = manager.sessions[session_id]
+        fields = (
+            session_id,
+            s.session_date.isoformat(),
+            s.level,
+            s.status,
+            s.soutenance,
+            s.student.name,
+            s.financed,
+        )
+        digest.update(repr(fields).encode())
+    return digest.hexdigest()
+
+
+class RenderedInvoice:
+    """The body of an invoice, and its validators
+
+    `body` is None until the invoice is rendered: the `Invoice` to render is
+    kept instead (see `InvoiceService.write()`).
+    """
+
+    __slots__ = ("key", "body", "invoice", "etag", "last_modified", "content_type")
+
+    def __init__(self, key, invoice, version, last_modified):
+        html = key[2]
+        self.key = key
+        self.body = None
+        self.invoice = invoice
+        self.etag = f'"{version[:20]}-{("txt", "html")[html]}"'
+        self.last_modified = last_modified
+        self.content_type = ("text/plain", "text/html")[html] + "; charset=utf-8"
+
+    def not_modified(self, if_none_match, if_modified_since):
+        """Whether the client already has this version (RFC 7232)"""
+        if if_none_match is not None:
+            tags = [tag.strip() for tag in if_none_match.split(",")]
+            return "*" in tags or self.etag in tags
+
+        if if_modified_since is not None:
+            try:
+                since = parsedate_to_datetime(if_modified_since).timestamp()
+            except (TypeError, ValueError):
+                return False
+            return int(self.last_modified) <= since
+
+        return False
+
+
+class InvoiceService:
+    """Keeps the sessions of the months in memory, and their invoices
+
+    The "live" months (the current month, and the previous one while its
+    pending sessions may still change) are refreshed by `refresh()`. The other
+    months are fetched on their first request only.
+    """
+
+    def __init__(self, adapter):
+        self.adapter = adapter
+        # (year, month) => SessionManager
+        self.managers = {}
+        # (year, month) => fingerprint of the sessions, and when they changed
+        self.versions = {}
+        # (year, month, html) => RenderedInvoice
+        self.rendered = {}
+        self.duration = 0
+        self._lock = threading.Lock()
+        self._crawl_lock = threading.Lock()
+
+    def live_months(self):
+        now = time.gmtime()
+        months = [(now.tm_year, now.tm_mon)]
+
+        if now.tm_mday <= OcAdapter.RECHECK_WINDOW.days:
+            year, month = now.tm_year, now.tm_mon - 1
+            if month == 0:
+                year, month = year - 1, 12
+            months.append((year, month))
+
+        return months
+
+    def _fetch(self, keys, missing_only=False):
+        with self._crawl_lock:
+            if missing_only:
+                # Fetched by another thread while waiting for the lock
+                keys = [key for key in keys if key not in self.managers]
+                if not keys:
+                    return
+
+            start = time.time()
+            managers = self.adapter.get_sessions_by_month(keys)
+            duration = time.time() - start
+            logger.info(f"Fetched {keys} in {duration:.2f}s")
+
+        with self._lock:
+            self.duration = duration
+            for key, manager in managers.items():
+                version = fingerprint(manager)
+                if self.versions.get(key, (None,))[0] != version:
+                    self.versions[key] = (version, time.time())
+                    self.rendered.pop(key + (True,), None)
+                    self.rendered.pop(key + (False,), None)
+                self.managers[key] = manager
+
+    def refresh(self):
+        """Fetches the new sessions of the live months"""
+        self._fetch(self.live_months())
+
+    def invoice(self, year, month, html=True):
+        """Returns the `RenderedInvoice` of a month, fetched if needed
+
+        The invoice is not rendered yet if its `body` is None: see `write()`.
+        """
+        key = (year, month)
+        if key not in self.managers:
+            self._fetch([key], missing_only=True)
+
+        with self._lock:
+            rendered = self.rendered.get(key + (html,))
+            if rendered is not None:
+                return rendered
+
+            version, changed = self.versions[key]
+            manager, duration = self.managers[key], self.duration
+
+        # Rendered outside of the lock, by `write()`
+        return RenderedInvoice(
+            key + (html,), Invoice(manager, duration), version, changed
+        )
+
+    def write(self, rendered, fp):
+        """Writes the body of a `RenderedInvoice` to `fp`, rendering it if needed
+
+        The invoice is streamed to `fp` as it is rendered, without holding the
+        lock. Its body is then kept for the next requests, unless its sessions
+        changed in the meantime.
+        """
+        if rendered.body is not None:
+            fp.write(rendered.body)
+            return
+
+        year, month, html = rendered.key
+        chunks = []
+        with metrics.timer("render_seconds"):
+            for chunk in rendered.invoice.generate(html):
+                chunk = chunk.encode()
+                fp.write(chunk)
+                chunks.append(chunk)
+
+        rendered.body = b"".join(chunks)
+        rendered.invoice = None
+
+        with self._lock:
+            # The sessions of the same version, since they changed at that time
+            _, changed = self.versions[(year, month)]
+            if changed == rendered.last_modified:
+                self.rendered.setdefault(rendered.key, rendered)
+
+
+class InvoiceRequestHandler(BaseHTTPRequestHandler):
+    server_version = "oc-tools"
+
+    def do_HEAD(self):
+        self.do_GET(send_body=False)
+
+    def do_GET(self, send_body=True):
+        if self.path == "/metrics":
+            self._send_metrics(send_body)
+            return
+
+        now = time.gmtime()
+        match = INVOICE_PATH_RE.match(self.path.split("?")[0])
+        # No invoice for the months to come
+        if match is None or not 1 <= int(match.group(1)) <= now.tm_mon:
+            self.send_error(HTTPStatus.NOT_FOUND)
+            return
+
+        month = int(match.group(1))
+        html = match.group(2) != ".txt"
+
+        try:
+            rendered = self.server.service.invoice(now.tm_year, month, html)
+        except Exception as e:
+            logger.exception(f"Cannot create the invoice of month {month}")
+            self.send_error(HTTPStatus.SERVICE_UNAVAILABLE, str(e))
+            return
+
+        not_modified = rendered.not_modified(
+            self.headers.get("If-None-Match"), self.headers.get("If-Modified-Since")
+        )
+        self.send_response(HTTPStatus.NOT_MODIFIED if not_modified else HTTPStatus.OK)
+        self.send_header("ETag", rendered.etag)
+        self.send_header(
+            "Last-Modified", formatdate(rendered.last_modified, usegmt=True)
+        )
+        self.send_header("Cache-Control", "no-cache")
+
+        if not_modified:
+            self.end_headers()
+            return
+
+        self.send_header("Content-Type", rendered.content_type)
+        # Else streamed while it is rendered, until the connection is closed
+        if rendered.body is not None:
+            self.send_header("Content-Length", str(len(rendered.body)))
+        self.end_headers()
+        if send_body:
+            self.server.service.write(rendered, self.wfile)
+
+    def _send_metrics(self, send_body):
+        body = metrics.prometheus_text().encode()
+        self.send_response(HTTPStatus.OK)
+        self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        if send_body:
+            self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        logger.info(f"{self.address_string()} {format % args}")
+
+
+class InvoiceServer(ThreadingHTTPServer):
+    """Serves the invoices of `service`, refreshed every `refresh` seconds"""
+
+    daemon_threads = True
+
+    def __init__(self, address, service, refresh=DEFAULT_REFRESH):
+        super().__init__(address, InvoiceRequestHandler)
+        self.service = service
+        self.refresh = refresh
+        self._stop = threading.Event()
+        self._refresh_thread = None
+
+    def _refresh_loop(self):
+        while not self._stop.wait(self.refresh):
+            try:
+                self.service.refresh()
+            except Exception:
+                logger.exception("Cannot refresh the sessions")
+
+    def start_refresh(self):
+        self._refresh_thread = threading.Thread(
+            target=self._refresh_loop, name="refresh", daemon=True
+        )
+        self._refresh_thread.start()
+
+    def server_close(self):
+        self._stop.set()
+        super().server_close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Serves the OC invoices")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument(
+        "--refresh",
+        type=int,
+        default=DEFAULT_REFRESH,
+        help="seconds between two refreshes of the current month",
+    )
+    parser.add_argument(
+        "--workers", type=int, default=5, help="threads fetching the student pages"
+    )
+    parser.add_argument(
+        "--asyncio",
+        dest="use_asyncio",
+        action="store_true",
+        default=False,
+        help="crawl with asyncio (requires aiohttp)",
+    )
+    parser.add_argument("--debug", action="store_true")
+    args = parser.parse_args()
+
+    logging.basicConfig(
+        level=logging.INFO if args.debug else logging.WARNING, format=LOG_FORMAT
+    )
+
+    service = InvoiceService(make_adapter(args.workers, args.use_asyncio))
+    service.refresh()
+
+    server = InvoiceServer((args.host, args.port), service, args.refresh)
+    server.start_refresh()
+    print(f"Serving the invoices on http://{args.host}:{server.server_port}/invoice/")
+
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+if __name__ == "__main__":
+    main()
@@ -1,22 +1,93 @@
-import operator
-from dataclasses import dataclass
-from datetime import datetime, timezone
+import heapq
+import threading
+from bisect import bisect_left, insort
+from collections import defaultdict
+from datetime import timezone
+from enum import Enum
+from functools import lru_cache
+
+from . import metrics
+from .constants import SESSION_URL
+from .student import StudentManager
 
 
-from .constants import SESSION_URL
-from .student import Student, StudentManager
+class Status(Enum):
+    """Status of a session, as far as the invoice is concerned"""
+
+    NOSHOW = "noshow"
+    COMPLETED = "completed"
+    PENDING = "pending"
+    # Canceled, late canceled...
+    OTHER = "other"
+
+    @classmethod
+    @lru_cache()
+    def parse(cls, status):
+        # Cached: the API only has a handful of statuses, parsed for each session
+        status = status.lower()
+        if "absent" in status:
+            return cls.NOSHOW
+        if "completed" in status:
+            return cls.COMPLETED
+        if "pending" in status:
+            return cls.PENDING
+        return cls.OTHER
 
 
-@dataclass
 class Session:
-    """An OC session, with a date, level, status, and student"""
+    """An OC session, with a date, level, status, and student
+
+    The status is parsed once into `status_code`, and the price is cached
+    until the financed status of the student changes. The fields a
+    `SessionManager` indexes the session by are read-only: to change them,
+    `add()` the session again.
+    """
+
+    __slots__ = (
+        "_session_id",
+        "_session_date",
+        "_level",
+        "_status",
+        "_status_code",
+        "_soutenance",
+        "student",
+        "_price",
+        "_price_financed",
+    )
+
+    def __init__(self, session_id, session_date, level, status, soutenance, student):
+        self._session_id = session_id
+        self._session_date = session_date
+        self._level = level
+        self._status = status
+        self._status_code = Status.parse(status)
+        self._soutenance = bool(soutenance)
+        self.student = student
+        self._price = None
+
+    @property
+    def session_id(self):
+        return self._session_id
+
+    @property
+    def session_date(self):
+        return self._session_date
+
+    @property
+    def level(self):
+        return self._level
+
+    @property
+    def status(self):
+        return self._status
+
+    @property
+    def status_code(self):
+        return self._status_code
 
-    session_id: int
-    session_date: datetime
-    level: int
-    status: str
-    soutenance: bool
-    student: Student
+    @property
+    def soutenance(self):
+        return self._soutenance
 
     @property
     def price(self):
@@ -27,10 +98,14 @@ class Session:
         auto financé = /2
         everything else... = 0
         """
+        financed = self.financed
+        if self._price is not None and self._price_financed is financed:
+            return self._price
+
         price = 25 + 5 * self.level
 
         # Soutenances are all the same price
-        if not self.financed and not self.soutenance:
+        if not financed and not self.soutenance:
             price = price / 2
 
         if self.noshow:
@@ -38,6 +113,8 @@ class Session:
         elif not self.completed:
             price = 0
 
+        self._price = price
+        self._price_financed = financed
         return price
 
     @property
@@ -50,15 +127,15 @@ class Session:
 
     @property
     def noshow(self):
-        return "absent" in self.status.lower()
+        return self.status_code is Status.NOSHOW
 
     @property
     def completed(self):
-        return "completed" in self.status.lower()
+        return self.status_code is Status.COMPLETED
 
     @property
     def pending(self):
-        return "pending" in self.status.lower()
+        return self.status_code is Status.PENDING
 
     @property
     def local_date(self):
@@ -69,25 +146,98 @@ class Session:
     def url(self):
         return SESSION_URL.format(self.session_id)
 
+    def _fields(self):
+        return (
+            self.session_id,
+            self.session_date,
+            self.level,
+            self.status,
+            self.soutenance,
+            self.student,
+        )
+
+    def __eq__(self, other):
+        if other.__class__ is not self.__class__:
+            return NotImplemented
+        return self._fields() == other._fields()
+
+    __hash__ = None
+
+    def __repr__(self):
+        return (
+            f"Session(session_id={self.session_id!r}, "
+            f"session_date={self.session_date!r}, level={self.level!r}, "
+            f"status={self.status!r}, soutenance={self.soutenance!r}, "
+            f"student={self.student!r})"
+        )
+
     def __str__(self):
         return f"{self.student.name: <30} | {self.session_date:%Y-%m-%d %H:%M} | {self.level} | {self.status}"
 
 
 class SessionManager:
-    """This manager makes it easier to filter/search for sessions"""
+    """This manager makes it easier to filter/search for sessions
+
+    The sessions are indexed by (level, soutenance, status), and each
+    bucket of the index is kept sorted by date, so `filter()` only merges the
+    matching buckets. The financed status is not indexed, since it is updated
+    while the sessions are added: it is checked when filtering. To update a
+    session, `add()` it again rather than modifying it.
+
+    `add()` and `filter()` can be called from several threads, but they wait
+    for each other on one lock. So producers fill their own `shard()` by
+    default (as the crawls do), without sharing a lock, and `merge()` the
+    shards at the end, once per shard.
+    """
+
+    def __init__(self, persistent_students=False, student_manager=None, month=None):
+        """Constructor
 
-    def __init__(self, persistent_students):
+        Several managers (e.g. one per month) can share the same
+        `student_manager`. `month` is only needed when there are no sessions.
+        """
         self.sessions = dict()
-        self.student_manager = StudentManager(persistent_students)
+        if student_manager is None:
+            student_manager = StudentManager(persistent_students)
+        self.student_manager = student_manager
+        self._month = month
+        # (level, soutenance, status) => sorted [(date, id, session)]
+        self._index = defaultdict(list)
+        # Held while the sessions and the index change, or are read
+        self._lock = threading.Lock()
+
+    def __getstate__(self):
+        # The lock cannot be pickled: a new one is created when unpickling
+        state = self.__dict__.copy()
+        del state["_lock"]
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._lock = threading.Lock()
 
     @property
     def month(self):
+        if self._month is not None:
+            return self._month
+
         if not len(self.sessions):
             raise RuntimeError("Not implemented?")
 
         first_item = next(iter(self.sessions.values()))
         return first_item.session_date.month
 
+    @month.setter
+    def month(self, val):
+        self._month = val
+
+    def get_month(self, default=None):
+        """Returns `month`, or `default` when it is unknown (no sessions)"""
+        try:
+            return self.month
+        except RuntimeError:
+            return default
+
     def filter(
         self,
         level=None,
@@ -97,34 +247,49 @@ class SessionManager:
         pending=None,
         soutenance=False,
     ):
-        sessions = self.sessions.values()
-
-        if level:
-            sessions = [s for s in sessions if s.level == level]
-
-        if financed is not None:
-            sessions = [s for s in sessions if s.financed is financed]
+        statuses = set(Status)
 
         if noshow is True:
-            sessions = [s for s in sessions if s.noshow]
+            statuses &= {Status.NOSHOW}
         elif noshow is False:
-            sessions = [s for s in sessions if s.completed]
+            statuses &= {Status.COMPLETED}
 
         if no_charge is True:
-            sessions = [s for s in sessions if s.no_charge]
+            statuses &= {Status.PENDING, Status.OTHER}
 
         if pending is True:
-            sessions = [s for s in sessions if s.pending]
+            statuses &= {Status.PENDING}
+
+        with self._lock:
+            buckets = [
+                bucket
+                for (s_level, s_soutenance, s_status), bucket in self._index.items()
+                if (not level or s_level == level)
+                and s_soutenance is (soutenance is True)
+                and s_status in statuses
+            ]
+
+            sessions = [s for _, _, s in heapq.merge(*buckets)]
+
+        if financed is not None:
+            sessions = [s for s in sessions if s.financed is financed]
 
-        if soutenance is True:
-            sessions = [s for s in sessions if s.soutenance]
-        else:
-            sessions = [s for s in sessions if not s.soutenance]
+        return sessions
 
-        return sorted(sessions, key=operator.attrgetter("session_date"))
+    @staticmethod
+    def _index_key(session):
+        return (session.level, session.soutenance, session.status_code)
+
+    def _index_add(self, session):
+        entry = (session.session_date, session.session_id, session)
+        insort(self._index[self._index_key(session)], entry)
+
+    def _index_remove(self, session):
+        bucket = self._index[self._index_key(session)]
+        del bucket[bisect_left(bucket, (session.session_date, session.session_id))]
 
     def add(self, **kwargs):
-        """Add a session to the list, and keep the list sorted"""
+        """Add (or replace) a session, and index it"""
 
         session_id = kwargs["session_id"]
 
@@ -144,7 +309,69 @@ class SessionManager:
             session_args["student"] = student
 
         session = Session(**session_args)
-        self.sessions[session_id] = session
+        with self._lock:
+            self._add_session(session)
 
-        if session_args["student"].financed is None:
+        if session_args["student"].needs_update:
+            metrics.inc("student_cache_misses")
             return session_args["student"]
+
+        metrics.inc("student_cache_hits")
+
+    def extend(self, sessions):
+        """Adds (or replaces) `Session` objects, in order (the last one wins)
+
+        Faster than adding them one by one: the sessions are grouped by bucket
+        of the index, and each bucket is sorted once.
+        """
+        # Reads the slots directly: the properties double the time of a load
+        sessions = {session._session_id: session for session in sessions}
+
+        buckets = defaultdict(list)
+        for s in sessions.values():
+            key = (s._level, s._soutenance, s._status_code)
+            buckets[key].append((s._session_date, s._session_id, s))
+
+        with self._lock:
+            for session_id in sessions.keys() & self.sessions.keys():
+                self._index_remove(self.sessions[session_id])
+            self.sessions.update(sessions)
+
+            for key, entries in buckets.items():
+                bucket = self._index[key]
+                bucket.extend(entries)
+                bucket.sort()
+
+    def _add_session(self, session):
+        """Adds or replaces a session, with the lock held"""
+        previous = self.sessions.get(session.session_id)
+        if previous is not None:
+            self._index_remove(previous)
+
+        self.sessions[session.session_id] = session
+        self._index_add(session)
+
+    def copy_sessions(self):
+        """Returns a list of the sessions, safe to use while others are added"""
+        with self._lock:
+            return list(self.sessions.values())
+
+    def columns(self):
+        """Returns the sessions as columns, for aggregations (see `columnar`)"""
+        from .columnar import SessionColumns
+
+        return SessionColumns.from_sessions(self.copy_sessions())
+
+    def shard(self):
+        """Returns an empty manager, sharing the students and month of this one
+
+        Meant to be filled by one producer thread, then `merge()`d.
+        """
+        return SessionManager(student_manager=self.student_manager, month=self._month)
+
+    def merge(self, *shards):
+        """Adds the sessions of the shards, in order (the last one wins)"""
+        for shard in shards:
+            self.extend(shard.copy_sessions())
+
+        return self
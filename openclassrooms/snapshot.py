@@ -0,0 +1,184 @@
+"""Snapshots of the sessions and students, in JSON lines
+
+A snapshot starts with a header line (format, version, and content), followed
+by one line per student, then one line per session (an array of the
+`SESSION_FIELDS`, faster to decode than an object). Only plain JSON types are
+written, so a snapshot does not depend on the version of the code (or of its
+dependencies) that wrote it, and it can be read line by line.
+"""
+import json
+from datetime import datetime
+
+from .helpers import atomic_write
+from .session import Session, SessionManager
+from .student import StudentManager
+
+SNAPSHOT_FORMAT = "oc-tools/snapshot"
+SNAPSHOT_VERSION = 2
+
+SESSION_FIELDS = (
+    "session_id",
+    "session_date",
+    "student_id",
+    "level",
+    "status",
+    "soutenance",
+)
+
+# Snapshot used by `--demo`
+DEMO_FILE = "demo.jsonl"
+
+# Size of the batches of lines decoded at once, in bytes
+READ_SIZE = 1 << 20
+
+
+def save_snapshot(manager, path):
+    """Writes a `SessionManager` (with its students) or a `StudentManager`"""
+    if isinstance(manager, SessionManager):
+        kind = "sessions"
+        sessions = manager.sessions.values()
+        student_manager = manager.student_manager
+        month = manager.get_month()
+    else:
+        kind = "students"
+        sessions = []
+        student_manager = manager
+        month = None
+
+    students = student_manager.students.values()
+    header = {
+        "format": SNAPSHOT_FORMAT,
+        "version": SNAPSHOT_VERSION,
+        "type": kind,
+        "month": month,
+        "students": len(students),
+        "sessions": len(sessions),
+    }
+
+    with atomic_write(path) as fp:
+        fp.write(json.dumps(header) + "\n")
+
+        for student in students:
+            fp.write(json.dumps({"student": student.json()}) + "\n")
+
+        for s in sessions:
+            data = [
+                s.session_id,
+                s.session_date.isoformat(),
+                s.student.student_id,
+                s.level,
+                s.status,
+                s.soutenance,
+            ]
+            fp.write(json.dumps({"session": data}) + "\n")
+
+
+class Snapshot:
+    """Reads a snapshot lazily
+
+    Only the header is read when opening the snapshot: the students and the
+    sessions are decoded as they are iterated over.
+    """
+
+    def __init__(self, path):
+        self.path = path
+
+        with open(path, "r") as fp:
+            try:
+                self.header = json.loads(fp.readline())
+            except ValueError:
+                self.header = {}
+
+        if self.header.get("format") != SNAPSHOT_FORMAT:
+            raise RuntimeError(f"Not a snapshot: {path}")
+
+        if self.header.get("version") != SNAPSHOT_VERSION:
+            raise RuntimeError(
+                f"Unsupported snapshot version {self.header.get('version')}: {path}"
+            )
+
+    def _batches(self):
+        """Yields the lines of records, by batches of about `READ_SIZE` bytes"""
+        with open(self.path, "r") as fp:
+            next(fp)
+            while True:
+                lines = fp.readlines(READ_SIZE)
+                if not lines:
+                    break
+                yield lines
+
+    @staticmethod
+    def _decode(lines):
+        # One JSON array decodes much faster than each line on its own
+        return json.loads(f"[{','.join(lines)}]") if lines else []
+
+    def _records(self, kind):
+        prefix = f'{{"{kind}"'
+        for lines in self._batches():
+            # Saves decoding the lines of the other kind
+            lines = [line for line in lines if line.startswith(prefix)]
+            for record in self._decode(lines):
+                yield record[kind]
+
+    def students(self):
+        """Yields the students, as dictionaries"""
+        return self._records("student")
+
+    def sessions(self):
+        """Yields the sessions, as expected by `SessionManager.add`"""
+        for values in self._records("session"):
+            data = dict(zip(SESSION_FIELDS, values))
+            data["session_date"] = datetime.fromisoformat(data["session_date"])
+            yield data
+
+    def load_students(self, student_manager=None):
+        if student_manager is None:
+            student_manager = StudentManager()
+
+        for data in self.students():
+            student_manager.get_or_create(**data)
+
+        return student_manager
+
+    def load(self):
+        """Returns the `SessionManager` (or `StudentManager`) of the snapshot
+
+        Reads the file once, creates the sessions straight from their records,
+        and sorts the index once (see `SessionManager.extend`).
+        """
+        student_manager = StudentManager()
+        students = student_manager.students
+        sessions = []
+        fromisoformat = datetime.fromisoformat
+
+        for lines in self._batches():
+            for record in self._decode(lines):
+                values = record.get("session")
+                if values is None:
+                    student_manager.get_or_create(**record["student"])
+                    continue
+
+                session_id, session_date, student_id, level, status, soutenance = values
+                sessions.append(
+                    Session(
+                        session_id,
+                        fromisoformat(session_date),
+                        level,
+                        status,
+                        soutenance,
+                        students[student_id],
+                    )
+                )
+
+        if self.header["type"] == "students":
+            return student_manager
+
+        manager = SessionManager(
+            student_manager=student_manager, month=self.header["month"]
+        )
+        manager.extend(sessions)
+        return manager
+
+
+def load_snapshot(path):
+    return Snapshot(path).load()
@@ -0,0 +1,242 @@
+"""Persistent storage, in a SQLite database
+
+The database is shared by all the stores, and its schema is versioned with
+`PRAGMA user_version`: each entry of `MIGRATIONS` upgrades the schema by one
+version. Writes happen in transactions, so several processes can safely use
+the same file, and a crash never leaves it half-written.
+"""
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime
+
+logger = logging.getLogger(__name__)
+
+DATABASE_FILE = "oc.db"
+
+# Seconds to wait for another process to release the database
+LOCK_TIMEOUT = 30
+
+MIGRATIONS = [
+    # Version 1: students financed status
+    [
+        """CREATE TABLE students (
+            student_id INTEGER PRIMARY KEY,
+            name TEXT NOT NULL,
+            financed INTEGER NOT NULL,
+            fetched_at REAL NOT NULL
+        )""",
+    ],
+    # Version 2: sessions, and how far each month has been synced
+    [
+        """CREATE TABLE sessions (
+            session_id INTEGER PRIMARY KEY,
+            year INTEGER NOT NULL,
+            month INTEGER NOT NULL,
+            session_date TEXT NOT NULL,
+            student_id INTEGER NOT NULL,
+            student_name TEXT NOT NULL,
+            level INTEGER NOT NULL,
+            status TEXT NOT NULL,
+            soutenance INTEGER NOT NULL
+        )""",
+        "CREATE INDEX sessions_month ON sessions (year, month)",
+        """CREATE TABLE watermarks (
+            year INTEGER NOT NULL,
+            month INTEGER NOT NULL,
+            synced_until TEXT NOT NULL,
+            PRIMARY KEY (year, month)
+        )""",
+    ],
+]
+
+
+class Store:
+    """Base class for the stores: connection and schema upgrades"""
+
+    def __init__(self, path=DATABASE_FILE):
+        self.path = path
+        self._lock = threading.Lock()
+        # Autocommit mode: the transactions are handled by `transaction()`
+        self._conn = sqlite3.connect(
+            path, timeout=LOCK_TIMEOUT, isolation_level=None, check_same_thread=False
+        )
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self.previous_version = self._migrate()
+
+    @contextmanager
+    def transaction(self):
+        """Runs the statements in a write transaction, and yields a cursor"""
+        with self._lock:
+            cursor = self._conn.cursor()
+            cursor.execute("BEGIN IMMEDIATE")
+            try:
+                yield cursor
+            except BaseException:
+                cursor.execute("ROLLBACK")
+                raise
+            else:
+                cursor.execute("COMMIT")
+            finally:
+                cursor.close()
+
+    def query(self, sql, params=()):
+        with self._lock:
+            return self._conn.execute(sql, params).fetchall()
+
+    def _migrate(self):
+        """Upgrades the schema, and returns the version it was at"""
+        with self.transaction() as cursor:
+            version = cursor.execute("PRAGMA user_version").fetchone()[0]
+            for statements in MIGRATIONS[version:]:
+                for statement in statements:
+                    cursor.execute(statement)
+
+            if version < len(MIGRATIONS):
+                logger.info(f"Upgraded {self.path} to version {len(MIGRATIONS)}.")
+                # PRAGMA does not support parameters
+                cursor.execute(f"PRAGMA user_version = {len(MIGRATIONS):d}")
+
+        return version
+
+    def close(self):
+        self._conn.close()
+
+
+class StudentStore(Store):
+    """Financed status of the students, with the date it was fetched"""
+
+    # The file used before the database: imported when the database is created
+    # (from the directory of the database)
+    LEGACY_FILE = "students.json"
+
+    def __init__(self, path=DATABASE_FILE):
+        super().__init__(path)
+
+        legacy_path = os.path.join(os.path.dirname(path), self.LEGACY_FILE)
+        if self.previous_version == 0 and os.path.exists(legacy_path):
+            self._import_legacy(legacy_path)
+
+    def _import_legacy(self, legacy_path):
+        with open(legacy_path, "r") as fp:
+            students = [s for s in json.load(fp) if s.get("financed") is not None]
+
+        # We don't know when they were fetched: use the date of the file
+        fetched_at = os.path.getmtime(legacy_path)
+        for student in students:
+            student.setdefault("fetched_at", fetched_at)
+
+        self.save(students)
+        logger.info(f"Imported {len(students)} students from {legacy_path}.")
+
+    def load(self):
+        """Returns the dictionaries of all the students"""
+        rows = self.query("SELECT student_id, name, financed, fetched_at FROM students")
+        return [
+            {
+                "student_id": student_id,
+                "name": name,
+                "financed": bool(financed),
+                "fetched_at": fetched_at,
+            }
+            for student_id, name, financed, fetched_at in rows
+        ]
+
+    def save(self, students):
+        """Saves the students dictionaries (see `Student.json`)
+
+        A student is only overwritten by a more recent value, so that a process
+        does not revert what another one fetched in the meantime.
+        """
+        rows = [
+            (s["student_id"], s["name"], s["financed"], s["fetched_at"] or time.time())
+            for s in students
+            if s["financed"] is not None
+        ]
+
+        with self.transaction() as cursor:
+            cursor.executemany(
+                """INSERT INTO students (student_id, name, financed, fetched_at)
+                VALUES (?, ?, ?, ?)
+                ON CONFLICT (student_id) DO UPDATE SET
+                    name = excluded.name,
+                    financed = excluded.financed,
+                    fetched_at = excluded.fetched_at
+                WHERE excluded.fetched_at >= students.fetched_at""",
+                rows,
+            )
+
+
+class SessionStore(Store):
+    """Sessions of each month, and the date up to which the month was synced"""
+
+    def load_month(self, year, month):
+        """Returns the date the month was synced until, and its sessions
+
+        The sessions are dictionaries, as expected by `SessionManager.add`.
+        """
+        rows = self.query(
+            "SELECT synced_until FROM watermarks WHERE year = ? AND month = ?",
+            (year, month),
+        )
+        synced_until = datetime.fromisoformat(rows[0][0]) if rows else None
+
+        rows = self.query(
+            """SELECT session_id, session_date, student_id, student_name, level,
+                status, soutenance
+            FROM sessions WHERE year = ? AND month = ?""",
+            (year, month),
+        )
+        sessions = [
+            {
+                "session_id": session_id,
+                "session_date": datetime.fromisoformat(session_date),
+                "student_id": student_id,
+                "student_name": student_name,
+                "level": level,
+                "status": status,
+                "soutenance": bool(soutenance),
+            }
+            for (
+                session_id,
+                session_date,
+                student_id,
+                student_name,
+                level,
+                status,
+                soutenance,
+            ) in rows
+        ]
+
+        return synced_until, sessions
+
+    def save_month(self, year, month, sessions, synced_until):
+        """Saves the `Session` objects of a month, and its watermark"""
+        rows = [
+            (
+                s.session_id,
+                year,
+                month,
+                s.session_date.isoformat(),
+                s.student.student_id,
+                s.student.name,
+                s.level,
+                s.status,
+                s.soutenance,
+            )
+            for s in sessions
+        ]
+
+        with self.transaction() as cursor:
+            cursor.executemany(
+                "INSERT OR REPLACE INTO sessions VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                rows,
+            )
+            cursor.execute(
+                "INSERT OR REPLACE INTO watermarks VALUES (?, ?, ?)",
+                (year, month, synced_until.isoformat()),
+            )
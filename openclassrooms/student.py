@@ -1,46 +1,163 @@
-import json
 import logging
-from io import BytesIO
-from lxml import etree
+import threading
+import time
+from concurrent.futures import Future
 
+from . import metrics
 from .constants import STUDENT_URL
+from .store import DATABASE_FILE, StudentStore
 
 logger = logging.getLogger(__name__)
 
+# Bytes read at a time from the student dashboard
+CHUNK_SIZE = 16 * 1024
+# Bytes read (without parsing them) after the financed status, at most: a
+# response closed before its end closes its connection, and the next page
+# then pays for a new TCP / TLS handshake
+DRAIN_LIMIT = 256 * 1024
+
+
+def drain(resp, chunks, limit=DRAIN_LIMIT):
+    """Reads what is left of a streamed response, if no more than `limit`
+
+    Once read to the end, the connection of the response goes back to the
+    pool when it is closed. Returns whether the response was read.
+    """
+    try:
+        left = int(resp.headers["Content-Length"]) - resp.raw.tell()
+    except (AttributeError, KeyError, TypeError, ValueError):
+        # Unknown length (e.g. chunked): read up to the limit
+        left = 0
+
+    if left > limit:
+        return False
+
+    for chunk in chunks:
+        limit -= len(chunk)
+        if limit < 0:
+            return False
+
+    return True
+
+
+class FinancedStatusParser:
+    """Incremental parser of the student dashboard
+
+    Feed it the page chunk by chunk: `feed()` returns the financed status text
+    as soon as the `mentorshipStudent__details` block has been read, so that
+    the rest of the page can be skipped. It returns None until then.
+    """
+
+    DETAILS_CLASS = "mentorshipStudent__details"
+
+    def __init__(self):
+        # Imported here: loading sessions from a snapshot does not parse pages
+        from lxml import etree
+
+        # OC pages are always UTF-8
+        self._parser = etree.HTMLPullParser(events=("start", "end"), encoding="utf-8")
+        self._details = None
+        self.status = None
+
+    def feed(self, chunk):
+        if self.status is None:
+            self._parser.feed(chunk)
+            self._read_events()
+        return self.status
+
+    def close(self):
+        """Parses what is left, once the whole page has been fed"""
+        if self.status is None:
+            from lxml import etree
+
+            try:
+                self._parser.close()
+            except etree.XMLSyntaxError:
+                pass
+            self._read_events()
+        return self.status
+
+    def _read_events(self):
+        for event, element in self._parser.read_events():
+            if event == "start":
+                classes = element.get("class", "")
+                if element.tag == "div" and self.DETAILS_CLASS in classes:
+                    self._details = element
+            elif element is self._details:
+                self._details = None
+            elif element.tag == "p" and element.getparent() is self._details:
+                self.status = (element.text or "").strip()
+                return
+
 
 class Student:
     """Holds information about students"""
 
-    def __init__(self, student_id, name, financed=None):
+    __slots__ = ("student_id", "name", "financed", "fetched_at", "stale")
+
+    def __init__(self, student_id, name, financed=None, fetched_at=None, stale=False):
         self.student_id = student_id
         self.name = name
         self.financed = financed
+        # When the financed status was fetched, and whether it should be again
+        self.fetched_at = fetched_at
+        self.stale = stale
+
+    @property
+    def needs_update(self):
+        return self.financed is None or self.stale
 
     def update_financed_status(self, connector):
         """Loads the student dashboard and updates their financed status
 
-        Meant to be run in thread / thread pool
+        Meant to be run in thread / thread pool. The page is streamed, and only
+        parsed up to the financed status. The rest is read if short (see
+        `DRAIN_LIMIT`), so that the connection is reused.
         """
 
-        if self.financed is not None:
+        if not self.needs_update:
             return
 
         student_url = STUDENT_URL.format(self.student_id)
 
-        resp = connector.get(student_url)
-        tree = etree.parse(BytesIO(resp.content), etree.HTMLParser())
+        parsing = 0
+        with metrics.timer("student_page_seconds"):
+            resp = connector.get(student_url, stream=True)
+            parser = FinancedStatusParser()
+            try:
+                chunks = resp.iter_content(CHUNK_SIZE)
+                for chunk in chunks:
+                    start = time.perf_counter()
+                    status = parser.feed(chunk)
+                    parsing += time.perf_counter() - start
+                    if status is not None:
+                        break
+                drain(resp, chunks, DRAIN_LIMIT)
+            finally:
+                resp.close()
+
+        metrics.observe("student_parse_seconds", parsing)
+        return self.set_financed_status(parser.close(), student_url)
 
-        xpath = tree.xpath("//div[contains(@class, 'mentorshipStudent__details')]/p")
+    def update_from_html(self, content, url=None):
+        """Sets the financed status from the content of the student dashboard"""
+        parser = FinancedStatusParser()
+        parser.feed(content)
+        return self.set_financed_status(parser.close(), url)
 
-        if not len(xpath):
-            raise RuntimeError(f"Cannot parse student page: {student_url}")
+    def set_financed_status(self, status, url=None):
+        """Sets the financed status from its text on the student dashboard"""
+        if status is None:
+            raise RuntimeError(f"Cannot parse student page: {url}")
 
-        status = xpath[0].text.strip()
         if "Auto" in status:
             self.financed = False
         else:
             self.financed = True
 
+        self.fetched_at = time.time()
+        self.stale = False
+
         logger.info(f"Updated {self.name} (financed: {self.financed}).")
         return self.financed
 
@@ -49,6 +166,7 @@ class Student:
             "student_id": self.student_id,
             "name": self.name,
             "financed": self.financed,
+            "fetched_at": self.fetched_at,
         }
 
     def __str__(self):
@@ -61,22 +179,53 @@ class Student:
 
 
 class StudentManager:
-    def __init__(self, persistent=False):
+    """Holds the students, and persists their financed status
+
+    When `persistent`, the students are loaded from the database, and the ones
+    fetched more than `ttl` seconds ago are marked as stale (to be fetched
+    again).
+    """
+
+    # 30 days
+    DEFAULT_TTL = 30 * 24 * 3600
+
+    # Locks of `get_or_create`, the students being spread over them by ID
+    LOCK_STRIPES = 16
+
+    def __init__(self, persistent=False, ttl=DEFAULT_TTL, path=DATABASE_FILE):
         self.students = {}
         self.persistent = persistent
+        self.ttl = ttl
+        self.store = None
+        self._locks = [threading.Lock() for _ in range(self.LOCK_STRIPES)]
+        # student_id => Future of the lookup in flight
+        self._lookups = {}
+        self._lookups_lock = threading.Lock()
 
         if not persistent:
             return
 
-        try:
-            with open("students.json", "r") as fp:
-                students_dicts = json.load(fp)
-                for student_data in students_dicts:
-                    self.get_or_create(**student_data)
-        except FileNotFoundError:
-            pass
+        self.store = StudentStore(path)
+        expired = time.time() - ttl
+        for student_data in self.store.load():
+            student_data["stale"] = student_data["fetched_at"] < expired
+            self.get_or_create(**student_data)
+
+    def __getstate__(self):
+        # The locks cannot be pickled, nor the lookups in flight
+        state = self.__dict__.copy()
+        for name in ("_locks", "_lookups", "_lookups_lock"):
+            del state[name]
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._locks = [threading.Lock() for _ in range(self.LOCK_STRIPES)]
+        self._lookups = {}
+        self._lookups_lock = threading.Lock()
 
     def get_or_create(self, student_id, **kwargs):
+        """Returns the student, created once even when called from threads"""
         student = self.students.get(student_id)
 
         if student:
@@ -85,14 +234,50 @@ class StudentManager:
         if not "name" in kwargs:
             return None
 
-        student = Student(student_id, **kwargs)
-        self.students[student_id] = student
+        # Only the students sharing a stripe wait for each other
+        with self._locks[hash(student_id) % self.LOCK_STRIPES]:
+            student = self.students.get(student_id)
+            if student is None:
+                student = Student(student_id, **kwargs)
+                self.students[student_id] = student
 
         return student
 
+    def update_financed_status(self, student, connector):
+        """Updates the financed status of a student, one lookup at a time
+
+        A student is queued once per session: the threads updating the same
+        student at the same time wait for the first lookup, instead of
+        fetching the page again. Returns the financed status.
+        """
+        with self._lookups_lock:
+            future = self._lookups.get(student.student_id)
+            if future is None:
+                future = self._lookups[student.student_id] = Future()
+                leader = True
+            else:
+                leader = False
+
+        if not leader:
+            metrics.inc("student_lookups_saved")
+            return future.result()
+
+        try:
+            student.update_financed_status(connector)
+            future.set_result(student.financed)
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        finally:
+            with self._lookups_lock:
+                del self._lookups[student.student_id]
+
+        return student.financed
+
     def save(self):
         if not self.persistent:
             return None
 
-        with open("students.json", "w") as fp:
-            json.dump([s.json() for s in self.students.values()], fp)
+        # Copied at once: students may be added meanwhile
+        students = list(self.students.values())
+        self.store.save([s.json() for s in students])
@@ -0,0 +1,71 @@
+"""Fixtures shared by the test modules"""
+import threading
+import time
+from datetime import datetime, timedelta, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+from requests.cookies import RequestsCookieJar
+
+from openclassrooms.tokens import TokenStore
+
+
+def make_session(session_id, session_date, student_id=1):
+    return {
+        "id": session_id,
+        "sessionDate": session_date.strftime("%Y-%m-%dT%H:%M:%S+0000"),
+        "recipient": {"id": student_id, "displayableName": f"Student {student_id}"},
+        "projectLevel": "1",
+        "status": "completed",
+        "type": "mentoring",
+    }
+
+
+@pytest.fixture
+def month_sessions():
+    now = datetime.now(timezone.utc)
+    start = datetime(now.year, now.month, 1, 1, tzinfo=timezone.utc)
+    dates = [start + timedelta(hours=3 * i) for i in range(30)]
+    # One session in the previous month, so that the crawl stops
+    dates.insert(0, start - timedelta(days=2))
+    return [
+        make_session(i, d, student_id=i % 7)
+        for i, d in reversed(list(enumerate(dates)))
+        if d <= now
+    ]
+
+
+@pytest.fixture
+def saved_token(tmp_path, monkeypatch):
+    """A valid token in the current directory, so that no login happens"""
+    monkeypatch.chdir(tmp_path)
+    TokenStore().save("abc", 1, time.time() + 3600, RequestsCookieJar())
+
+
+@pytest.fixture
+def server():
+    """Local server answering 429 to the first two requests of each path"""
+    hits = {}
+
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def do_GET(self):
+            hits[self.path] = hits.get(self.path, 0) + 1
+            status = 429 if hits[self.path] <= 2 else 200
+            body = b"{}"
+            self.send_response(status)
+            self.send_header("Content-Length", str(len(body)))
+            if status == 429:
+                self.send_header("Retry-After", "0")
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    httpd = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    thread = threading.Thread(target=httpd.serve_forever, daemon=True)
+    thread.start()
+    yield f"http://127.0.0.1:{httpd.server_port}"
+    httpd.shutdown()
@@ -1,5 +1,135 @@
+import json
+from datetime import datetime, timedelta, timezone
+from unittest.mock import Mock
+
 import pytest
 
+from openclassrooms.adapter import OcAdapter
+
+from .conftest import make_session
+
 
 def test_truc():
     assert 2 + 2 == 4
+
+
+STUDENT_HTML = b"""<html><body><div class="mentorshipStudent__details">
+<p>Financ\xc3\xa9 par un tiers</p></div></body></html>"""
+
+
+class FakeConnector:
+    """Serves a fixed list of sessions, most recent first
+
+    Pages hold 5 sessions.
+    """
+
+    user_id = 1
+
+    def __init__(self, sessions):
+        self.sessions = sessions
+        self.student_requests = 0
+
+    def get(self, url, params=None, **kwargs):
+        response = Mock()
+        if params is None:
+            self.student_requests += 1
+            response.content = STUDENT_HTML
+            response.iter_content = lambda chunk_size=1: iter([STUDENT_HTML])
+            return response
+
+        before = datetime.strptime(params["before"], "%Y-%m-%dT%H:%M:%SZ")
+        before = before.replace(tzinfo=timezone.utc)
+        page = [
+            s
+            for s in self.sessions
+            if datetime.strptime(s["sessionDate"], "%Y-%m-%dT%H:%M:%S%z") < before
+        ]
+        response.content = json.dumps(page[:5]).encode()
+        return response
+
+
+def test_adapter_pipeline(month_sessions):
+    connector = FakeConnector(month_sessions)
+    adapter = OcAdapter(None, None, workers=3, connector=connector)
+
+    adapter.get_sessions_for_month(None)
+
+    assert len(adapter.manager.sessions) == len(month_sessions) - 1
+    students = adapter.manager.student_manager.students.values()
+    assert all(s.financed is True for s in students)
+    # One request per student, even when several threads look them up
+    assert connector.student_requests == len(students)
+
+
+def test_adapter_pipeline_error():
+    connector = Mock()
+    connector.get = Mock(side_effect=RuntimeError("API down"))
+    adapter = OcAdapter(None, None, workers=2, connector=connector)
+
+    with pytest.raises(RuntimeError):
+        adapter.get_sessions_for_month(None)
+
+
+class CountingConnector(FakeConnector):
+    def __init__(self, sessions):
+        super().__init__(sessions)
+        self.session_requests = 0
+
+    def get(self, url, params=None, **kwargs):
+        if params is not None:
+            self.session_requests += 1
+        return super().get(url, params=params, **kwargs)
+
+
+def test_adapter_page_size(month_sessions):
+    """Pages of 5 sessions, overlapping by one session"""
+    connector = CountingConnector(month_sessions)
+    adapter = OcAdapter(None, None, connector=connector)
+    adapter.get_sessions_for_month(None)
+
+    assert len(adapter.manager.sessions) == len(month_sessions) - 1
+    assert connector.session_requests == -(-len(month_sessions) // 4)
+
+
+def test_adapter_incremental(month_sessions, tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    month_sessions[0]["status"] = "pending"
+
+    connector = CountingConnector(month_sessions)
+    adapter = OcAdapter(None, None, connector=connector, incremental=True)
+    # Pages of 5 sessions: the full crawl takes several
+    adapter.get_sessions_for_month(None)
+    full_crawl = connector.session_requests
+
+    # The pending session has been completed since
+    month_sessions[0]["status"] = "completed"
+    connector = CountingConnector(month_sessions)
+    adapter = OcAdapter(None, None, connector=connector, incremental=True)
+    adapter.get_sessions_for_month(None)
+
+    assert len(adapter.manager.sessions) == len(month_sessions) - 1
+    assert adapter.manager.sessions[month_sessions[0]["id"]].completed
+    assert full_crawl > 1
+    assert connector.session_requests == 1
+
+
+def test_adapter_several_months():
+    year = datetime.now(timezone.utc).year - 1
+    dates = [datetime(year, 4, 30, tzinfo=timezone.utc)]
+    dates += [
+        datetime(year, 5, 1, tzinfo=timezone.utc) + timedelta(days=i) for i in range(61)
+    ]
+    sessions = [make_session(i, d) for i, d in reversed(list(enumerate(dates)))]
+
+    connector = CountingConnector(sessions)
+    adapter = OcAdapter(None, None, connector=connector)
+    managers = adapter.get_sessions_for_months([5, 6], year)
+
+    assert list(managers) == [5, 6]
+    assert len(managers[5].sessions) == 31
+    assert len(managers[6].sessions) == 30
+    assert managers[6].month == 6
+    # One crawl for both months: pages of 5, overlapping by one session
+    assert connector.session_requests == -(-len(sessions) // 4)
+    # The students are shared
+    assert managers[5].student_manager is managers[6].student_manager
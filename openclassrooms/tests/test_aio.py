@@ -0,0 +1,108 @@
+import asyncio
+import json
+
+import pytest
+
+from openclassrooms.aio import AsyncOcAdapter
+
+from .test_adapter import FakeConnector
+
+
+class FakeAsyncConnector:
+    """Async wrapper around `FakeConnector`, limiting the requests in flight"""
+
+    def __init__(self, connector, concurrency):
+        self.connector = connector
+        self.semaphore = asyncio.Semaphore(concurrency)
+        self.in_flight = 0
+        self.max_in_flight = 0
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        pass
+
+    async def get(self, url, params=None, parser=None):
+        async with self.semaphore:
+            self.in_flight += 1
+            self.max_in_flight = max(self.max_in_flight, self.in_flight)
+            await asyncio.sleep(0.001)
+            self.in_flight -= 1
+            content = self.connector.get(url, params=params).content
+        if parser is None:
+            return content
+
+        parser.feed(content)
+        return parser.close()
+
+    async def get_json(self, url, params=None):
+        return json.loads(self.connector.get(url, params=params).content)
+
+
+class FakeAsyncOcAdapter(AsyncOcAdapter):
+    def async_connector_class(self, connector, **kwargs):
+        self.async_connector = FakeAsyncConnector(connector, **kwargs)
+        return self.async_connector
+
+
+def test_async_adapter(month_sessions):
+    connector = FakeConnector(month_sessions)
+    adapter = FakeAsyncOcAdapter(None, None, concurrency=3, connector=connector)
+
+    adapter.get_sessions_for_month(None)
+
+    assert len(adapter.manager.sessions) == len(month_sessions) - 1
+    students = adapter.manager.student_manager.students.values()
+    assert all(s.financed is True for s in students)
+    assert connector.student_requests == len(students)
+    assert 1 < adapter.async_connector.max_in_flight <= 3
+
+
+def test_async_connector():
+    pytest.importorskip("aiohttp")
+    from aiohttp import web
+    from aiohttp.test_utils import TestServer
+    from requests.cookies import RequestsCookieJar
+
+    from openclassrooms.aio import AsyncOcConnector
+    from openclassrooms.ratelimit import RateLimiter
+
+    hits = []
+
+    async def handler(request):
+        hits.append(request)
+        if len(hits) == 1:
+            return web.Response(status=429, headers={"Retry-After": "0"})
+
+        return web.json_response(
+            {
+                "auth": request.headers.get("Authorization"),
+                "cookie": request.cookies.get("access_token"),
+                "before": request.query.get("before"),
+            }
+        )
+
+    class Connector:
+        user_id = 1
+        limiter = RateLimiter()
+
+    sync_connector = Connector()
+    sync_connector.session = type("Session", (), {})()
+    sync_connector.session.headers = {"Authorization": "Bearer abc"}
+    sync_connector.session.cookies = RequestsCookieJar()
+    sync_connector.session.cookies.set("access_token", "abc")
+
+    async def run():
+        app = web.Application()
+        app.router.add_get("/sessions", handler)
+        async with TestServer(app) as server:
+            url = str(server.make_url("/sessions"))
+            async with AsyncOcConnector(sync_connector, concurrency=2) as connector:
+                return await connector.get_json(url, params={"before": "now"})
+
+    assert asyncio.run(run()) == {
+        "auth": "Bearer abc",
+        "cookie": "abc",
+        "before": "now",
+    }
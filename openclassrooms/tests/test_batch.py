@@ -0,0 +1,79 @@
+import json
+import threading
+import time
+
+import pytest
+from requests.cookies import RequestsCookieJar
+
+from openclassrooms.batch import create_invoices, load_credentials
+from openclassrooms.connector import OcConnector
+from openclassrooms.tokens import TokenStore
+
+from .test_adapter import FakeConnector
+
+
+def test_load_credentials(tmp_path):
+    path = tmp_path / "credentials.json"
+    path.write_text(
+        json.dumps(
+            [
+                {"name": "Alice B.", "username": "alice", "password": "a"},
+                {"username": "bob@example.com", "password": "b"},
+            ]
+        )
+    )
+    accounts = load_credentials(path)
+    assert [a["name"] for a in accounts] == ["Alice_B.", "bob@example.com"]
+
+    path.write_text(json.dumps([{"username": "alice"}]))
+    with pytest.raises(RuntimeError):
+        load_credentials(path)
+
+    with pytest.raises(RuntimeError):
+        load_credentials(tmp_path / "missing.json")
+
+
+def test_create_invoices(month_sessions, tmp_path, monkeypatch):
+    """The connectors of the accounts share the slots of `OcConnector._request`"""
+    in_flight = {"now": 0, "max": 0}
+    lock = threading.Lock()
+    fake = FakeConnector(month_sessions)
+
+    def send(self, method, url, **kwargs):
+        with lock:
+            in_flight["now"] += 1
+            in_flight["max"] = max(in_flight["max"], in_flight["now"])
+        time.sleep(0.002)
+        with lock:
+            in_flight["now"] -= 1
+        return fake.get(url, **kwargs)
+
+    monkeypatch.setattr(OcConnector, "_send", send)
+    # No saved token: logs in, and fails
+    monkeypatch.setattr(OcConnector, "_authenticate", lambda *args: False)
+
+    accounts = []
+    for name in ("alice", "bob", "carol", "broken"):
+        accounts.append({"name": name, "username": name, "password": "x"})
+        if name != "broken":
+            account_dir = tmp_path / "accounts" / name
+            account_dir.mkdir(parents=True)
+            TokenStore.in_directory(account_dir).save(
+                "abc", 1, time.time() + 3600, RequestsCookieJar()
+            )
+
+    paths, errors = create_invoices(
+        accounts,
+        output_dir=tmp_path / "html",
+        data_dir=tmp_path / "accounts",
+        workers=3,
+    )
+
+    assert sorted(paths) == ["alice", "bob", "carol"]
+    assert list(errors) == ["broken"]
+    for name, path in paths.items():
+        assert open(path).read().startswith("<!DOCTYPE html>")
+        # One database per account
+        assert (tmp_path / "accounts" / name / "oc.db").exists()
+    # The accounts are crawled concurrently, with at most 3 requests at once
+    assert 1 < in_flight["max"] <= 3
@@ -0,0 +1,50 @@
+import json
+
+import pytest
+
+from openclassrooms.cassette import Cassette
+from openclassrooms.connector import OcConnector
+
+
+def test_cassette_record_replay(saved_token, server, tmp_path):
+    path = tmp_path / "cassette"
+    connector = OcConnector(backoff_factor=0, cassette=Cassette(path, mode="record"))
+    resp = connector.get(f"{server}/a", params={"before": "2021-03-01T00:00:00Z"})
+    assert resp.status_code == 200
+    assert json.loads((path / "meta.json").read_text())["user_id"] == 1
+
+    # Offline, and without a token
+    (tmp_path / "token.json").unlink()
+    cassette = Cassette(path, latency=0.001)
+    connector = OcConnector("user", "password", cassette=cassette)
+    assert connector.user_id == 1
+
+    resp = connector.get(f"{server}/a", params={"before": "2021-03-01T00:00:00Z"})
+    assert resp.status_code == 200
+    assert resp.json() == {}
+    assert cassette.played == 1
+
+    with pytest.raises(RuntimeError):
+        connector.get(f"{server}/b")
+
+
+def test_cassette_throttle(tmp_path):
+    url = "https://openclassrooms.com/fr/mentorship/students/1/dashboard"
+    cassette = Cassette(tmp_path, mode="record")
+    cassette.save_meta(1)
+    cassette.save("GET", url, {}, 200, {}, b"ok")
+
+    cassette = Cassette(tmp_path, throttle=1)
+    connector = OcConnector(cassette=cassette)
+
+    assert connector.get(url).content == b"ok"
+    assert cassette.throttled == 1
+    assert connector.retry_count == 1
+    # The rate limiter slows down, as with a real 429
+    bucket = connector.limiter.bucket(url)
+    assert bucket.rate < bucket.max_rate
+
+
+def test_cassette_missing(tmp_path):
+    with pytest.raises(RuntimeError):
+        Cassette(tmp_path / "missing")
@@ -0,0 +1,117 @@
+import csv
+from datetime import datetime, timezone
+
+import pytest
+
+from openclassrooms import columnar
+from openclassrooms.columnar import SessionColumns
+from openclassrooms.session import SessionManager, Status
+
+STATUSES = ["completed", "marked student as absent", "canceled", "pending"]
+
+
+@pytest.fixture(params=["numpy", "array"])
+def backend(request, monkeypatch):
+    if request.param == "array":
+        monkeypatch.setattr(columnar, "numpy", None)
+    return request.param
+
+
+@pytest.fixture
+def managers():
+    managers = {}
+    for month in (1, 2, 3):
+        manager = managers[month] = SessionManager(month=month)
+        for i in range(20):
+            manager.add(
+                session_id=month * 100 + i,
+                session_date=datetime(2021, month, i + 1, 10, tzinfo=timezone.utc),
+                student_id=i % 4,
+                student_name=f"Student {i % 4}",
+                level=i % 3 + 1,
+                status=STATUSES[i % 4],
+                soutenance=i % 10 == 0,
+            )
+        for student in manager.student_manager.students.values():
+            student.financed = student.student_id % 2 == 0
+    return managers
+
+
+def sessions_of(managers):
+    return [s for manager in managers.values() for s in manager.sessions.values()]
+
+
+def test_columns_revenue(managers, backend):
+    columns = SessionColumns.from_managers(managers.values())
+    sessions = sessions_of(managers)
+    assert len(columns) == len(sessions) == 60
+
+    expected = {}
+    for s in sessions:
+        key = (s.session_date.month, s.level)
+        expected[key] = expected.get(key, 0) + s.price
+
+    assert columns.revenue("month", "level") == pytest.approx(expected)
+    assert list(columns.revenue("month", "level")) == sorted(expected)
+    assert columns.revenue() == {(): pytest.approx(sum(s.price for s in sessions))}
+
+
+def test_columns_rates(managers, backend):
+    columns = SessionColumns.from_managers(managers.values())
+    sessions = sessions_of(managers)
+
+    held = [s for s in sessions if s.completed or s.noshow]
+    rate = sum(s.noshow for s in held) / len(held)
+    assert columns.noshow_rate() == {(): pytest.approx(rate)}
+
+    ratios = columns.financed_ratio("month")
+    assert ratios == pytest.approx({(1,): 0.5, (2,): 0.5, (3,): 0.5})
+
+    # Counts, restricted to a level
+    counts = columns.group_by("month", where=columns.mask(level=1))
+    assert counts == {(1,): 7, (2,): 7, (3,): 7}
+
+
+def test_columns_mask(managers, backend):
+    columns = managers[1].columns()
+    mask = columns.mask(status=(Status.COMPLETED, Status.NOSHOW), soutenance=0)
+
+    expected = [
+        (s.completed or s.noshow) and not s.soutenance
+        for s in managers[1].sessions.values()
+    ]
+    assert list(map(bool, mask)) == expected
+
+
+def test_columns_empty(backend):
+    columns = SessionManager().columns()
+    assert len(columns) == 0
+    assert columns.revenue("month") == {}
+    assert columns.noshow_rate() == {}
+
+
+def test_columns_csv(managers, backend, tmp_path):
+    columns = managers[1].columns()
+    columns.to_csv(tmp_path / "sessions.csv")
+
+    with open(tmp_path / "sessions.csv", newline="") as fp:
+        rows = list(csv.DictReader(fp))
+
+    assert len(rows) == 20
+    assert rows[1]["status"] == "noshow"
+    assert float(rows[1]["price"]) == managers[1].sessions[101].price
+    assert int(rows[1]["student_id"]) == 1
+
+
+def test_columns_parquet(managers, backend, tmp_path):
+    parquet = pytest.importorskip("pyarrow.parquet")
+
+    columns = SessionColumns.from_managers(managers.values())
+    columns.to_parquet(tmp_path / "sessions.parquet")
+
+    table = parquet.read_table(tmp_path / "sessions.parquet")
+    assert table.num_rows == 60
+    assert table.column("status").to_pylist()[:2] == ["completed", "noshow"]
+    assert sum(table.column("price").to_pylist()) == pytest.approx(
+        sum(columns.revenue().values())
+    )
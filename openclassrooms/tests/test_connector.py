@@ -0,0 +1,237 @@
+import base64
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+from requests.cookies import RequestsCookieJar
+
+from openclassrooms.cassette import make_response
+from openclassrooms.connector import REFRESH_MARGIN, REFRESH_RETRY, OcConnector
+from openclassrooms.constants import API_ME_URL, CSRF_URL
+from openclassrooms.tokens import TokenStore, dump_cookies, token_expiry
+
+
+def make_jwt(exp):
+    payload = base64.urlsafe_b64encode(json.dumps({"exp": exp}).encode())
+    return f"header.{payload.decode().rstrip('=')}.signature"
+
+
+def test_connector_retries(saved_token, server):
+    connector = OcConnector(backoff_factor=0)
+    assert connector.access_token == "abc"
+
+    assert connector.get(f"{server}/a").status_code == 200
+    assert connector.get(f"{server}/b").status_code == 200
+
+    stats = connector.stats
+    assert stats["retries"] == 4
+    assert stats["requests"] == 6
+    # Keep-alive: everything goes through the same connection
+    assert stats["new_connections"] == 1
+    assert stats["reused_connections"] == 5
+
+
+def test_connector_retries_rate_limited(saved_token, server):
+    """The retries of urllib3 go through the rate limiter too"""
+    connector = OcConnector(backoff_factor=0)
+    acquired = []
+    connector.limiter.acquire = acquired.append
+
+    connector.get(f"{server}/a")
+
+    assert len(acquired) == 3
+    assert {url.rsplit("/", 1)[-1] for url in acquired} == {"a"}
+
+
+def test_connector_slots_streamed(saved_token, closing_server):
+    """A streamed response keeps its slot until it is closed"""
+    url, _ = closing_server
+    slots = threading.BoundedSemaphore(1)
+    connector = OcConnector(slots=slots)
+
+    assert connector.get(f"{url}/keep").status_code == 200
+    assert slots.acquire(blocking=False)
+    slots.release()
+
+    resp = connector.get(f"{url}/keep", stream=True)
+    assert not slots.acquire(blocking=False)
+    assert resp.json() == {}
+    resp.close()
+    resp.close()
+    assert slots.acquire(blocking=False)
+    slots.release()
+
+    with connector.get(f"{url}/keep", stream=True):
+        assert not slots.acquire(blocking=False)
+    assert slots.acquire(blocking=False)
+
+
+@pytest.fixture
+def closing_server():
+    """Local server closing the connection after each response to /close"""
+    connections = []
+
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def setup(self):
+            connections.append(self.client_address)
+            super().setup()
+
+        def do_GET(self):
+            body = b"{}"
+            self.send_response(200)
+            self.send_header("Content-Length", str(len(body)))
+            if self.path == "/close":
+                self.send_header("Connection", "close")
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    httpd = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    thread = threading.Thread(target=httpd.serve_forever, daemon=True)
+    thread.start()
+    yield f"http://127.0.0.1:{httpd.server_port}", connections
+    httpd.shutdown()
+
+
+def test_connector_dropped_connections(saved_token, closing_server):
+    """The connections opened again once dropped are new connections"""
+    url, connections = closing_server
+    connector = OcConnector()
+
+    for path in ("/keep", "/keep", "/close", "/close", "/close"):
+        assert connector.get(f"{url}{path}").status_code == 200
+
+    stats = connector.stats
+    assert len(connections) == 3
+    assert stats["new_connections"] == 3
+    assert stats["reused_connections"] == 2
+
+
+def test_token_expiry():
+    assert token_expiry(make_jwt(1700000000)) == 1700000000
+    # Not a JWT: the default lifetime
+    assert abs(token_expiry("abc") - time.time() - 3500) < 5
+
+
+def test_token_store(tmp_path):
+    store = TokenStore(tmp_path / "token.json")
+    assert store.load() is None
+
+    jar = RequestsCookieJar()
+    jar.set("access_token", "abc", domain=".openclassrooms.com", secure=True)
+    jar.set("session", "xyz", domain="openclassrooms.com", rest={"HttpOnly": None})
+
+    expires = time.time() + 600
+    store.save("abc", 1, expires, jar)
+    data = store.load()
+    assert data["token"] == "abc"
+    assert abs(data["expires"] - expires) < 1e-3
+    assert dump_cookies(data["cookies"]) == dump_cookies(jar)
+    # Expires within the margin
+    assert store.load(margin=900) is None
+
+
+def test_token_store_old_version(tmp_path):
+    """Files of older versions (with pickled cookies) are ignored"""
+    path = tmp_path / "token.json"
+    path.write_text(json.dumps({"token": "abc", "user_id": 1, "expires": "2099-01-01"}))
+    assert TokenStore(path).load() is None
+
+
+def test_connector_single_login(tmp_path, monkeypatch):
+    """Concurrent connectors log in only once, and share the token"""
+    monkeypatch.chdir(tmp_path)
+    logins = []
+
+    def authenticate(self, username, password):
+        logins.append(username)
+        time.sleep(0.1)
+        self.access_token = make_jwt(int(time.time()) + 3600)
+        self.user_id = 42
+        return True
+
+    monkeypatch.setattr(OcConnector, "_authenticate", authenticate)
+
+    connectors = []
+
+    def connect():
+        # A store per connector: each opens its own lock file descriptor
+        connectors.append(OcConnector("user", "password", auto_refresh=False))
+
+    threads = [threading.Thread(target=connect) for _ in range(5)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert len(logins) == 1
+    assert {c.user_id for c in connectors} == {42}
+    assert len({c.access_token for c in connectors}) == 1
+
+
+def test_connector_login_failed(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(OcConnector, "_authenticate", lambda *args: False)
+
+    with pytest.raises(RuntimeError):
+        OcConnector("user", "wrong")
+
+
+@pytest.fixture
+def expiring_connector(saved_token):
+    """A connector whose token (and cookie) is about to expire"""
+    connector = OcConnector("user", "password", auto_refresh=False)
+
+    jar = RequestsCookieJar()
+    jar.set("access_token", "old", domain=".openclassrooms.com")
+    connector.token_store.save("old", 1, time.time() + 100, jar)
+    connector.load_token()
+
+    responses = {CSRF_URL: {"csrf": "state"}, API_ME_URL: {"id": 42}}
+    connector.get = lambda url, **kwargs: make_response(
+        url, 200, json.dumps(responses[url]).encode()
+    )
+    yield connector
+    connector.close()
+
+
+def test_connector_refresh(expiring_connector):
+    connector = expiring_connector
+    token = make_jwt(int(time.time()) + 3600)
+
+    def post(url, session, **kwargs):
+        # The shared session keeps the old token during the login
+        assert connector.session.cookies["access_token"] == "old"
+        assert connector.session.headers["Authorization"] == "Bearer old"
+        session.cookies.set("access_token", token)
+
+    connector.post = post
+    connector._refresh()
+
+    assert connector.access_token == token
+    assert connector.session.headers["Authorization"] == f"Bearer {token}"
+    assert connector.session.cookies["access_token"] == token
+    assert connector.user_id == 42
+    assert connector.token_store.load()["token"] == token
+    # Next renewal: shortly before the new token expires
+    delay = connector._refresh_timer.interval
+    assert abs(delay - (connector.expires - REFRESH_MARGIN - time.time())) < 5
+    assert delay > 3000
+
+
+def test_connector_refresh_failed(expiring_connector):
+    """A login that sets no new cookie is a failure, retried later"""
+    connector = expiring_connector
+    connector.post = lambda url, **kwargs: None
+
+    connector._refresh()
+
+    assert connector.access_token == "old"
+    assert connector.token_store.load()["token"] == "old"
+    assert connector._refresh_timer.interval == REFRESH_RETRY
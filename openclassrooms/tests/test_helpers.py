@@ -0,0 +1,54 @@
+import os
+
+import dateutil.parser
+import pytest
+
+from openclassrooms.helpers import atomic_write, json_loads, parse_date
+
+
+def test_atomic_write(tmp_path):
+    path = tmp_path / "report.html"
+    path.write_text("previous")
+    os.chmod(path, 0o640)
+
+    with atomic_write(path) as fp:
+        fp.write("new")
+        assert path.read_text() == "previous"
+
+    assert path.read_text() == "new"
+    assert os.stat(path).st_mode & 0o777 == 0o640
+
+
+def test_atomic_write_error(tmp_path):
+    path = tmp_path / "report.html"
+    path.write_text("previous")
+
+    with pytest.raises(RuntimeError):
+        with atomic_write(path) as fp:
+            fp.write("partial")
+            raise RuntimeError
+
+    assert path.read_text() == "previous"
+    assert list(tmp_path.iterdir()) == [path]
+
+
+@pytest.mark.parametrize(
+    "value",
+    [
+        "2021-03-01T10:00:00+0000",
+        "2021-03-01T10:00:00Z",
+        "2021-03-01T10:00:00.123+0200",
+        "2021-03-01T10:00:00-05:30",
+        "2021-03-01T10:00:00",
+        "1 March 2021 10:00 UTC",
+    ],
+)
+def test_parse_date(value):
+    # Same result as dateutil, which it replaces
+    assert parse_date(value) == dateutil.parser.parse(value)
+    assert parse_date(value).utcoffset() == dateutil.parser.parse(value).utcoffset()
+
+
+def test_json_loads():
+    assert json_loads(b'[{"id": 1, "name": "\xc3\xa9"}]') == [{"id": 1, "name": "é"}]
+    assert json_loads('{"a": null}') == {"a": None}
@@ -0,0 +1,155 @@
+import threading
+from datetime import datetime, timedelta, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from unittest.mock import Mock
+
+import pytest
+
+from openclassrooms.adapter import OcAdapter
+from openclassrooms.cassette import make_response
+from openclassrooms.connector import OcConnector
+from openclassrooms.httpcache import DEFAULT_POLICIES, HttpCache
+
+
+@pytest.fixture
+def server():
+    """Local server with an ETag for each path, answering 304 when it matches"""
+    bodies = {"/page": b"version 1", "/other": b"other", "/private": b"secret"}
+    requests = []
+
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def do_GET(self):
+            body = bodies[self.path]
+            etag = f'"{hash(body)}"'
+            requests.append((self.path, self.headers.get("If-None-Match")))
+
+            if self.headers.get("If-None-Match") == etag:
+                self.send_response(304)
+                self.send_header("ETag", etag)
+                self.send_header("Content-Length", "0")
+                self.end_headers()
+                return
+
+            self.send_response(200)
+            self.send_header("ETag", etag)
+            self.send_header("Content-Length", str(len(body)))
+            if self.path == "/private":
+                self.send_header("Cache-Control", "no-store")
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    httpd = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    thread = threading.Thread(target=httpd.serve_forever, daemon=True)
+    thread.start()
+    yield f"http://127.0.0.1:{httpd.server_port}", bodies, requests
+    httpd.shutdown()
+
+
+def test_cache_revalidate(saved_token, server, tmp_path):
+    url, bodies, requests = server
+    cache = HttpCache(tmp_path / "cache", policies=((url, 0),))
+    connector = OcConnector(cache=cache)
+
+    assert connector.get(f"{url}/page").content == b"version 1"
+    # Stale at once: revalidated, and answered from the cache
+    resp = connector.get(f"{url}/page")
+    assert resp.status_code == 200
+    assert resp.content == b"version 1"
+    path, etag = requests[1]
+    assert path == "/page" and etag is not None
+
+    # Changed: downloaded again
+    bodies["/page"] = b"version 2"
+    assert connector.get(f"{url}/page").content == b"version 2"
+
+    stats = cache.stats
+    assert (stats["hits"], stats["revalidated"], stats["misses"]) == (0, 1, 2)
+    assert stats["hit_rate"] == pytest.approx(1 / 3)
+    assert connector.stats["cache"]["revalidated"] == 1
+
+
+def test_cache_fresh(saved_token, server, tmp_path):
+    url, _, requests = server
+    policies = ((f"{url}/page", 3600), (f"{url}/other", 0))
+    connector = OcConnector(cache=HttpCache(tmp_path / "cache", policies))
+
+    for _ in range(3):
+        assert connector.get(f"{url}/page").content == b"version 1"
+        assert connector.get(f"{url}/other").content == b"other"
+
+    # Fresh for an hour: asked once. The other one is revalidated each time
+    assert [path for path, _ in requests] == ["/page"] + ["/other"] * 3
+
+    # Shared by the next runs
+    cache = HttpCache(tmp_path / "cache", policies)
+    connector = OcConnector(cache=cache)
+    assert connector.get(f"{url}/page", stream=True).content == b"version 1"
+    assert cache.stats["hits"] == 1
+
+
+def test_cache_not_stored(saved_token, server, tmp_path):
+    url, _, requests = server
+    cache = HttpCache(tmp_path / "cache", policies=((f"{url}/private", 3600),))
+    connector = OcConnector(cache=cache)
+
+    # no-store, and no policy
+    for _ in range(2):
+        assert connector.get(f"{url}/private").content == b"secret"
+        assert connector.get(f"{url}/other").content == b"other"
+
+    assert len(requests) == 4
+    assert all(etag is None for _, etag in requests)
+    assert cache.stats["misses"] == 2
+
+
+def test_cache_policies(tmp_path):
+    cache = HttpCache(tmp_path, DEFAULT_POLICIES)
+    student = "https://openclassrooms.com/fr/mentorship/students/1/dashboard"
+    sessions = "https://api.openclassrooms.com/users/1/sessions"
+
+    assert cache.max_age(student) > cache.max_age(sessions) > 0
+    assert cache.max_age("https://api.openclassrooms.com/me") is None
+    assert cache.max_age("https://openclassrooms.com/login_check") is None
+
+    # A page of sessions is cached by its parameters and range
+    params = {"before": "2021-03-01T00:00:00Z"}
+    page = {"Range": "items=0-99"}
+    cache.store(sessions, params, page, make_response(sessions, 200, b"[]"))
+
+    entry = cache.lookup(sessions, params, page)
+    assert entry["content"] == b"[]" and cache.is_fresh(entry)
+    assert cache.lookup(sessions, params, {"Range": "items=0-9"}) is None
+    assert cache.lookup(sessions, {"before": "2021-02-01T00:00:00Z"}, page) is None
+
+
+def test_cache_bypassed(saved_token, server, tmp_path):
+    url, _, requests = server
+    cache = HttpCache(tmp_path / "cache", policies=((url, 3600),))
+    connector = OcConnector(cache=cache)
+
+    for _ in range(2):
+        assert connector.get(f"{url}/page", cache=False).content == b"version 1"
+
+    assert len(requests) == 2
+    assert cache.stats["misses"] == 0
+    assert list((tmp_path / "cache").iterdir()) == []
+
+
+def test_cache_sessions_pages():
+    """The first page of the current month is never requested again"""
+    connector = Mock()
+    connector.get.return_value = make_response("", 200, b"[]")
+    adapter = OcAdapter(None, None, connector=connector)
+
+    now = datetime.now(timezone.utc)
+    adapter._fetch_page(now)
+    adapter._fetch_page(now - timedelta(days=1))
+
+    first, second = connector.get.call_args_list
+    assert first.kwargs["cache"] is False
+    assert "cache" not in second.kwargs
@@ -0,0 +1,126 @@
+import argparse
+import io
+import time
+from datetime import datetime, timezone
+
+import pytest
+from requests.cookies import RequestsCookieJar
+
+from openclassrooms import invoice as invoice_module
+from openclassrooms.invoice import (
+    Invoice,
+    compile_templates,
+    get_environment,
+    make_adapter,
+    parse_months,
+    select_months,
+)
+from openclassrooms.session import SessionManager
+from openclassrooms.student import Student
+from openclassrooms.tokens import TokenStore
+
+
+def test_parse_months():
+    assert parse_months("5") == [5]
+    assert parse_months("1-12") == list(range(1, 13))
+
+    for value in ("0", "3-13", "5-2", "may"):
+        with pytest.raises(argparse.ArgumentTypeError):
+            parse_months(value)
+
+
+def test_select_months():
+    now = datetime.now()
+    past = list(range(1, now.month + 1))
+
+    # The current year stops at the current month
+    assert select_months(list(range(1, 13))) == past
+    assert select_months(None, now.year) == past
+    assert select_months([5], now.year - 1) == [5]
+    assert select_months(None, now.year - 1) == list(range(1, 13))
+    assert select_months(None, now.year - 1, month=3) == [3]
+    if now.month < 12:
+        assert select_months([12], now.year) == []
+
+
+@pytest.fixture
+def manager():
+    student = Student(1, "Student", financed=True)
+    manager = SessionManager(month=6)
+    for session_id, status in enumerate(["completed", "marked student as absent"]):
+        manager.add(
+            session_id=session_id,
+            session_date=datetime(2021, 6, session_id + 1, 10, tzinfo=timezone.utc),
+            level=2,
+            status=status,
+            soutenance=False,
+            student=student,
+        )
+    return manager
+
+
+def test_invoice_render(manager):
+    invoice = Invoice(manager, 1.5)
+
+    text = invoice.render(html=False)
+    assert "Invoice / month 6" in text
+    assert "== TOTAL: 52.50" in text
+
+    html = invoice.render(html=True)
+    assert "TOTAL: 52.50" in html
+    assert get_environment() is get_environment()
+
+
+def test_invoice_render_twice(manager):
+    """The total starts from zero on each rendering"""
+    invoice = Invoice(manager, 1.5)
+
+    for html in (False, True):
+        first = invoice.render(html=html)
+        second = invoice.render(html=html)
+        assert "TOTAL: 52.50" in second
+        assert second == first
+
+
+def test_compile_templates(tmp_path, monkeypatch):
+    """The bytecode of the templates is kept in TEMPLATE_CACHE_DIR"""
+    monkeypatch.setattr(invoice_module, "TEMPLATE_CACHE_DIR", str(tmp_path))
+    monkeypatch.setattr(invoice_module, "_environment", None)
+
+    compile_templates()
+    env = get_environment()
+    assert len(list(tmp_path.iterdir())) == len(env.list_templates())
+    assert env.bytecode_cache.directory == str(tmp_path)
+
+
+def test_invoice_stream(manager, tmp_path):
+    invoice = Invoice(manager, 1.5)
+    expected = invoice.render(html=True)
+
+    fp = io.StringIO()
+    invoice.stream(fp, html=True)
+    assert fp.getvalue() == expected
+
+    path = tmp_path / "report.html"
+    invoice.write(path, html=True)
+    assert path.read_text() == expected
+    assert list(tmp_path.iterdir()) == [path]
+
+
+def test_make_adapter_data_dir(tmp_path, monkeypatch):
+    """The token, the database and the cache live in the data directory"""
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setenv("OC_USERNAME", "user")
+    monkeypatch.setenv("OC_PASSWORD", "password")
+    data_dir = tmp_path / "data"
+    data_dir.mkdir()
+    TokenStore.in_directory(data_dir).save(
+        "abc", 1, time.time() + 3600, RequestsCookieJar()
+    )
+
+    adapter = make_adapter(http_cache=True, data_dir=str(data_dir))
+    adapter.connector.close()
+
+    assert adapter.connector.access_token == "abc"
+    assert {path.name for path in data_dir.iterdir()} >= {"oc.db", "http-cache"}
+    assert list(tmp_path.iterdir()) == [data_dir]
@@ -0,0 +1,78 @@
+import json
+
+from openclassrooms import metrics
+from openclassrooms.adapter import OcAdapter
+from openclassrooms.invoice import Invoice
+from openclassrooms.metrics import JsonFileSink, Registry, prometheus_text
+
+from .test_adapter import FakeConnector
+
+
+def test_registry():
+    registry = Registry()
+    registry.inc("requests")
+    registry.inc("requests", 2)
+    for value in (0.002, 0.02, 3):
+        registry.observe("page_seconds", value)
+
+    summary = registry.summary()
+    assert summary["counters"] == {"requests": 3}
+    page = summary["histograms"]["page_seconds"]
+    assert page["count"] == 3
+    assert page["min"] == 0.002
+    assert page["max"] == 3
+
+    with registry.timer("block_seconds"):
+        pass
+    assert registry.summary()["histograms"]["block_seconds"]["count"] == 1
+
+
+def test_prometheus_text():
+    registry = Registry()
+    registry.inc("requests", 3)
+    registry.observe("page_seconds", 0.02)
+    registry.observe("page_seconds", 20)
+
+    lines = prometheus_text(registry).splitlines()
+    assert "oc_requests_total 3" in lines
+    assert 'oc_page_seconds_bucket{le="0.01"} 0' in lines
+    assert 'oc_page_seconds_bucket{le="0.05"} 1' in lines
+    assert 'oc_page_seconds_bucket{le="+Inf"} 2' in lines
+    assert "oc_page_seconds_count 2" in lines
+
+
+def test_json_sink(tmp_path):
+    registry = Registry()
+    registry.inc("requests")
+    JsonFileSink(tmp_path / "metrics.json").emit(registry)
+
+    data = json.loads((tmp_path / "metrics.json").read_text())
+    assert data["counters"] == {"requests": 1}
+
+
+def test_stage_metrics(month_sessions):
+    metrics.REGISTRY.reset()
+    connector = FakeConnector(month_sessions)
+    adapter = OcAdapter(None, None, connector=connector)
+    adapter.get_sessions_for_month(None)
+    Invoice(adapter.manager, 0).render()
+
+    summary = metrics.REGISTRY.summary()
+    histograms = summary["histograms"]
+    # Each page but the first starts with the last session of the previous one
+    pages = histograms["sessions_page_seconds"]["count"]
+    assert (
+        histograms["process_session_seconds"]["count"]
+        == len(month_sessions) + pages - 1
+    )
+    # One per student page fetched
+    student_pages = connector.student_requests
+    assert student_pages >= 7
+    assert histograms["student_page_seconds"]["count"] == student_pages
+    assert histograms["student_parse_seconds"]["count"] == student_pages
+    assert histograms["render_seconds"]["count"] == 1
+    assert histograms["sessions_page_seconds"]["count"] >= 1
+    counters = summary["counters"]
+    lookups = counters.get("student_cache_misses", 0)
+    lookups += counters.get("student_cache_hits", 0)
+    assert lookups == len(month_sessions) - 1
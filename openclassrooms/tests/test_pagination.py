@@ -0,0 +1,87 @@
+import threading
+from datetime import datetime, timedelta, timezone
+
+from openclassrooms.pagination import SessionPaginator
+
+START = datetime(2021, 3, 1, tzinfo=timezone.utc)
+
+
+def make_sessions(dates):
+    """Sessions dictionaries, most recent first"""
+    sessions = [{"session_id": i, "session_date": d} for i, d in enumerate(dates)]
+    return sorted(sessions, key=lambda s: s["session_date"], reverse=True)
+
+
+def make_fetch(sessions, size=3):
+    """An API returning `size` sessions strictly before the cursor"""
+    calls = []
+
+    def fetch(before):
+        calls.append(before)
+        return [s for s in sessions if s["session_date"] < before][:size]
+
+    return fetch, calls
+
+
+def walk(paginator, fetch):
+    return [s["session_id"] for page in paginator(fetch) for s in page]
+
+
+def test_paginator_same_date():
+    # 3 sessions at the same second, across the first two pages
+    dates = [START + timedelta(hours=h) for h in (10, 9, 5, 5, 5, 3, 2, 1)]
+    sessions = make_sessions(dates)
+    fetch, _ = make_fetch(sessions)
+
+    ids = walk(SessionPaginator(START + timedelta(days=1), START), fetch)
+    # All of them, once
+    assert sorted(ids) == list(range(8))
+
+
+def test_paginator_empty_page():
+    sessions = make_sessions([START + timedelta(hours=i) for i in range(5)])
+    fetch, calls = make_fetch(sessions)
+
+    # The API has nothing before START: the walk stops on the empty page
+    paginator = SessionPaginator(START + timedelta(days=1), START - timedelta(days=365))
+    assert sorted(walk(paginator, fetch)) == list(range(5))
+    assert len(calls) == 4
+
+
+def test_paginator_stuck():
+    """An API that ignores the cursor still lets the walk end"""
+    page = make_sessions([START + timedelta(seconds=1)] * 3)
+    before = START + timedelta(seconds=3)
+    calls = []
+
+    def fetch(cursor):
+        calls.append(cursor)
+        return page
+
+    assert walk(SessionPaginator(before, START), fetch) == [0, 1, 2]
+    # Past the session date, then one second at a time down to `after`
+    second = timedelta(seconds=1)
+    assert calls == [before, START + 2 * second, START + second]
+
+
+def test_paginator_done():
+    paginator = SessionPaginator(START, START)
+    assert paginator.done
+    assert list(paginator(None)) == []
+
+
+def test_paginator_prefetch():
+    """The next page is requested before the current one is processed"""
+    sessions = make_sessions([START + timedelta(hours=i) for i in range(9)])
+    fetch, calls = make_fetch(sessions)
+    requested = threading.Event()
+
+    def fetch_and_notify(before):
+        page = fetch(before)
+        if len(calls) == 2:
+            requested.set()
+        return page
+
+    pages = SessionPaginator(START + timedelta(days=1), START)(fetch_and_notify)
+    next(pages)
+    assert requested.wait(1)
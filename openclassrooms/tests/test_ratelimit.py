@@ -0,0 +1,58 @@
+import asyncio
+import threading
+import time
+
+from openclassrooms.ratelimit import RateLimiter, TokenBucket
+
+
+def test_token_bucket_rate():
+    bucket = TokenBucket(rate=100, capacity=1)
+
+    start = time.monotonic()
+    threads = [
+        threading.Thread(target=lambda: [bucket.acquire() for _ in range(5)])
+        for _ in range(4)
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    # 20 requests, the first one without waiting
+    assert time.monotonic() - start >= 0.18
+
+
+def test_token_bucket_async():
+    bucket = TokenBucket(rate=100, capacity=1)
+
+    async def run():
+        start = time.monotonic()
+        await asyncio.gather(*(bucket.acquire_async() for _ in range(10)))
+        return time.monotonic() - start
+
+    assert asyncio.run(run()) >= 0.08
+
+
+def test_token_bucket_adapts():
+    bucket = TokenBucket(rate=10)
+
+    bucket.throttled(retry_after=0.1)
+    assert bucket.rate == 5
+
+    start = time.monotonic()
+    bucket.acquire()
+    assert time.monotonic() - start >= 0.09
+
+    for _ in range(100):
+        bucket.succeeded()
+    assert bucket.rate == 10
+
+
+def test_rate_limiter_hosts():
+    limiter = RateLimiter({"https://api.openclassrooms.com": 10})
+
+    assert limiter.bucket("https://api.openclassrooms.com/me") is not None
+    assert limiter.bucket("https://openclassrooms.com/fr/") is None
+
+    limiter.update("https://api.openclassrooms.com/me", 429)
+    assert limiter.bucket("https://api.openclassrooms.com/me").rate == 5
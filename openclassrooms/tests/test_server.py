@@ -0,0 +1,113 @@
+import threading
+import time
+from urllib.error import HTTPError
+from urllib.request import Request, urlopen
+
+import pytest
+
+from openclassrooms.adapter import OcAdapter
+from openclassrooms.invoice import Invoice
+from openclassrooms.server import InvoiceServer, InvoiceService
+
+from .test_adapter import CountingConnector
+
+
+@pytest.fixture
+def server(month_sessions):
+    connector = CountingConnector(month_sessions)
+    service = InvoiceService(OcAdapter(None, None, connector=connector))
+    service.refresh()
+
+    httpd = InvoiceServer(("127.0.0.1", 0), service, refresh=3600)
+    thread = threading.Thread(target=httpd.serve_forever, daemon=True)
+    thread.start()
+    httpd.url = f"http://127.0.0.1:{httpd.server_port}/invoice/{time.gmtime().tm_mon}"
+    httpd.connector = connector
+    yield httpd
+    httpd.shutdown()
+    httpd.server_close()
+
+
+def get(url, **headers):
+    try:
+        with urlopen(Request(url, headers=headers)) as resp:
+            return resp.status, resp.headers, resp.read()
+    except HTTPError as e:
+        return e.code, e.headers, b""
+
+
+def test_server_invoice(server):
+    requests = server.connector.session_requests
+
+    status, headers, body = get(server.url)
+    assert status == 200
+    assert headers["Content-Type"] == "text/html; charset=utf-8"
+    assert b"<html" in body.lower()
+
+    status, headers, text = get(server.url + ".txt")
+    assert status == 200
+    assert headers["Content-Type"].startswith("text/plain")
+
+    # Served from memory
+    assert server.connector.session_requests == requests
+    assert get(server.url)[2] == body
+
+
+def test_server_invoice_streamed(server, monkeypatch):
+    """Rendered outside of the lock, while it is sent, then kept"""
+    generate = Invoice.generate
+    locked = []
+
+    def check_lock(invoice, html=True):
+        locked.append(server.service._lock.locked())
+        return generate(invoice, html)
+
+    monkeypatch.setattr(Invoice, "generate", check_lock)
+
+    status, headers, body = get(server.url)
+    assert status == 200
+    assert headers["Content-Length"] is None
+    assert locked == [False]
+
+    status, headers, cached = get(server.url)
+    assert int(headers["Content-Length"]) == len(body)
+    assert cached == body
+    assert locked == [False]
+
+
+def test_server_not_modified(server):
+    _, headers, _ = get(server.url)
+
+    status, _, body = get(server.url, **{"If-None-Match": headers["ETag"]})
+    assert status == 304
+    assert body == b""
+
+    status, _, _ = get(server.url, **{"If-Modified-Since": headers["Last-Modified"]})
+    assert status == 304
+
+    status, _, _ = get(server.url, **{"If-None-Match": '"other"'})
+    assert status == 200
+
+
+def test_server_refresh(server, month_sessions):
+    _, headers, _ = get(server.url)
+
+    # Nothing changed: same version
+    server.service.refresh()
+    assert get(server.url)[1]["ETag"] == headers["ETag"]
+
+    month_sessions[0]["status"] = "marked student as absent"
+    server.service.refresh()
+    assert get(server.url)[1]["ETag"] != headers["ETag"]
+
+
+def test_server_not_found(server):
+    assert get(server.url.rsplit("/", 1)[0] + "/13")[0] == 404
+    assert get(server.url + ".pdf")[0] == 404
+
+
+def test_server_metrics(server):
+    get(server.url)
+    status, headers, body = get(server.url.rsplit("/", 2)[0] + "/metrics")
+    assert status == 200
+    assert b"# TYPE oc_sessions_page_seconds histogram" in body
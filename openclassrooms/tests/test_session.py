@@ -1,8 +1,11 @@
-from datetime import datetime
+import pickle
+import sys
+import threading
+from datetime import datetime, timedelta
 
 import pytest
 
-from openclassrooms.session import Session, SessionManager
+from openclassrooms.session import Session, SessionManager, Status
 from openclassrooms.student import Student
 
 
@@ -15,12 +18,23 @@ def session_manager():
 
     sm = SessionManager()
 
-    sm.add(datetime(2021, 6, 1, 1, 0), 1, "completed", False, financed)
-    sm.add(datetime(2021, 6, 2, 1, 0), 2, "canceled", False, financed)
-    sm.add(datetime(2021, 6, 3, 1, 0), 2, "completed", False, autof)
-    sm.add(datetime(2021, 6, 4, 1, 0), 3, "marked as absent", False, financed)
-    sm.add(datetime(2021, 6, 5, 1, 0), 2, "completed", True, financed)
-    sm.add(datetime(2021, 6, 6, 1, 0), 3, "completed", True, autof)
+    sessions = [
+        (datetime(2021, 6, 1, 1, 0), 1, "completed", False, financed),
+        (datetime(2021, 6, 2, 1, 0), 2, "canceled", False, financed),
+        (datetime(2021, 6, 3, 1, 0), 2, "completed", False, autof),
+        (datetime(2021, 6, 4, 1, 0), 3, "marked as absent", False, financed),
+        (datetime(2021, 6, 5, 1, 0), 2, "completed", True, financed),
+        (datetime(2021, 6, 6, 1, 0), 3, "completed", True, autof),
+    ]
+    for session_id, (date, level, status, soutenance, student) in enumerate(sessions):
+        sm.add(
+            session_id=session_id,
+            session_date=date,
+            level=level,
+            status=status,
+            soutenance=soutenance,
+            student=student,
+        )
 
     return sm
 
@@ -29,29 +43,37 @@ def test_session_price():
     student = Student(12345, "Test")
     student.financed = True
 
-    session = Session(
-        datetime.now(), level=1, status="completed", soutenance=False, student=student
-    )
+    def session(level=1, status="completed", soutenance=False):
+        return Session(1, datetime.now(), level, status, soutenance, student)
 
-    assert session.price == 30
+    completed = session()
+    assert completed.price == 30
+    assert session(level=2).price == 35
+    assert session(level=3).price == 40
 
-    session.level = 2
-    assert session.price == 35
+    # Cached until the financed status changes
+    student.financed = False
+    assert completed.price == 15
+    assert session(level=3).price == 20
 
-    session.level = 3
-    assert session.price == 40
+    assert session(level=3, soutenance=True).price == 40
+    assert session(level=3, soutenance=True, status="marked as absent").price == 20
+    assert session(level=3, soutenance=True, status="canceled").price == 0
 
-    student.financed = False
-    assert session.price == 20
 
-    session.soutenance = True
-    assert session.price == 40
+def test_session_read_only():
+    """The indexed fields cannot change behind the index of the manager"""
+    session = Session(1, datetime.now(), 1, "completed", False, Student(1, "Test"))
 
-    session.status = "marked as absent"
-    assert session.price == 20
+    for name, value in (("level", 2), ("status", "canceled"), ("soutenance", True)):
+        with pytest.raises(AttributeError):
+            setattr(session, name, value)
 
-    session.status = "canceled"
-    assert session.price == 0
+    assert (session.level, session.status, session.soutenance) == (
+        1,
+        "completed",
+        False,
+    )
 
 
 def test_session_manager(session_manager):
@@ -73,3 +95,171 @@ def test_session_manager_filter(session_manager):
         == 1
     )
     assert len(session_manager.filter(no_charge=True)) == 1
+
+
+def session_kwargs(session, **kwargs):
+    fields = ("session_id", "session_date", "level", "status", "soutenance", "student")
+    return dict({f: getattr(session, f) for f in fields}, **kwargs)
+
+
+def test_session_manager_filter_sorted(session_manager):
+    # Added in reverse order: the index keeps them sorted by date
+    manager = SessionManager()
+    for session in reversed(list(session_manager.sessions.values())):
+        manager.add(**session_kwargs(session))
+
+    dates = [s.session_date for s in manager.filter(soutenance=True)]
+    assert dates == sorted(dates)
+    assert manager.filter(level=2) == session_manager.filter(level=2)
+
+
+def test_session_manager_replace(session_manager):
+    session = session_manager.sessions[1]
+    assert session_manager.filter(no_charge=True) == [session]
+
+    # The session is completed since
+    session_manager.add(**session_kwargs(session, status="completed"))
+
+    assert session_manager.filter(no_charge=True) == []
+    assert len(session_manager.filter(level=2, noshow=False)) == 2
+    assert len(session_manager.sessions) == 6
+
+
+def test_session_manager_financed_updated(session_manager):
+    autof = session_manager.sessions[2].student
+    assert len(session_manager.filter(financed=True)) == 3
+
+    autof.financed = True
+    assert len(session_manager.filter(financed=True)) == 4
+
+
+def test_session_status():
+    assert Status.parse("marked student as absent") is Status.NOSHOW
+    assert Status.parse("Completed") is Status.COMPLETED
+    assert Status.parse("pending") is Status.PENDING
+    assert Status.parse("late canceled") is Status.OTHER
+
+
+def test_session_slots():
+    student = Student(12345, "Test")
+    session = Session(1, datetime.now(), 1, "completed", False, student)
+
+    with pytest.raises(AttributeError):
+        session.foo = 1
+    with pytest.raises(AttributeError):
+        student.foo = 1
+
+
+def test_session_manager_shards(session_manager):
+    shard = session_manager.shard()
+    assert shard.student_manager is session_manager.student_manager
+
+    session = session_manager.sessions[1]
+    shard.add(**session_kwargs(session, status="completed"))
+    shard.add(**session_kwargs(session, session_id=10, status="completed"))
+
+    assert session_manager.merge(shard) is session_manager
+    assert len(session_manager.sessions) == 7
+    assert session_manager.filter(no_charge=True) == []
+    assert session_manager.sessions[10].student is session.student
+
+
+def test_session_manager_extend(session_manager):
+    session = session_manager.sessions[1]
+    completed = Session(1, session.session_date, 2, "completed", False, session.student)
+    extra = Session(10, datetime(2021, 6, 7), 1, "pending", False, session.student)
+    late = Session(10, datetime(2021, 5, 31), 1, "completed", False, session.student)
+
+    session_manager.extend([completed, extra, late])
+    assert len(session_manager.sessions) == 7
+    assert session_manager.filter(no_charge=True) == []
+    # The last one wins, and the buckets are still sorted
+    assert session_manager.filter(level=1) == [late, session_manager.sessions[0]]
+
+
+def test_session_manager_pickle(session_manager):
+    manager = pickle.loads(pickle.dumps(session_manager))
+    ids = [s.session_id for s in session_manager.filter(level=2)]
+    assert [s.session_id for s in manager.filter(level=2)] == ids
+
+    # New locks, in both managers
+    manager.add(**session_kwargs(manager.sessions[1], session_id=10))
+    assert len(manager.sessions) == 7
+    student = manager.student_manager.get_or_create(789, name="New")
+    assert manager.student_manager.students[789] is student
+
+
+@pytest.fixture
+def fast_switch():
+    """Switches between threads as often as possible"""
+    interval = sys.getswitchinterval()
+    sys.setswitchinterval(1e-6)
+    yield
+    sys.setswitchinterval(interval)
+
+
+def test_session_manager_concurrent(fast_switch):
+    """Many producers, half of them on shards, while the sessions are read"""
+    manager = SessionManager()
+    start = datetime(2021, 6, 1)
+    producers, per_producer, students = 16, 200, 50
+    barrier = threading.Barrier(producers + 1)
+    shards = []
+    errors = []
+
+    def produce(worker):
+        target = manager.shard() if worker % 2 else manager
+        barrier.wait()
+        for i in range(per_producer):
+            session_id = worker * per_producer + i
+            target.add(
+                session_id=session_id,
+                session_date=start + timedelta(minutes=session_id),
+                level=i % 3 + 1,
+                status="pending",
+                soutenance=False,
+                student_id=session_id % students,
+                student_name=f"Student {session_id % students}",
+            )
+        # Completed since: replaced, and moved to another bucket of the index
+        for session_id in range(worker * per_producer, worker * per_producer + 20):
+            session = target.sessions[session_id]
+            target.add(**session_kwargs(session, status="completed"))
+        if target is not manager:
+            shards.append(target)
+
+    def read():
+        barrier.wait()
+        while any(thread.is_alive() for thread in threads):
+            try:
+                sessions = manager.filter(level=2, pending=True)
+                assert sessions == sorted(sessions, key=lambda s: s.session_date)
+                # Copied under the lock, while the producers add sessions
+                assert len(manager.columns()) >= len(sessions)
+            except Exception as e:
+                errors.append(e)
+                return
+
+    threads = [
+        threading.Thread(target=produce, args=(worker,)) for worker in range(producers)
+    ]
+    reader = threading.Thread(target=read)
+    for thread in threads + [reader]:
+        thread.start()
+    for thread in threads + [reader]:
+        thread.join()
+
+    assert errors == []
+    manager.merge(*shards)
+
+    total = producers * per_producer
+    assert len(manager.sessions) == total
+    assert sum(len(bucket) for bucket in manager._index.values()) == total
+    assert len(manager.filter(noshow=False)) == producers * 20
+    assert len(manager.filter(pending=True)) == total - producers * 20
+
+    # One student object per ID, shared by all their sessions
+    student_manager = manager.student_manager
+    assert len(student_manager.students) == students
+    for session in manager.sessions.values():
+        assert session.student is student_manager.students[session.student.student_id]
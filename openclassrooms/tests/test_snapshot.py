@@ -0,0 +1,75 @@
+from datetime import datetime, timezone
+
+import pytest
+
+from openclassrooms.invoice import Invoice
+from openclassrooms.session import SessionManager
+from openclassrooms.snapshot import Snapshot, load_snapshot, save_snapshot
+from openclassrooms.student import StudentManager
+
+
+@pytest.fixture
+def manager():
+    manager = SessionManager(month=3)
+    for i in range(10):
+        manager.add(
+            session_id=i,
+            session_date=datetime(2021, 3, i + 1, 10, tzinfo=timezone.utc),
+            student_id=i % 3,
+            student_name=f"Student {i % 3}",
+            level=i % 3 + 1,
+            status="completed" if i % 4 else "marked student as absent",
+            soutenance=i == 5,
+        )
+    for student in manager.student_manager.students.values():
+        student.financed = student.student_id != 0
+        student.fetched_at = 1600000000.0
+    return manager
+
+
+def test_snapshot_roundtrip(manager, tmp_path):
+    path = tmp_path / "demo.jsonl"
+    save_snapshot(manager, path)
+
+    loaded = load_snapshot(path)
+    assert loaded.month == 3
+    assert list(map(str, loaded.sessions.values())) == list(
+        map(str, manager.sessions.values())
+    )
+    assert [s.json() for s in loaded.student_manager.students.values()] == [
+        s.json() for s in manager.student_manager.students.values()
+    ]
+    # Same filters, same invoice
+    assert Invoice(loaded, 0).render() == Invoice(manager, 0).render()
+
+
+def test_snapshot_lazy(manager, tmp_path):
+    path = tmp_path / "demo.jsonl"
+    save_snapshot(manager, path)
+
+    snapshot = Snapshot(path)
+    assert snapshot.header["sessions"] == 10
+    assert snapshot.header["students"] == 3
+    first = next(snapshot.sessions())
+    assert first["session_date"] == datetime(2021, 3, 1, 10, tzinfo=timezone.utc)
+
+
+def test_snapshot_students(manager, tmp_path):
+    path = tmp_path / "students.jsonl"
+    save_snapshot(manager.student_manager, path)
+
+    students = load_snapshot(path)
+    assert isinstance(students, StudentManager)
+    assert students.students[1].financed is True
+    assert students.students[0].financed is False
+
+
+def test_snapshot_version(tmp_path):
+    path = tmp_path / "demo.jsonl"
+    path.write_text('{"format": "oc-tools/snapshot", "version": 99}\n')
+    with pytest.raises(RuntimeError):
+        Snapshot(path)
+
+    path.write_bytes(b"\x80\x04pickle")
+    with pytest.raises(RuntimeError):
+        Snapshot(path)
@@ -0,0 +1,58 @@
+import os
+import subprocess
+import sys
+from datetime import datetime, timezone
+
+from openclassrooms.session import SessionManager
+from openclassrooms.snapshot import save_snapshot
+
+ROOT = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# Loaded on first use only: the invoice command imports none of them
+HEAVY_MODULES = ("requests", "urllib3", "lxml", "jinja2", "dateutil", "aiohttp")
+
+
+def imported_modules(*args):
+    """Returns the modules imported by a new interpreter, with -X importtime"""
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", *args],
+        cwd=ROOT,
+        capture_output=True,
+        check=True,
+        text=True,
+    )
+    return {
+        line.split("|")[-1].strip()
+        for line in result.stderr.splitlines()
+        if line.startswith("import time:")
+    }
+
+
+def heavy(modules):
+    return sorted(m for m in modules if m.split(".")[0] in HEAVY_MODULES)
+
+
+def test_startup_imports():
+    modules = imported_modules("-c", "import openclassrooms.invoice")
+    assert "openclassrooms.invoice" in modules
+    assert heavy(modules) == []
+
+
+def test_startup_demo(tmp_path):
+    manager = SessionManager(month=3)
+    manager.add(
+        session_id=1,
+        session_date=datetime(2021, 3, 1, 10, tzinfo=timezone.utc),
+        student_id=1,
+        student_name="Student",
+        level=1,
+        status="completed",
+        soutenance=False,
+    )
+    save_snapshot(manager, tmp_path / "demo.jsonl")
+
+    modules = imported_modules(
+        "-m", "openclassrooms.invoice", "--demo", str(tmp_path / "demo.jsonl")
+    )
+    # Rendering needs the templates, but neither HTTP nor HTML parsing
+    assert {m.split(".")[0] for m in heavy(modules)} == {"jinja2"}
@@ -1,26 +1,44 @@
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
 from unittest.mock import Mock
+from urllib.parse import urlsplit
 
 import pytest
+import requests
 
-from openclassrooms.student import Student
+from openclassrooms import metrics, student as student_module
+from openclassrooms.student import FinancedStatusParser, Student, StudentManager
 
 
-class MockResponseNoData:
-    text = """<html><body></body></html>"""
+class MockResponse:
+    content = b""
 
+    def iter_content(self, chunk_size=1):
+        for i in range(0, len(self.content), chunk_size):
+            yield self.content[i : i + chunk_size]
 
-class MockResponseFinanced:
-    text = """<html><body><div class="mentorshipStudent__details oc-typography-body1">
+    def close(self):
+        pass
+
+
+class MockResponseNoData(MockResponse):
+    content = b"""<html><body></body></html>"""
+
+
+class MockResponseFinanced(MockResponse):
+    content = """<html><body><div class="mentorshipStudent__details oc-typography-body1">
     <p>
     Financé par un tiers
-    </p></div></body></html>"""
+    </p></div></body></html>""".encode()
 
 
-class MockResponseNotFinanced:
-    text = """<html><body><div class="mentorshipStudent__details oc-typography-body1">
+class MockResponseNotFinanced(MockResponse):
+    content = """<html><body><div class="mentorshipStudent__details oc-typography-body1">
     <p>
     Auto-financé
-    </p></div></body></html>"""
+    </p></div></body></html>""".encode()
 
 
 @pytest.fixture
@@ -63,6 +81,90 @@ def test_student_status_not_financed(connector_not_financed):
     assert autof.financed is False
 
 
+class MockResponseLong(MockResponse):
+    content = MockResponseFinanced.content + b"<div>" * 10000
+
+
+def test_financed_status_parser_stops_early():
+    page = MockResponseLong.content
+    parser = FinancedStatusParser()
+
+    chunks = MockResponseLong().iter_content(64)
+    for read, chunk in enumerate(chunks, 1):
+        if parser.feed(chunk) is not None:
+            break
+
+    assert parser.status == "Financé par un tiers"
+    assert read * 64 < len(page) / 10
+
+
+@pytest.fixture
+def page_server():
+    """Local server answering a long student page, counting its connections"""
+    page = MockResponseFinanced.content + b"<div></div>" * 20000
+    connections = []
+
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def setup(self):
+            connections.append(self.client_address)
+            super().setup()
+
+        def handle(self):
+            try:
+                super().handle()
+            except ConnectionResetError:
+                pass
+
+        def do_GET(self):
+            self.send_response(200)
+            self.send_header("Content-Length", str(len(page)))
+            self.end_headers()
+            try:
+                self.wfile.write(page)
+            except OSError:
+                pass
+
+        def log_message(self, *args):
+            pass
+
+    httpd = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    thread = threading.Thread(target=httpd.serve_forever, daemon=True)
+    thread.start()
+
+    session = requests.Session()
+    base = f"http://127.0.0.1:{httpd.server_port}"
+    connector = Mock()
+    connector.get = lambda url, **kwargs: session.get(
+        base + urlsplit(url).path, **kwargs
+    )
+    yield connector, connections
+    httpd.shutdown()
+
+
+@pytest.mark.parametrize("limit, expected", [(1024 * 1024, 1), (1024, 3)])
+def test_student_status_drain(page_server, monkeypatch, limit, expected):
+    """The rest of a short page is read, so that the connection is reused"""
+    connector, connections = page_server
+    monkeypatch.setattr(student_module, "DRAIN_LIMIT", limit)
+
+    for student_id in range(3):
+        assert Student(student_id, "Student").update_financed_status(connector)
+
+    assert len(connections) == expected
+
+
+def test_financed_status_parser_nested():
+    parser = FinancedStatusParser()
+    parser.feed(
+        b"""<div><p>Not this one</p></div>
+        <div class="mentorshipStudent__details"><span><p>Nested</p></span>
+        <p>Auto</p></div>"""
+    )
+    assert parser.close() == "Auto"
+
+
 def test_student_str():
     no_html = Student(12345, "Error")
     assert str(no_html) == "Error (unknown)"
@@ -78,3 +180,149 @@ def test_student_get_by_id():
     no_html = Student(12345, "Error")
 
     assert Student.get_by_id(12345) == no_html
+
+
+def test_student_manager_persistent(tmp_path):
+    db = tmp_path / "oc.db"
+
+    manager = StudentManager(persistent=True, path=db)
+    manager.get_or_create(1, name="Fresh", financed=True, fetched_at=time.time())
+    manager.get_or_create(2, name="Old", financed=False, fetched_at=time.time() - 100)
+    manager.get_or_create(3, name="Unknown")
+    manager.save()
+
+    manager = StudentManager(persistent=True, ttl=50, path=db)
+    assert set(manager.students) == {1, 2}
+    assert not manager.students[1].needs_update
+    # Expired: still has its value, but is fetched again
+    assert manager.students[2].financed is False
+    assert manager.students[2].needs_update
+
+
+def test_student_manager_keeps_most_recent(tmp_path):
+    db = tmp_path / "oc.db"
+
+    first = StudentManager(persistent=True, path=db)
+    second = StudentManager(persistent=True, path=db)
+    first.get_or_create(1, name="Student", financed=True, fetched_at=time.time())
+    second.get_or_create(1, name="Student", financed=False, fetched_at=1)
+    first.save()
+    second.save()
+
+    assert StudentManager(persistent=True, path=db).students[1].financed is True
+
+
+def test_student_manager_legacy_import(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    with open("students.json", "w") as fp:
+        json.dump([{"student_id": 1, "name": "Legacy", "financed": True}], fp)
+
+    manager = StudentManager(persistent=True)
+    assert manager.students[1].financed is True
+    assert not manager.students[1].needs_update
+
+
+class BlockingConnector:
+    """Serves the student page once `release` is set"""
+
+    def __init__(self, response):
+        self.response = response
+        self.started = threading.Event()
+        self.release = threading.Event()
+        self.requests = 0
+
+    def get(self, url, **kwargs):
+        self.requests += 1
+        self.started.set()
+        assert self.release.wait(5)
+        if isinstance(self.response, Exception):
+            raise self.response
+        return self.response
+
+
+def update_concurrently(manager, student, connector, threads=5):
+    """Updates the student from several threads, once the first is in flight"""
+    metrics.REGISTRY.reset()
+    results = []
+    errors = []
+
+    def update():
+        try:
+            results.append(manager.update_financed_status(student, connector))
+        except Exception as e:
+            errors.append(e)
+
+    workers = [threading.Thread(target=update) for _ in range(threads)]
+    workers[0].start()
+    assert connector.started.wait(5)
+    for worker in workers[1:]:
+        worker.start()
+
+    # The others wait for the first lookup
+    deadline = time.time() + 5
+    while metrics.REGISTRY.counters.get("student_lookups_saved", 0) < threads - 1:
+        assert time.time() < deadline
+        time.sleep(0.001)
+
+    connector.release.set()
+    for worker in workers:
+        worker.join()
+    return results, errors
+
+
+def test_student_manager_single_flight():
+    manager = StudentManager()
+    student = manager.get_or_create(1, name="Student")
+    connector = BlockingConnector(MockResponseNotFinanced())
+
+    results, errors = update_concurrently(manager, student, connector)
+
+    assert connector.requests == 1
+    assert results == [False] * 5 and errors == []
+    assert metrics.REGISTRY.counters["student_lookups_saved"] == 4
+    # Not in flight anymore, and up to date
+    assert manager.update_financed_status(student, connector) is False
+    assert connector.requests == 1
+
+
+def test_student_manager_single_flight_error():
+    manager = StudentManager()
+    student = manager.get_or_create(1, name="Student")
+    connector = BlockingConnector(RuntimeError("Unavailable"))
+
+    results, errors = update_concurrently(manager, student, connector)
+
+    # The waiting threads get the error of the lookup
+    assert connector.requests == 1
+    assert results == [] and len(errors) == 5
+
+    # The next lookup is made again
+    connector.response = MockResponseFinanced()
+    assert manager.update_financed_status(student, connector) is True
+    assert connector.requests == 2
+
+
+def test_student_manager_get_or_create_concurrent():
+    manager = StudentManager()
+    threads = 16
+    barrier = threading.Barrier(threads)
+    results = [None] * threads
+
+    def create(worker):
+        barrier.wait()
+        results[worker] = [
+            manager.get_or_create(student_id, name=f"Student {student_id}")
+            for student_id in range(500)
+        ]
+
+    workers = [threading.Thread(target=create, args=(i,)) for i in range(threads)]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+
+    # Every thread got the same student objects
+    assert len(manager.students) == 500
+    for students in results:
+        assert all(a is b for a, b in zip(students, results[0]))
+        assert students[42] is manager.students[42]
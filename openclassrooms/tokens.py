@@ -0,0 +1,156 @@
+"""Storage of the access token, shared by the processes of a directory
+
+The token file is written atomically, and a lock file makes sure that only
+one process logs in at a time: the others wait, and reuse its token. The
+cookies are stored in the same JSON file, next to the token.
+"""
+import base64
+import json
+import logging
+import os
+import time
+from contextlib import contextmanager
+from datetime import datetime, timezone
+
+from requests.cookies import RequestsCookieJar, create_cookie
+
+from .helpers import atomic_write
+
+try:
+    import fcntl
+except ImportError:  # pragma: no cover (Windows)
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+TOKEN_FILE = "token.json"
+LOCK_FILE = "token.lock"
+# Version of the token file: older files are ignored
+TOKEN_VERSION = 2
+
+# Lifetime of a token whose expiry cannot be read, in seconds
+DEFAULT_LIFETIME = 3500
+
+# Non-standard attributes of the cookies that are saved: `Cookie` has no public
+# way to list them, only to read them by name
+COOKIE_ATTRS = ("HttpOnly", "SameSite")
+
+
+def token_expiry(token, cookies=None):
+    """Returns the expiry timestamp of an access token
+
+    Read from the `exp` claim of the token (a JWT), or else from the expiry of
+    the `access_token` cookie. Defaults to `DEFAULT_LIFETIME` from now.
+    """
+    try:
+        payload = token.split(".")[1]
+        # base64url, without the padding
+        payload += "=" * (-len(payload) % 4)
+        return float(json.loads(base64.urlsafe_b64decode(payload))["exp"])
+    except (AttributeError, IndexError, KeyError, TypeError, ValueError):
+        pass
+
+    for cookie in cookies or []:
+        if cookie.name == "access_token" and cookie.expires:
+            return float(cookie.expires)
+
+    return time.time() + DEFAULT_LIFETIME
+
+
+def dump_cookies(jar):
+    """Returns the cookies of a jar, as a list of dictionaries"""
+    return [
+        {
+            "name": cookie.name,
+            "value": cookie.value,
+            "domain": cookie.domain,
+            "path": cookie.path,
+            "expires": cookie.expires,
+            "secure": cookie.secure,
+            "rest": {
+                name: cookie.get_nonstandard_attr(name)
+                for name in COOKIE_ATTRS
+                if cookie.has_nonstandard_attr(name)
+            },
+        }
+        for cookie in jar
+    ]
+
+
+def load_cookies(cookies):
+    """Returns a `RequestsCookieJar` holding the cookies of `dump_cookies`"""
+    jar = RequestsCookieJar()
+    for data in cookies:
+        jar.set_cookie(create_cookie(**data))
+    return jar
+
+
+class TokenStore:
+    """Reads and writes the token, its user ID, expiry, and cookies"""
+
+    def __init__(self, path=TOKEN_FILE, lock_path=LOCK_FILE):
+        self.path = path
+        self.lock_path = lock_path
+
+    @classmethod
+    def in_directory(cls, directory):
+        """The store of the token files in `directory`"""
+        return cls(
+            os.path.join(directory, TOKEN_FILE), os.path.join(directory, LOCK_FILE)
+        )
+
+    @contextmanager
+    def lock(self):
+        """Exclusive lock, held while logging in (blocks until acquired)"""
+        with open(self.lock_path, "a") as fp:
+            if fcntl is not None:
+                fcntl.flock(fp, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                if fcntl is not None:
+                    fcntl.flock(fp, fcntl.LOCK_UN)
+
+    def load(self, margin=0):
+        """Returns the saved token data, or None if missing or expiring
+
+        The token must be valid for `margin` more seconds. The data is a
+        dictionary with the `token`, `user_id`, `expires` (timestamp) and
+        `cookies` keys.
+        """
+        try:
+            with open(self.path, "r") as fp:
+                data = json.load(fp)
+
+            if data.get("version") != TOKEN_VERSION:
+                return None
+
+            expires = datetime.fromisoformat(data["expires"]).timestamp()
+            if expires < time.time() + margin:
+                return None
+
+            return {
+                "token": data["token"],
+                "user_id": data["user_id"],
+                "expires": expires,
+                "cookies": load_cookies(data["cookies"]),
+            }
+        except (FileNotFoundError, KeyError, TypeError, ValueError):
+            return None
+
+    def save(self, token, user_id, expires, cookies):
+        with atomic_write(self.path) as fp:
+            data = {
+                "version": TOKEN_VERSION,
+                "token": token,
+                "user_id": user_id,
+                "expires": datetime.fromtimestamp(expires, timezone.utc).isoformat(),
+                "cookies": dump_cookies(cookies),
+            }
+            json.dump(data, fp)
+
+    def remove(self):
+        try:
+            os.unlink(self.path)
+        except FileNotFoundError:
+            pass
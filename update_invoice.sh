@@ -9,8 +9,10 @@ CUR_DIR="${BASE_DIR}/html"
 CONTAINER="report"
 RUN_DOCKER="$DOCKER_COMPOSE -f $COMPOSE_FILE run --rm $CONTAINER"
 
-# Run the container
-$RUN_DOCKER > "${CUR_DIR}/report-${CUR_MONTH}.html"
+# Run the container: the report is replaced atomically, and only on success
+# (./html is mounted as /app/html in the container, and ./data as /app/data:
+# the token, the database and the HTTP cache are kept between the runs)
+$RUN_DOCKER --output "html/report-${CUR_MONTH}.html" || exit 1
 
 rm -f ${CUR_DIR}/index.html
 ln -s report-${CUR_MONTH}.html ${CUR_DIR}/index.html